@@ -0,0 +1,278 @@
+"""
+Motor de alertas avaliado a cada leitura recebida.
+
+Cada regra verifica uma métrica (temperatura ou umidade) de um dispositivo
+(ou de todos) com um dos tipos:
+
+- ``threshold``: valor fora de [min_value, max_value]
+- ``rate``: variação por minuto entre leituras consecutivas acima de max_rate
+- ``zscore``: desvio em relação à janela móvel acima de z_limit
+
+O estado móvel fica em buffers circulares compactos por dispositivo
+(``array('d')`` com somas acumuladas), então a avaliação nunca consulta
+``sensor_data``. Somente as mudanças de estado (disparo/normalização) são
+gravadas em ``alert_events``, com histerese para evitar oscilação.
+
+O estado de cada dispositivo (``AlertState``: última leitura, buffers e
+regras disparadas) não fica no worker: é serializado e gravado por
+``DeviceAlertState`` na mesma transação das leituras. Assim todos os
+workers avaliam a sequência completa de leituras do dispositivo, e um
+rollback desfaz o estado junto com os eventos.
+"""
+
+import math
+import struct
+import threading
+import time
+from array import array
+
+RULE_KINDS = ('threshold', 'rate', 'zscore')
+RULE_METRICS = ('temperature', 'humidity')
+
+# Mínimo de amostras na janela antes de avaliar z-score
+MIN_ZSCORE_SAMPLES = 10
+# Leituras mais distantes que isso não são comparadas pela regra de taxa
+MAX_RATE_GAP_SECONDS = 3600
+
+# versão, última leitura (µs; -1 = nenhuma), temperatura, umidade, regras disparadas
+STATE_HEADER = struct.Struct('<Bqddi')
+# capacidade (0 = sem buffer) e leituras do buffer de uma métrica
+BUFFER_HEADER = struct.Struct('<II')
+STATE_VERSION = 1
+NO_READING = -1
+
+
+class RingBuffer:
+    """Janela móvel de tamanho fixo com média e desvio padrão em O(1)"""
+
+    __slots__ = ('capacity', 'values', 'index', 'count', 'total', 'total_sq')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array('d', bytes(8 * capacity))
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def append(self, value):
+        if self.count == self.capacity:
+            old = self.values[self.index]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.total_sq += value * value
+        self.index = (self.index + 1) % self.capacity
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.mean()
+        variance = max(self.total_sq / self.count - mean * mean, 0.0)
+        return math.sqrt(variance)
+
+    def recent(self):
+        """Amostras em ordem cronológica"""
+        return [self.values[(self.index - self.count + i) % self.capacity] for i in range(self.count)]
+
+    def resize(self, capacity):
+        """Mantém as amostras mais recentes em uma nova capacidade"""
+        recent = self.recent()[-capacity:]
+        self.__init__(capacity)
+        for value in recent:
+            self.append(value)
+
+
+class AlertState:
+    """Estado de alertas de um dispositivo: última leitura, buffers e regras disparadas"""
+
+    __slots__ = ('last', 'buffers', 'active')
+
+    def __init__(self, active=()):
+        # (timestamp em µs, {métrica: valor}) da última leitura avaliada
+        self.last = None
+        self.buffers = {}
+        self.active = set(active)
+
+    def buffer(self, metric, window):
+        buffer = self.buffers.get(metric)
+        if buffer is None:
+            buffer = self.buffers[metric] = RingBuffer(window)
+        elif buffer.capacity < window:
+            buffer.resize(window)
+        return buffer
+
+    def pack(self):
+        micros, values = self.last if self.last is not None else (NO_READING, {})
+        parts = [STATE_HEADER.pack(STATE_VERSION, micros, values.get('temperature', 0.0),
+                                   values.get('humidity', 0.0), len(self.active))]
+        parts.append(array('i', sorted(self.active)).tobytes())
+        for metric in RULE_METRICS:
+            buffer = self.buffers.get(metric)
+            if buffer is None:
+                parts.append(BUFFER_HEADER.pack(0, 0))
+                continue
+            recent = buffer.recent()
+            parts.append(BUFFER_HEADER.pack(buffer.capacity, len(recent)))
+            parts.append(array('d', recent).tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def unpack(cls, data):
+        version, micros, temperature, humidity, active = STATE_HEADER.unpack_from(data)
+        state = cls()
+        if version != STATE_VERSION:
+            return state
+        if micros != NO_READING:
+            state.last = (micros, {'temperature': temperature, 'humidity': humidity})
+        offset = STATE_HEADER.size
+        ids = array('i')
+        ids.frombytes(data[offset:offset + 4 * active])
+        state.active = set(ids)
+        offset += 4 * active
+        for metric in RULE_METRICS:
+            capacity, count = BUFFER_HEADER.unpack_from(data, offset)
+            offset += BUFFER_HEADER.size
+            if not capacity:
+                continue
+            values = array('d')
+            values.frombytes(data[offset:offset + 8 * count])
+            offset += 8 * count
+            buffer = state.buffers[metric] = RingBuffer(capacity)
+            for value in values:
+                buffer.append(value)
+        return state
+
+
+class AlertEngine:
+    """Avalia as regras ativas sobre cada leitura aceita pelo ingest
+
+    Só as regras ficam em cache no worker; o estado de cada dispositivo é
+    passado a ``evaluate`` pelo chamador.
+    """
+
+    def __init__(self, refresh_interval=60, default_window=60):
+        self.refresh_interval = refresh_interval
+        self.default_window = default_window
+        self._rules = []
+        self._loaded_at = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Força a recarga das regras na próxima avaliação"""
+        self._loaded_at = None
+
+    def rules_for(self, device_id, rule_loader, version=None):
+        """Regras ativas que valem para o dispositivo (recarregadas a cada ``refresh_interval``)
+
+        ``version`` é o ``rules_version`` atual do cache compartilhado:
+        quando muda, as regras são recarregadas antes do intervalo.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (self._loaded_at is None or version != self._version
+                    or now - self._loaded_at >= self.refresh_interval):
+                self._rules = list(rule_loader())
+                self._loaded_at = now
+                self._version = version
+            rules = self._rules
+        return [rule for rule in rules if rule['device_id'] is None or rule['device_id'] == device_id]
+
+    def evaluate(self, state, rules, device_id, timestamp, micros, values):
+        """Avalia uma leitura sobre ``state`` e retorna a lista de mudanças de estado
+
+        ``values`` é um dict {'temperature': ..., 'humidity': ...} e
+        ``micros`` o timestamp em µs. Leituras mais antigas que a última
+        avaliada do dispositivo (reenvios atrasados) não alteram o estado
+        móvel nem os alertas.
+        """
+        last = state.last
+        if last is not None and micros < last[0]:
+            return []
+
+        changes = []
+        windows = {}
+        for rule in rules:
+            if rule['kind'] == 'zscore':
+                metric = rule['metric']
+                windows[metric] = max(windows.get(metric, 0), rule['window'] or self.default_window)
+
+        for rule in rules:
+            value = values[rule['metric']]
+            observed, triggered, cleared = self._check(rule, state, micros, value, windows)
+            if observed is None:
+                continue
+
+            if rule['id'] not in state.active and triggered:
+                state.active.add(rule['id'])
+                changes.append(self._change(rule, device_id, 'triggered', observed, timestamp))
+            elif rule['id'] in state.active and cleared:
+                state.active.discard(rule['id'])
+                changes.append(self._change(rule, device_id, 'cleared', observed, timestamp))
+
+        # Atualizar o estado móvel só depois de avaliar a leitura
+        for metric, window in windows.items():
+            state.buffer(metric, window).append(values[metric])
+        state.last = (micros, dict(values))
+        return changes
+
+    def _check(self, rule, state, micros, value, windows):
+        """Retorna (valor observado, disparou, normalizou) para uma regra"""
+        hysteresis = rule['hysteresis'] or 0.0
+
+        if rule['kind'] == 'threshold':
+            low, high = rule['min_value'], rule['max_value']
+            triggered = (high is not None and value > high) or (low is not None and value < low)
+            cleared = ((high is None or value <= high - hysteresis)
+                       and (low is None or value >= low + hysteresis))
+            return value, triggered, cleared
+
+        if rule['kind'] == 'rate':
+            last = state.last
+            if last is None:
+                return None, False, False
+            elapsed = (micros - last[0]) / 1e6
+            if elapsed <= 0 or elapsed > MAX_RATE_GAP_SECONDS:
+                return None, False, False
+            rate = abs(value - last[1][rule['metric']]) / (elapsed / 60.0)
+            return rate, rate > rule['max_rate'], rate <= rule['max_rate'] - hysteresis
+
+        if rule['kind'] == 'zscore':
+            buffer = state.buffer(rule['metric'], windows[rule['metric']])
+            if buffer.count < MIN_ZSCORE_SAMPLES:
+                return None, False, False
+            std = buffer.std()
+            if std == 0:
+                return None, False, False
+            z = abs(value - buffer.mean()) / std
+            return z, z > rule['z_limit'], z <= rule['z_limit'] - hysteresis
+
+        return None, False, False
+
+    @staticmethod
+    def _change(rule, device_id, state, observed, timestamp):
+        return {
+            'rule_id': rule['id'],
+            'device_id': device_id,
+            'state': state,
+            'value': round(observed, 4),
+            'timestamp': timestamp,
+            'message': f"{rule['name']}: {rule['metric']} "
+                       f"{'fora do limite' if state == 'triggered' else 'normalizado'} ({observed:.2f})"
+        }
+
+
+alert_engine = AlertEngine()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao motor de alertas"""
+    alert_engine.refresh_interval = app.config.get('ALERT_RULES_REFRESH_INTERVAL', 60)
+    alert_engine.default_window = app.config.get('ALERT_DEFAULT_WINDOW', 60)
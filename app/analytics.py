@@ -0,0 +1,271 @@
+"""
+Métricas derivadas e agregações vetorizadas com NumPy.
+
+As séries chegam do banco como colunas (epoch, temperatura, umidade) e todo
+o cálculo é feito sobre arrays, sem laço por linha em Python. O agrupamento
+em intervalos (``bucket_series``) é o mesmo usado por todos os endpoints de
+séries, para que pontos de endpoints diferentes caiam nos mesmos instantes.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+# Constantes de Magnus (Alduchov & Eskridge, 1996), válidas de -40 a 50 °C
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12
+MAGNUS_ES0 = 6.112
+
+# Umidade mínima considerada (ln(0) no ponto de orvalho)
+MIN_RELATIVE_HUMIDITY = 0.1
+
+
+def columns_from_rows(rows):
+    """[(epoch, temperatura, umidade), ...] -> três arrays float64"""
+    # fromiter sobre as tuplas achatadas: np.array(rows) inspeciona cada linha
+    data = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=3 * len(rows))
+    data = data.reshape(-1, 3)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def saturation_vapor_pressure(temperature):
+    """Pressão de saturação do vapor (hPa), fórmula de Magnus"""
+    return MAGNUS_ES0 * np.exp(MAGNUS_A * temperature / (MAGNUS_B + temperature))
+
+
+def dew_point(temperature, humidity):
+    """Ponto de orvalho (°C)"""
+    rh = np.clip(humidity, MIN_RELATIVE_HUMIDITY, 100.0) / 100.0
+    gamma = np.log(rh) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+
+def heat_index(temperature, humidity):
+    """Índice de calor (°C), regressão de Rothfusz com os ajustes do NWS"""
+    t = temperature * 9.0 / 5.0 + 32.0
+    rh = np.clip(humidity, 0.0, 100.0)
+
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = (-42.379 + 2.04901523 * t + 10.14333127 * rh
+            - 0.22475541 * t * rh - 0.00683783 * t * t
+            - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+            + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+
+    # Ajustes para umidade baixa (80–112 °F) e alta (80–87 °F)
+    with np.errstate(invalid='ignore'):
+        low = (13.0 - rh) / 4.0 * np.sqrt(np.maximum(17.0 - np.abs(t - 95.0), 0.0)) / 17.0
+    full = np.where((rh < 13.0) & (t >= 80.0) & (t <= 112.0), full - low, full)
+    high = (rh - 85.0) / 10.0 * (87.0 - t) / 5.0
+    full = np.where((rh > 85.0) & (t >= 80.0) & (t <= 87.0), full + high, full)
+
+    # A regressão completa só vale quando a média simples passa de 80 °F
+    result = np.where((simple + t) / 2.0 >= 80.0, full, simple)
+    return (result - 32.0) * 5.0 / 9.0
+
+
+def psychrometrics(temperature, humidity):
+    """Todas as métricas derivadas de uma série de temperatura/umidade"""
+    saturation = saturation_vapor_pressure(temperature)
+    vapor = np.clip(humidity, 0.0, 100.0) / 100.0 * saturation
+    return {
+        'dew_point': dew_point(temperature, humidity),
+        'heat_index': heat_index(temperature, humidity),
+        # g/m³ (pressão em hPa)
+        'absolute_humidity': 216.7 * vapor / (273.15 + temperature),
+        # kPa
+        'vapor_pressure_deficit': (saturation - vapor) / 10.0
+    }
+
+
+def bucket_series(epochs, columns, bucket_seconds):
+    """Média de cada coluna por intervalo de ``bucket_seconds``
+
+    ``epochs`` deve estar em ordem crescente. Os intervalos são alinhados à
+    epoch (um bucket de 300s começa em :00, :05, ...), então séries de
+    dispositivos diferentes compartilham os mesmos instantes. Retorna
+    (início de cada intervalo, contagem, {nome: médias}); intervalos sem
+    leituras não aparecem.
+    """
+    if not len(epochs):
+        return epochs, np.empty(0, dtype=np.int64), {name: values for name, values in columns.items()}
+    keys = np.floor(epochs / bucket_seconds).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    means = {name: np.add.reduceat(values, starts) / counts for name, values in columns.items()}
+    return keys[starts].astype(np.float64) * bucket_seconds, counts, means
+
+
+def isoformat(epochs):
+    """Epoch (s) -> strings ISO 8601 em UTC, sem laço em Python"""
+    micros = np.round(epochs * 1e6).astype(np.int64).astype('datetime64[us]')
+    return np.datetime_as_string(micros, unit='s').tolist()
+
+
+def summarize(values):
+    """Média, máximo e mínimo de uma coluna (None se vazia)"""
+    if not len(values):
+        return None
+    return {
+        'avg': round(float(values.mean()), 2),
+        'max': round(float(values.max()), 2),
+        'min': round(float(values.min()), 2)
+    }
+
+
+def derived_series(rows, bucket_seconds=None, overlay=None):
+    """Série de métricas derivadas em formato colunar (pronta para gráficos)
+
+    As métricas são calculadas leitura a leitura e só depois agregadas por
+    intervalo, já que são funções não lineares de temperatura e umidade.
+    ``overlay`` são colunas extras alinhadas às linhas (ex.: suavização),
+    agregadas da mesma forma, sem resumo; NaN vira null.
+    """
+    epochs, temperature, humidity = columns_from_rows(rows)
+    columns = {'temperature': temperature, 'humidity': humidity}
+    columns.update(psychrometrics(temperature, humidity))
+    # Resumo sobre as leituras, não sobre as médias dos intervalos
+    summary = {name: summarize(values) for name, values in columns.items()}
+    if overlay:
+        columns.update(overlay)
+
+    counts = None
+    if bucket_seconds:
+        epochs, counts, columns = bucket_series(epochs, columns, bucket_seconds)
+
+    series = {'timestamps': isoformat(epochs)}
+    for name, values in columns.items():
+        series[name] = to_json_list(values) if overlay and name in overlay else np.round(values, 2).tolist()
+    if counts is not None:
+        series['counts'] = counts.tolist()
+
+    return {
+        'points': len(epochs),
+        'readings': len(rows),
+        'bucket_seconds': bucket_seconds or None,
+        'series': series,
+        'summary': summary
+    }
+
+
+# Intervalos "redondos" para a grade automática
+NICE_BUCKETS = (60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+
+def choose_bucket(seconds, max_points):
+    """Menor intervalo da lista que mantém a grade com até ``max_points`` pontos"""
+    for bucket in NICE_BUCKETS:
+        if seconds / bucket <= max_points:
+            return bucket
+    return NICE_BUCKETS[-1]
+
+
+def forward_fill(grid, max_gap):
+    """Repete o último valor em lacunas de até ``max_gap`` intervalos (por linha)"""
+    if max_gap <= 0 or not grid.size:
+        return grid
+    valid = ~np.isnan(grid)
+    positions = np.arange(grid.shape[1])
+    last_valid = np.where(valid, positions, -1)
+    np.maximum.accumulate(last_valid, axis=1, out=last_valid)
+    rows = np.arange(grid.shape[0])[:, None]
+    filled = grid[rows, np.maximum(last_valid, 0)]
+    fill = ~valid & (last_valid >= 0) & (positions - last_valid <= max_gap)
+    return np.where(fill, filled, grid)
+
+
+def resample_grid(device_index, epochs, values, devices, start, end, bucket_seconds, how='mean'):
+    """Reamostra várias séries em uma grade comum (dispositivos x intervalos)
+
+    As linhas devem vir ordenadas por dispositivo e tempo. Usa o mesmo
+    alinhamento à epoch de ``bucket_series``. Intervalos sem leituras ficam
+    NaN. Retorna (início de cada intervalo, grade de valores, grade de contagens).
+    """
+    first = int(np.floor(start / bucket_seconds))
+    last = int(np.ceil(end / bucket_seconds))
+    size = max(last - first, 0)
+    grid_epochs = (first + np.arange(size, dtype=np.float64)) * bucket_seconds
+
+    buckets = np.floor(epochs / bucket_seconds).astype(np.int64) - first
+    inside = (buckets >= 0) & (buckets < size)
+    device_index, buckets, values = device_index[inside], buckets[inside], values[inside]
+
+    flat = device_index * size + buckets
+    counts = np.bincount(flat, minlength=devices * size)
+    if how == 'last':
+        grid = np.full(devices * size, np.nan)
+        ends = np.flatnonzero(np.r_[flat[1:] != flat[:-1], True]) if len(flat) else flat
+        grid[flat[ends]] = values[ends]
+    else:
+        sums = np.bincount(flat, weights=values, minlength=devices * size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            grid = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return grid_epochs, grid.reshape(devices, size), counts.reshape(devices, size)
+
+
+def correlation(a, b, min_points=3):
+    """Correlação de Pearson nos intervalos em que as duas séries têm valor"""
+    mask = ~np.isnan(a) & ~np.isnan(b)
+    if mask.sum() < min_points:
+        return None
+    x, y = a[mask], b[mask]
+    x, y = x - x.mean(), y - y.mean()
+    denominator = np.sqrt((x * x).sum() * (y * y).sum())
+    if not denominator:
+        return None
+    return round(float((x * y).sum() / denominator), 4)
+
+
+def to_json_list(values, decimals=2):
+    """Array -> lista com None no lugar de NaN"""
+    rounded = np.round(values, decimals)
+    return np.where(np.isnan(rounded), None, rounded).tolist()
+
+
+def compare_series(rows, device_ids, metric, start, end, bucket_seconds, how='mean', max_gap=0):
+    """Séries de vários dispositivos na mesma grade, com diferenças e correlação
+
+    ``rows`` são tuplas (índice do dispositivo, epoch, valor) ordenadas por
+    dispositivo e tempo.
+    """
+    data = np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=3 * len(rows)).reshape(-1, 3)
+    grid_epochs, grid, counts = resample_grid(
+        data[:, 0].astype(np.int64), data[:, 1], data[:, 2], len(device_ids),
+        start, end, bucket_seconds, how
+    )
+    grid = forward_fill(grid, max_gap)
+
+    series = {}
+    for index, device_id in enumerate(device_ids):
+        row = grid[index]
+        series[device_id] = {
+            'values': to_json_list(row),
+            'readings': int(counts[index].sum()),
+            'gaps': int(np.isnan(row).sum()),
+            'summary': summarize(row[~np.isnan(row)])
+        }
+
+    differences = []
+    matrix = {device_id: {} for device_id in device_ids}
+    for i, first in enumerate(device_ids):
+        matrix[first][first] = 1.0 if counts[i].sum() else None
+        for j in range(i + 1, len(device_ids)):
+            second = device_ids[j]
+            difference = grid[i] - grid[j]
+            valid = difference[~np.isnan(difference)]
+            differences.append({
+                'devices': [first, second],
+                'values': to_json_list(difference),
+                'mean': round(float(valid.mean()), 2) if len(valid) else None,
+                'max_abs': round(float(np.abs(valid).max()), 2) if len(valid) else None
+            })
+            matrix[first][second] = matrix[second][first] = correlation(grid[i], grid[j])
+
+    return {
+        'metric': metric,
+        'aggregation': how,
+        'bucket_seconds': bucket_seconds,
+        'timestamps': isoformat(grid_epochs),
+        'series': series,
+        'differences': differences,
+        'correlation': matrix
+    }
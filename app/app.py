@@ -1,10 +1,39 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from markupsafe import Markup
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
-import json
-from models import db, SensorData, Device, User
+import threading
+import time
+import click
+from collections import Counter
+from models import (db, SensorData, SensorRollup, Device, DeviceDeletion, DeviceRetiredError, DeviceTrend,
+                    DeviceAlertState, User, AlertRule, AlertEvent, READ_BIND, COMPACT_STORAGE, STORAGE_LAYOUT,
+                    configure_engines, enable_wal, floor_hour, load_readings, migrate_storage, storage_layout,
+                    upgrade_schema)
+import auth
+import alerts
+import recent
+import liveness
+import shared_cache as shared_cache_module
+import backpressure
+import assets
+import scheduler as scheduler_module
+import result_cache as result_cache_module
+import journal
+import trends
+from alerts import RULE_KINDS, RULE_METRICS
+from recent import recent_window, to_micros
+from liveness import DEVICE_STATUSES, device_liveness
+from shared_cache import shared_cache
+from fragments import fragment_cache
+from result_cache import result_cache
+from journal import JournalReader, ingest_journal
+from trends import smooth_rows, trend_settings
+from scheduler import scheduler
+from backpressure import ingest_guard
+from payloads import PayloadError, decode_request
+from auth import AuthBusyError, device_keys, user_cache
 import logging
 
 # Configuração do logging
@@ -15,12 +44,122 @@ app = Flask(__name__)
 
 # Configuração do banco de dados
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "database", "sensor_data.db")}'
+database_path = os.path.join(basedir, "database", "sensor_data.db")
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
+# Engine somente leitura para as requisições GET: por padrão o mesmo arquivo
+# SQLite aberto com mode=ro (em WAL não disputa o lock do ingest); aponte
+# READ_DATABASE_URL para uma réplica ou deixe vazio para usar só o principal
+app.config['READ_DATABASE_URL'] = os.environ.get(
+    'READ_DATABASE_URL', f'sqlite:///file:{database_path}?mode=ro&uri=true')
+if app.config['READ_DATABASE_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {READ_BIND: app.config['READ_DATABASE_URL']}
+
+# Configuração de autenticação (cache de usuários e hashing de senhas)
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+
+# API keys dos dispositivos: chave própria por dispositivo (Device.api_key_hash)
+# ou, para dispositivos sem chave própria, a chave global API_KEY (opcional)
+app.config['API_KEY'] = os.environ.get('API_KEY')
+app.config['API_KEY_SECRET'] = os.environ.get('API_KEY_SECRET')
+app.config['API_KEY_REFRESH_INTERVAL'] = int(os.environ.get('API_KEY_REFRESH_INTERVAL', 300))
+
+# Motor de alertas: intervalo de recarga das regras e janela padrão do z-score
+app.config['ALERT_RULES_REFRESH_INTERVAL'] = int(os.environ.get('ALERT_RULES_REFRESH_INTERVAL', 60))
+app.config['ALERT_DEFAULT_WINDOW'] = int(os.environ.get('ALERT_DEFAULT_WINDOW', 60))
+
+# Suavização por dispositivo: meia-vida da EWMA (s), janela móvel (leituras)
+# e lacuna que reinicia o estado (s)
+app.config['TRENDS_ENABLED'] = os.environ.get('TRENDS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['TRENDS_HALFLIFE'] = max(float(os.environ.get('TRENDS_HALFLIFE', 300)), 1.0)
+app.config['TRENDS_WINDOW'] = max(int(os.environ.get('TRENDS_WINDOW', 30)), 2)
+app.config['TRENDS_RESET_GAP'] = float(os.environ.get('TRENDS_RESET_GAP', 3600))
+
+# Janela recente em memória por dispositivo (0 desativa)
+app.config['RECENT_WINDOW_HOURS'] = int(os.environ.get('RECENT_WINDOW_HOURS', 48))
+app.config['RECENT_SYNC_INTERVAL'] = float(os.environ.get('RECENT_SYNC_INTERVAL', 1.0))
+# Releitura de cada sincronização (ids confirmados fora de ordem no PostgreSQL)
+app.config['RECENT_SYNC_OVERLAP'] = float(os.environ.get('RECENT_SYNC_OVERLAP', 5.0))
+
+# Atividade dos dispositivos: stale após ~3 ciclos de envio, offline após 15 min
+app.config['DEVICE_STALE_AFTER'] = int(os.environ.get('DEVICE_STALE_AFTER', 180))
+app.config['DEVICE_OFFLINE_AFTER'] = int(os.environ.get('DEVICE_OFFLINE_AFTER', 900))
+app.config['LAST_SEEN_FLUSH_INTERVAL'] = float(os.environ.get('LAST_SEEN_FLUSH_INTERVAL', 10))
+app.config['LIVENESS_TICK_INTERVAL'] = float(os.environ.get('LIVENESS_TICK_INTERVAL', 5))
+
+# Cache compartilhado entre workers (arquivo mmap; vazio desativa)
+app.config['SHARED_CACHE_PATH'] = os.environ.get(
+    'SHARED_CACHE_PATH', os.path.join(basedir, 'database', 'hot_cache.bin'))
+app.config['SHARED_CACHE_SLOTS'] = int(os.environ.get('SHARED_CACHE_SLOTS', 4096))
+app.config['SHARED_STATS_TTL'] = float(os.environ.get('SHARED_STATS_TTL', 30))
+
+# Cache de resultados dos endpoints de estatísticas, por worker (0 desativa)
+app.config['RESULT_CACHE_TTL'] = float(os.environ.get('RESULT_CACHE_TTL', 30))
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 1024))
+
+# Journal binário das leituras aceitas, para reconstruir o banco (flask journal-replay)
+app.config['JOURNAL_ENABLED'] = os.environ.get('JOURNAL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+app.config['JOURNAL_DIR'] = os.environ.get('JOURNAL_DIR', os.path.join(basedir, 'database', 'journal'))
+app.config['JOURNAL_SEGMENT_BYTES'] = int(os.environ.get('JOURNAL_SEGMENT_MB', 64)) * 1024 * 1024
+app.config['JOURNAL_FSYNC'] = os.environ.get('JOURNAL_FSYNC', 'false').lower() in ('1', 'true', 'yes')
+
+# Controle de carga do ingest: token bucket por dispositivo (0 desativa) e
+# descarte global quando a latência média dos commits passa do limite
+app.config['INGEST_RATE_PER_DEVICE'] = float(os.environ.get('INGEST_RATE_PER_DEVICE', 0.5))
+app.config['INGEST_BURST'] = float(os.environ.get('INGEST_BURST', 20))
+app.config['INGEST_SHED_LATENCY_MS'] = float(os.environ.get('INGEST_SHED_LATENCY_MS', 200))
+app.config['INGEST_SHED_FACTOR'] = float(os.environ.get('INGEST_SHED_FACTOR', 4))
+
+# Limites dos corpos do ingest (comprimido / descomprimido) e do tamanho de lote
+app.config['INGEST_MAX_BODY_BYTES'] = int(os.environ.get('INGEST_MAX_BODY_BYTES', 256 * 1024))
+app.config['INGEST_MAX_DECODED_BYTES'] = int(os.environ.get('INGEST_MAX_DECODED_BYTES', 1024 * 1024))
+app.config['INGEST_MAX_BATCH'] = int(os.environ.get('INGEST_MAX_BATCH', 1000))
+
+# Cadência esperada dos dispositivos (SEND_INTERVAL do firmware) e menor
+# lacuna listada no relatório de completude, em segundos
+app.config['EXPECTED_CADENCE'] = int(os.environ.get('EXPECTED_CADENCE', 60))
+app.config['GAP_THRESHOLD'] = int(os.environ.get('GAP_THRESHOLD', 300))
+
+# Agendador de manutenção: roda só no worker que obtém o lock (líder)
+app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['SCHEDULER_LOCK_PATH'] = os.environ.get(
+    'SCHEDULER_LOCK_PATH', os.path.join(basedir, 'database', 'scheduler.lock'))
+# Rollups por hora: intervalo da tarefa e quanto do passado recalcular a cada rodada
+app.config['ROLLUP_INTERVAL'] = int(os.environ.get('ROLLUP_INTERVAL', 300))
+app.config['ROLLUP_LOOKBACK'] = int(os.environ.get('ROLLUP_LOOKBACK', 3600))
+# Retenção das leituras brutas em dias (0 mantém tudo; os rollups não são apagados)
+app.config['RETENTION_DAYS'] = int(os.environ.get('RETENTION_DAYS', 0))
+app.config['RETENTION_INTERVAL'] = int(os.environ.get('RETENTION_INTERVAL', 3600))
+app.config['DELETE_CHUNK_SIZE'] = int(os.environ.get('DELETE_CHUNK_SIZE', 5000))
+# Frequência com que o líder procura remoções/desativações de dispositivos pedidas
+app.config['DEVICE_DELETION_INTERVAL'] = int(os.environ.get('DEVICE_DELETION_INTERVAL', 10))
+
+# Tolerância para relógios de dispositivos adiantados (segundos)
+app.config['MAX_CLOCK_SKEW'] = int(os.environ.get('MAX_CLOCK_SKEW', 300))
+
 # Inicializar extensões
 db.init_app(app)
+with app.app_context():
+    configure_engines()
+auth.init_app(app)
+alerts.init_app(app)
+recent.init_app(app)
+liveness.init_app(app)
+shared_cache_module.init_app(app)
+backpressure.init_app(app)
+assets.init_app(app)
+scheduler_module.init_app(app)
+result_cache_module.init_app(app)
+journal.init_app(app)
+trends.init_app(app)
+
+# Consultas usadas para aquecer e sincronizar a janela recente
+RECENT_LOADERS = (SensorData.recent_rows, SensorData.max_id, SensorData.rows_after,
+                  DeviceDeletion.finished_after)
 
 # Configurar Flask-Login
 login_manager = LoginManager()
@@ -29,15 +168,42 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça login para acessar esta página.'
 login_manager.login_message_category = 'info'
 
+def _load_user_from_db(user_id):
+    """Carrega o usuário e o desanexa da sessão para guardar no cache"""
+    user = db.session.get(User, user_id)
+    if user is None or not user.is_active:
+        return None
+    db.session.expunge(user)
+    return user
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id), _load_user_from_db, shared_cache.users_version())
 
-# Criar tabelas se não existirem
-with app.app_context():
-    db.create_all()
-    # Criar usuários padrão
-    User.create_default_users()
+def init_database():
+    """Cria o schema e os usuários padrão
+
+    Executado uma única vez (flask init-db, hook on_starting do gunicorn ou
+    python app.py), nunca na importação do módulo: cada worker do gunicorn
+    importa este arquivo e não deve tocar no SQLite ao iniciar.
+    """
+    os.makedirs(os.path.join(basedir, 'database'), exist_ok=True)
+    with app.app_context():
+        layout = storage_layout()
+        if layout not in (None, STORAGE_LAYOUT):
+            raise RuntimeError(f"sensor_data está no layout {layout} e SENSOR_STORAGE={STORAGE_LAYOUT}: "
+                               f"rode 'flask migrate-storage' com os workers parados")
+        enable_wal()
+        db.create_all()
+        upgrade_schema()
+        Device.backfill_last_seen()
+        # O cache compartilhado é sempre reconstruído a partir do banco
+        shared_cache.rebuild(SensorData.latest_rows())
+        # Criar usuários padrão
+        User.create_default_users()
+        # Não herdar conexões abertas no processo master para os workers
+        for engine in db.engines.values():
+            engine.dispose()
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -49,7 +215,14 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password) and user.is_active:
+        try:
+            authenticated = bool(user and user.is_active and user.check_password(password))
+        except AuthBusyError:
+            logger.warning("Login recusado: fila de verificação de senha cheia")
+            flash('Servidor ocupado, tente novamente em alguns segundos.', 'error')
+            return render_template('login.html'), 503
+        
+        if authenticated:
             login_user(user, remember=bool(remember))
             user.last_login = datetime.utcnow()
             db.session.commit()
@@ -70,26 +243,57 @@ def logout():
     flash('Logout realizado com sucesso!', 'info')
     return redirect(url_for('login'))
 
+def _render_fragment(name, template, load_context):
+    """Fragmento HTML do cache, renderizado de novo só quando os dados mudam
+
+    A versão é lida antes de renderizar: se os dados mudarem durante a
+    renderização, o próximo acesso renderiza outra vez.
+    """
+    version = shared_cache.data_version()
+    html = fragment_cache.get(name, version, lambda: render_template(template, **load_context()))
+    return Markup(html)
+
+def _latest_by_device():
+    """{device_id: última leitura} para renderizar os cards"""
+    return {reading['device_id']: reading for reading in _latest_readings()}
+
 @app.route('/')
 @login_required
 def index():
-    """Página principal com dashboard"""
-    devices = Device.query.filter_by(is_active=True).all()
-    return render_template('index.html', devices=devices)
+    """Página principal com dashboard
+
+    Cards e estatísticas já vêm preenchidos, sem requisições extras do
+    navegador para a primeira exibição.
+    """
+    device_cards = _render_fragment('device_cards', 'partials/device_cards.html', lambda: {
+        'devices': Device.query.filter_by(is_active=True).all(),
+        'latest': _latest_by_device()
+    })
+    return render_template(
+        'index.html',
+        device_cards=device_cards,
+        active_devices=Device.query.filter_by(is_active=True).count(),
+        stats=_summary_stats()
+    )
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard com gráficos em tempo real"""
     devices = Device.query.filter_by(is_active=True).all()
-    return render_template('dashboard.html', devices=devices)
+    latest = _latest_readings()
+    current = max(latest, key=lambda reading: reading['timestamp']) if latest else None
+    return render_template('dashboard.html', devices=devices, current=current)
 
 @app.route('/devices')
 @login_required
 def devices():
     """Página de gerenciamento de dispositivos"""
-    devices = Device.query.all()
-    return render_template('devices.html', devices=devices)
+    device_list = _render_fragment('device_list', 'partials/device_list.html', lambda: {
+        'devices': Device.query.all(),
+        'latest': _latest_by_device()
+    })
+    return render_template('devices.html', device_list=device_list)
 
 @app.route('/device/<device_id>')
 @login_required
@@ -98,44 +302,275 @@ def device_detail(device_id):
     device = Device.query.filter_by(device_id=device_id).first_or_404()
     return render_template('device_detail.html', device=device)
 
+# Timestamps enviados pelo dispositivo fora desta faixa são ignorados: o
+# firmware atual envia millis() (tempo desde o boot), não um horário real
+MIN_DEVICE_TIMESTAMP = datetime(2020, 1, 1)
+# Tamanho de devices.device_id (String(50)); ids maiores são recusados no ingest
+MAX_DEVICE_ID_LENGTH = 50
+
+def _parse_device_timestamp(value):
+    """Converte o timestamp do dispositivo para datetime UTC (naive)
+
+    Aceita epoch em segundos ou milissegundos e strings ISO 8601. Retorna
+    None quando o valor não é um horário plausível, para usar o do servidor.
+    """
+    if value is None or value == '':
+        return None
+    
+    if isinstance(value, bool):
+        raise ValueError('Timestamp inválido')
+    
+    if isinstance(value, (int, float)):
+        seconds = value / 1000.0 if value > 1e11 else float(value)
+        try:
+            timestamp = datetime.utcfromtimestamp(seconds)
+        except (OverflowError, OSError, ValueError):
+            return None
+    else:
+        try:
+            timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('Timestamp inválido')
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    max_timestamp = datetime.utcnow() + timedelta(seconds=app.config['MAX_CLOCK_SKEW'])
+    if timestamp < MIN_DEVICE_TIMESTAMP or timestamp > max_timestamp:
+        return None
+    return timestamp
+
+def _parse_sequence(value):
+    """Valida o número de sequência opcional enviado pelo dispositivo"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 0x7FFFFFFF:
+        raise ValueError('Número de sequência inválido')
+    return value
+
+def _parse_reading(data, default_device_id='ESP8266_001'):
+    """Valida uma leitura decodificada; levanta ValueError com a mensagem de erro"""
+    if not isinstance(data, dict) or 'temperature' not in data or 'humidity' not in data:
+        raise ValueError('Dados inválidos')
+    
+    try:
+        temperature = float(data['temperature'])
+        humidity = float(data['humidity'])
+    except (TypeError, ValueError):
+        raise ValueError('Dados inválidos')
+    
+    device_id = data.get('device_id', default_device_id)
+    if not isinstance(device_id, str) or not device_id:
+        raise ValueError('Dados inválidos')
+    if len(device_id) > MAX_DEVICE_ID_LENGTH:
+        raise ValueError(f'device_id maior que {MAX_DEVICE_ID_LENGTH} caracteres')
+    
+    return {
+        'temperature': temperature,
+        'humidity': humidity,
+        'device_id': device_id,
+        'timestamp': _parse_device_timestamp(data.get('timestamp')),
+        'seq': _parse_sequence(data.get('seq'))
+    }
+
+def _reject_device(device_id, readings=1):
+    """Verifica API key e limite do dispositivo; retorna a resposta de erro ou None
+
+    O balde do dispositivo é cobrado por leitura (``readings``).
+    """
+    # Verificar API key sem consultar o banco (tabela de digests em memória)
+    if not device_keys.verify(device_id, request.headers.get('X-API-Key'),
+                              Device.api_key_digests, app.config['API_KEY'],
+                              shared_cache.keys_version()):
+        logger.warning(f"API key inválida para o dispositivo {device_id}")
+        return jsonify({'status': 'error', 'message': 'API key inválida'}), 401
+    
+    # Limite por dispositivo (o nginx só enxerga o IP do NAT)
+    status_code, retry_after = ingest_guard.admit(device_id, cost=readings)
+    if status_code:
+        logger.warning(f"Ingest limitado ({status_code}) para o dispositivo {device_id}")
+        response = jsonify({
+            'status': 'error',
+            'message': 'Servidor sobrecarregado' if status_code == 503 else 'Muitas requisições do dispositivo',
+            'retry_after': retry_after
+        })
+        response.headers['Retry-After'] = str(retry_after)
+        return response, status_code
+    return None
+
+def _store_readings(readings):
+    """Grava leituras já validadas em uma transação; retorna os ids (None = duplicada)
+
+    Reenvios são idempotentes: uma leitura com o mesmo ``seq`` ou o mesmo
+    ``timestamp`` de uma já gravada para o dispositivo é ignorada. Leituras
+    atrasadas (de horas já consolidadas) são somadas só aos rollups das horas
+    afetadas, na mesma transação, que também atualiza a suavização e o
+    estado dos alertas. Levanta DeviceRetiredError para dispositivos com
+    remoção ou desativação pedida.
+    """
+    # Dispositivos primeiro, sem commit: um dispositivo novo ou retirado no
+    # meio do lote não pode confirmar só parte das leituras
+    devices = list(dict.fromkeys(reading['device_id'] for reading in readings))
+    for device_id in devices:
+        if Device.get_or_create(device_id, commit=False).retired_at is not None:
+            raise DeviceRetiredError(device_id)
+    
+    record_ids = []
+    for reading in readings:
+        # Inserir ignorando duplicatas (sem SELECT prévio)
+        reading['timestamp'] = reading['timestamp'] or datetime.utcnow()
+        record_id = SensorData.insert_ignore(**reading)
+        record_ids.append(record_id)
+    
+    inserted = [
+        (reading['device_id'], reading['timestamp'], reading['temperature'], reading['humidity'], reading['seq'])
+        for reading, record_id in zip(readings, record_ids) if record_id is not None
+    ]
+    SensorRollup.merge_late([row[:4] for row in inserted])
+    DeviceTrend.apply([row[:4] for row in inserted])
+    # Alertas: estado por dispositivo na mesma transação; só mudanças viram eventos
+    changes = DeviceAlertState.evaluate([row[:4] for row in inserted])
+    for change in changes:
+        db.session.add(AlertEvent(**change))
+    commit_started = time.perf_counter()
+    db.session.commit()
+    ingest_guard.observe_commit(time.perf_counter() - commit_started)
+    # Journal só depois do commit (um lote desfeito não entra nele) e antes
+    # da resposta: uma leitura confirmada ao dispositivo pode ser recuperada
+    ingest_journal.append(inserted)
+    for change in changes:
+        logger.warning(f"Alerta {change['state']}: {change['device_id']} - {change['message']}")
+    
+    for reading, record_id in zip(readings, record_ids):
+        if record_id is not None:
+            args = (reading['device_id'], reading['timestamp'], reading['temperature'], reading['humidity'])
+            recent_window.append(record_id, *args)
+            shared_cache.update_latest(reading['device_id'], record_id, *args[1:])
+    
+    # last_seen só em memória; gravado em lote pelo monitor de atividade
+    for device_id in devices:
+        device_liveness.touch(device_id)
+    return record_ids
+
+def _decode_ingest_body():
+    """Decodifica o corpo conforme Content-Type/Content-Encoding, com limites de tamanho"""
+    return decode_request(request, app.config['INGEST_MAX_BODY_BYTES'],
+                          app.config['INGEST_MAX_DECODED_BYTES'])
+
 @app.route('/api/sensor-data', methods=['POST'])
 def receive_sensor_data():
-    """Endpoint para receber dados do ESP8266"""
+    """Endpoint para receber dados do ESP8266
+
+    Aceita JSON, MessagePack ou CBOR, opcionalmente com gzip/deflate.
+    """
     try:
-        data = request.get_json()
+        try:
+            reading = _parse_reading(_decode_ingest_body())
+        except PayloadError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), e.status_code
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
         
-        # Validar dados recebidos
-        if not data or 'temperature' not in data or 'humidity' not in data:
-            return jsonify({'status': 'error', 'message': 'Dados inválidos'}), 400
+        device_id = reading['device_id']
+        rejection = _reject_device(device_id)
+        if rejection:
+            return rejection
         
-        # Buscar ou criar dispositivo
-        device_id = data.get('device_id', 'ESP8266_001')
-        device = Device.get_or_create(device_id)
+        record_id = _store_readings([reading])[0]
         
-        # Criar novo registro
-        sensor_data = SensorData(
-            temperature=float(data['temperature']),
-            humidity=float(data['humidity']),
-            device_id=device_id,
-            timestamp=datetime.utcnow()
-        )
-        
-        db.session.add(sensor_data)
-        db.session.commit()
+        if record_id is None:
+            logger.info(f"Leitura duplicada ignorada: {device_id} seq={reading['seq']} timestamp={reading['timestamp']}")
+            return jsonify({
+                'status': 'success',
+                'message': 'Leitura já registrada',
+                'duplicate': True,
+                'id': None
+            })
         
-        logger.info(f"Dados recebidos: Temp={data['temperature']}°C, Hum={data['humidity']}%")
+        logger.info(f"Dados recebidos: Temp={reading['temperature']}°C, Hum={reading['humidity']}%")
         
         return jsonify({
             'status': 'success',
             'message': 'Dados salvos com sucesso',
-            'id': sensor_data.id
+            'id': record_id
         })
         
+    except DeviceRetiredError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 410
     except Exception as e:
         logger.error(f"Erro ao salvar dados: {str(e)}")
         db.session.rollback()
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+@app.route('/api/sensor-data/batch', methods=['POST'])
+def receive_sensor_data_batch():
+    """Recebe várias leituras de uma vez (gateways e dispositivos com buffer)
+
+    O corpo é uma lista de leituras ou ``{"device_id": ..., "readings": [...]}``;
+    cada leitura precisa de ``timestamp``. O lote é gravado em uma única
+    transação e é recusado inteiro se alguma leitura for inválida.
+    """
+    try:
+        try:
+            body = _decode_ingest_body()
+        except PayloadError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), e.status_code
+        
+        default_device_id = 'ESP8266_001'
+        if isinstance(body, dict):
+            default_device_id = body.get('device_id', default_device_id)
+            body = body.get('readings')
+        if not isinstance(body, list) or not body:
+            return jsonify({'status': 'error', 'message': 'Lote inválido'}), 400
+        if len(body) > app.config['INGEST_MAX_BATCH']:
+            return jsonify({
+                'status': 'error',
+                'message': f"Lote excede {app.config['INGEST_MAX_BATCH']} leituras"
+            }), 413
+        
+        readings = []
+        for index, item in enumerate(body):
+            try:
+                reading = _parse_reading(item, default_device_id)
+                if reading['timestamp'] is None:
+                    raise ValueError('Timestamp obrigatório em lotes')
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': f'Leitura {index}: {e}'}), 400
+            readings.append(reading)
+        
+        counts = Counter(reading['device_id'] for reading in readings)
+        admitted = []
+        for device_id in sorted(counts):
+            rejection = _reject_device(device_id, counts[device_id])
+            if rejection:
+                # Lote recusado inteiro: devolve o que já foi cobrado dos outros dispositivos
+                for admitted_id in admitted:
+                    ingest_guard.refund(admitted_id, counts[admitted_id])
+                return rejection
+            admitted.append(device_id)
+        
+        # Ordem cronológica por dispositivo, para alertas e janela recente
+        readings.sort(key=lambda reading: (reading['device_id'], reading['timestamp']))
+        record_ids = _store_readings(readings)
+        inserted = [record_id for record_id in record_ids if record_id is not None]
+        
+        logger.info(f"Lote recebido: {len(inserted)} novas, {len(record_ids) - len(inserted)} duplicadas")
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Lote salvo com sucesso',
+            'inserted': len(inserted),
+            'duplicates': len(record_ids) - len(inserted)
+        })
+        
+    except DeviceRetiredError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 410
+    except Exception as e:
+        logger.error(f"Erro ao salvar lote: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
 @app.route('/api/sensor-data', methods=['GET'])
 def get_sensor_data():
     """Retorna dados históricos do sensor"""
@@ -143,6 +578,16 @@ def get_sensor_data():
         limit = request.args.get('limit', 100, type=int)
         device_id = request.args.get('device_id')
         
+        # Consultas curtas são respondidas pela janela recente em memória
+        if limit > 0 and recent_window.ready(RECENT_LOADERS):
+            result = recent_window.latest(device_id, limit)
+            if result is not None:
+                return jsonify({
+                    'status': 'success',
+                    'data': result,
+                    'count': len(result)
+                })
+        
         query = SensorData.query
         
         if device_id:
@@ -171,68 +616,96 @@ def get_sensor_data():
         logger.error(f"Erro ao buscar dados: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+def _latest_readings():
+    """Última leitura de cada dispositivo: memória compartilhada ou, sem ela, o banco"""
+    result = shared_cache.latest_all()
+    if result is None:
+        result = [{
+            'id': record_id,
+            'temperature': temperature,
+            'humidity': humidity,
+            'device_id': device_id,
+            'timestamp': timestamp.isoformat()
+        } for record_id, device_id, timestamp, temperature, humidity in SensorData.latest_rows()]
+    return result
+
 @app.route('/api/sensor-data/latest')
 def get_latest_data():
     """Retorna o último registro de cada sensor"""
     try:
-        # Buscar último registro de cada dispositivo
-        latest_data = db.session.query(SensorData).filter(
-            SensorData.id.in_(
-                db.session.query(db.func.max(SensorData.id)).group_by(SensorData.device_id)
-            )
-        ).all()
-        
-        result = []
-        for record in latest_data:
-            result.append({
-                'id': record.id,
-                'temperature': record.temperature,
-                'humidity': record.humidity,
-                'device_id': record.device_id,
-                'timestamp': record.timestamp.isoformat()
-            })
-        
         return jsonify({
             'status': 'success',
-            'data': result
+            'data': _latest_readings()
         })
         
     except Exception as e:
         logger.error(f"Erro ao buscar dados mais recentes: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+def _format_summary(stats):
+    """Formata agregados (memória ou banco) no formato de /api/sensor-data/stats"""
+    if not stats['total_readings']:
+        empty = {'average': 0, 'maximum': 0, 'minimum': 0}
+        return {'temperature': dict(empty), 'humidity': dict(empty), 'total_readings': 0}
+    return {
+        'temperature': {
+            'average': round(stats['temperature']['avg'], 2),
+            'maximum': round(stats['temperature']['max'], 2),
+            'minimum': round(stats['temperature']['min'], 2)
+        },
+        'humidity': {
+            'average': round(stats['humidity']['avg'], 2),
+            'maximum': round(stats['humidity']['max'], 2),
+            'minimum': round(stats['humidity']['min'], 2)
+        },
+        'total_readings': stats['total_readings']
+    }
+
+def _summary_24h():
+    """Agregados das últimas 24h: janela recente em memória ou, sem ela, o banco"""
+    if recent_window.ready(RECENT_LOADERS, hours=24):
+        return recent_window.stats(None, 24)
+    
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    stats = db.session.query(
+        db.func.avg(SensorData.temperature).label('avg_temp'),
+        db.func.max(SensorData.temperature).label('max_temp'),
+        db.func.min(SensorData.temperature).label('min_temp'),
+        db.func.avg(SensorData.humidity).label('avg_humidity'),
+        db.func.max(SensorData.humidity).label('max_humidity'),
+        db.func.min(SensorData.humidity).label('min_humidity'),
+        db.func.count(SensorData.id).label('total_readings'),
+        db.func.max(SensorData.timestamp).label('last_update')
+    ).filter(SensorData.timestamp >= yesterday).first()
+    
+    if not stats.total_readings:
+        return {'total_readings': 0}
+    return {
+        'total_readings': stats.total_readings,
+        'temperature': {'avg': stats.avg_temp, 'max': stats.max_temp, 'min': stats.min_temp},
+        'humidity': {'avg': stats.avg_humidity, 'max': stats.max_humidity, 'min': stats.min_humidity},
+        'last_update': stats.last_update.isoformat()
+    }
+
+def _summary_stats():
+    """Estatísticas de 24h formatadas (usadas pela API e pela página inicial)"""
+    # Agregados compartilhados entre workers, recalculados por um só deles
+    stats = shared_cache.stats(_summary_24h)
+    if stats is None:
+        stats = _summary_24h()
+    return _format_summary(stats)
+
 @app.route('/api/sensor-data/stats')
 def get_sensor_stats():
     """Retorna estatísticas dos sensores"""
     try:
-        # Estatísticas dos últimos 24 horas
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        
-        stats = db.session.query(
-            db.func.avg(SensorData.temperature).label('avg_temp'),
-            db.func.max(SensorData.temperature).label('max_temp'),
-            db.func.min(SensorData.temperature).label('min_temp'),
-            db.func.avg(SensorData.humidity).label('avg_humidity'),
-            db.func.max(SensorData.humidity).label('max_humidity'),
-            db.func.min(SensorData.humidity).label('min_humidity'),
-            db.func.count(SensorData.id).label('total_readings')
-        ).filter(SensorData.timestamp >= yesterday).first()
-        
+        # Calculado da janela/banco, não do agregado compartilhado: este pode
+        # ser de uma versão anterior e ficaria no cache com a versão atual
+        stats = result_cache.get_or_compute('stats', (), shared_cache.data_version(),
+                                            lambda: _format_summary(_summary_24h()))
         return jsonify({
             'status': 'success',
-            'stats': {
-                'temperature': {
-                    'average': round(stats.avg_temp, 2) if stats.avg_temp else 0,
-                    'maximum': round(stats.max_temp, 2) if stats.max_temp else 0,
-                    'minimum': round(stats.min_temp, 2) if stats.min_temp else 0
-                },
-                'humidity': {
-                    'average': round(stats.avg_humidity, 2) if stats.avg_humidity else 0,
-                    'maximum': round(stats.max_humidity, 2) if stats.max_humidity else 0,
-                    'minimum': round(stats.min_humidity, 2) if stats.min_humidity else 0
-                },
-                'total_readings': stats.total_readings or 0
-            }
+            'stats': stats
         })
         
     except Exception as e:
@@ -241,9 +714,23 @@ def get_sensor_stats():
 
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
-    """Retorna lista de dispositivos"""
+    """Retorna lista de dispositivos (opcionalmente filtrada por ?status=online,stale)"""
     try:
-        devices = Device.query.all()
+        query = Device.query
+        status = request.args.get('status')
+        if status:
+            statuses = [value.strip() for value in status.split(',') if value.strip()]
+            invalid = [value for value in statuses if value not in DEVICE_STATUSES]
+            if invalid:
+                return jsonify({
+                    'status': 'error',
+                    'message': f"Status inválido: {', '.join(invalid)} (use {', '.join(DEVICE_STATUSES)})"
+                }), 400
+            condition = Device.status.in_(statuses)
+            if 'offline' in statuses:
+                condition = db.or_(condition, Device.status.is_(None))
+            query = query.filter(condition)
+        devices = query.all()
         return jsonify({
             'status': 'success',
             'data': [device.to_dict() for device in devices]
@@ -299,6 +786,116 @@ def update_device(device_id):
         db.session.rollback()
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+@app.route('/api/devices/<device_id>/api-key', methods=['POST'])
+@login_required
+def rotate_device_api_key(device_id):
+    """Gera (ou troca) a API key de um dispositivo; o valor só é exibido aqui"""
+    try:
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+        
+        api_key = device.generate_api_key()
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'API key gerada com sucesso. Guarde-a: ela não será exibida novamente',
+            'api_key': api_key
+        })
+    except Exception as e:
+        logger.error(f"Erro ao gerar API key: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/devices/<device_id>/api-key', methods=['DELETE'])
+@login_required
+def revoke_device_api_key(device_id):
+    """Remove a API key própria de um dispositivo"""
+    try:
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+        
+        device.revoke_api_key()
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'API key removida com sucesso'
+        })
+    except Exception as e:
+        logger.error(f"Erro ao remover API key: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+def _retire_device(device_id, mode):
+    """Retira o dispositivo e agenda a remoção em lotes (tarefa device-deletion)"""
+    try:
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+
+        deletion, created = DeviceDeletion.request(device, mode)
+        logger.info(f"Dispositivo {device_id} retirado ({deletion.mode}); remoção agendada")
+
+        return jsonify({
+            'status': 'success',
+            'message': 'Remoção agendada' if created else 'Remoção já em andamento',
+            'data': deletion.to_dict()
+        }), 202
+    except Exception as e:
+        logger.error(f"Erro ao retirar dispositivo: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/devices/<device_id>', methods=['DELETE'])
+@login_required
+def delete_device(device_id):
+    """Remove o dispositivo e todo o seu histórico em segundo plano
+
+    Responde 202 na hora: o ingest do dispositivo passa a ser recusado (410)
+    e o líder do agendador apaga as leituras em lotes. O progresso fica em
+    GET /api/devices/<id>/deletion.
+    """
+    return _retire_device(device_id, 'delete')
+
+@app.route('/api/devices/<device_id>/decommission', methods=['POST'])
+@login_required
+def decommission_device(device_id):
+    """Desativa o dispositivo: apaga as leituras brutas e mantém cadastro e rollups"""
+    return _retire_device(device_id, 'decommission')
+
+@app.route('/api/devices/<device_id>/deletion')
+def get_device_deletion(device_id):
+    """Progresso do último pedido de remoção/desativação do dispositivo"""
+    try:
+        deletion = DeviceDeletion.latest_for(device_id)
+        if not deletion:
+            return jsonify({'status': 'error', 'message': 'Nenhuma remoção pedida para o dispositivo'}), 404
+
+        return jsonify({
+            'status': 'success',
+            'data': deletion.to_dict()
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar remoção do dispositivo: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+def _format_device_stats(device, hours, stats):
+    """Formata agregados da janela recente no formato de Device.get_stats"""
+    if not stats['total_readings']:
+        return None
+    return {
+        'device_id': device.device_id,
+        'device_name': device.name,
+        'period_hours': hours,
+        'total_readings': stats['total_readings'],
+        'temperature': {key: round(value, 2) for key, value in stats['temperature'].items()},
+        'humidity': {key: round(value, 2) for key, value in stats['humidity'].items()},
+        'last_update': stats['last_update']
+    }
+
 @app.route('/api/devices/<device_id>/stats')
 def get_device_stats(device_id):
     """Retorna estatísticas de um dispositivo específico"""
@@ -308,7 +905,14 @@ def get_device_stats(device_id):
             return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
         
         hours = request.args.get('hours', 24, type=int)
-        stats = device.get_stats(hours)
+
+        def compute():
+            if hours > 0 and recent_window.ready(RECENT_LOADERS, hours=hours):
+                return _format_device_stats(device, hours, recent_window.stats(device_id, hours))
+            return device.get_stats(hours)
+
+        stats = result_cache.get_or_compute('device_stats', (device_id, hours),
+                                            shared_cache.device_version(device_id), compute)
         
         if not stats:
             return jsonify({
@@ -317,6 +921,8 @@ def get_device_stats(device_id):
                 'message': 'Nenhum dado encontrado para o período especificado'
             })
         
+        # O nome pode ter sido editado depois do cálculo (edição não muda a versão)
+        stats = dict(stats, device_name=device.name)
         return jsonify({
             'status': 'success',
             'data': stats
@@ -325,17 +931,541 @@ def get_device_stats(device_id):
         logger.error(f"Erro ao buscar estatísticas do dispositivo: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+# Maior intervalo aceito pelos endpoints de séries
+MAX_SERIES_DAYS = 92
+# Limites da comparação entre dispositivos
+MAX_COMPARE_DEVICES = 8
+MAX_GRID_POINTS = 2000
+# Máximo de faixas de um histograma
+MAX_HISTOGRAM_BINS = 50
+
+def _parse_time_range():
+    """Lê ?start=&end= (ISO ou epoch) ou ?hours= (padrão 24); levanta ValueError"""
+    end = request.args.get('end')
+    end = _parse_range_bound(end) if end else datetime.utcnow()
+    start = request.args.get('start')
+    if start:
+        start = _parse_range_bound(start)
+    else:
+        hours = request.args.get('hours', 24, type=float)
+        if hours <= 0:
+            raise ValueError('Parâmetro hours inválido')
+        start = end - timedelta(hours=hours)
+    if start >= end:
+        raise ValueError('Intervalo inválido: start deve ser anterior a end')
+    if end - start > timedelta(days=MAX_SERIES_DAYS):
+        raise ValueError(f'Intervalo máximo de {MAX_SERIES_DAYS} dias')
+    return start, end
+
+def _parse_range_bound(value):
+    """Converte um limite de intervalo (ISO 8601 ou epoch) para datetime UTC (naive)"""
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    if isinstance(value, float):
+        try:
+            return datetime.utcfromtimestamp(value / 1000.0 if value > 1e11 else value)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('Data inválida')
+    try:
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('Data inválida')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def _parse_bucket():
+    """Lê ?bucket= (segundos, opcional); levanta ValueError"""
+    bucket = request.args.get('bucket', 0, type=int)
+    if bucket < 0:
+        raise ValueError('Parâmetro bucket inválido')
+    return bucket
+
+@app.route('/api/devices/<device_id>/derived')
+def get_device_derived(device_id):
+    """Ponto de orvalho, índice de calor, umidade absoluta e VPD de um período
+
+    Calculados com NumPy sobre as colunas do banco; ``bucket`` (segundos)
+    agrega os pontos em intervalos. Com ``smooth=1`` a série inclui a
+    suavização (EWMA e média móvel, com inclinações por hora) para sobrepor
+    no gráfico, calculada a partir de um trecho anterior ao início.
+    """
+    # Importação tardia: NumPy só é carregado na primeira consulta
+    from analytics import derived_series
+
+    try:
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+        
+        try:
+            start, end = _parse_time_range()
+            bucket = _parse_bucket()
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        smooth = request.args.get('smooth', 'false').lower() in ('1', 'true', 'yes')
+        if smooth:
+            warmup = timedelta(seconds=trend_settings.warmup_seconds())
+            rows, overlay = smooth_rows(SensorData.series_rows(device_id, start - warmup, end),
+                                        to_micros(start) / 1e6)
+            data = derived_series(rows, bucket, overlay)
+            data['smoothing'] = trend_settings.describe()
+        else:
+            data = derived_series(SensorData.series_rows(device_id, start, end), bucket)
+        data.update({
+            'device_id': device_id,
+            'start': start.isoformat(),
+            'end': end.isoformat()
+        })
+        return jsonify({
+            'status': 'success',
+            'data': data
+        })
+    except Exception as e:
+        logger.error(f"Erro ao calcular métricas derivadas: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/devices/<device_id>/trend')
+def get_device_trend(device_id):
+    """Suavização atual do dispositivo: EWMA e média móvel, com inclinações por hora
+
+    Mantida pelo ingest a cada leitura; a resposta não lê ``sensor_data``.
+    """
+    try:
+        device = Device.query.filter_by(device_id=device_id).first()
+        if not device:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+        
+        trend = db.session.get(DeviceTrend, device_id)
+        if trend is None:
+            data = trend_settings.new_state().snapshot()
+            data.update({'device_id': device_id, 'last_timestamp': None, 'updated_at': None})
+            data.update(trend_settings.describe())
+        else:
+            data = trend.to_dict()
+        return jsonify({
+            'status': 'success',
+            'data': data
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar tendência do dispositivo: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/sensor-data/compare')
+def compare_devices():
+    """Séries de vários dispositivos na mesma grade de tempo
+
+    Parâmetros: ``devices`` (lista separada por vírgula), ``metric``
+    (temperature/humidity), ``hours`` ou ``start``/``end``, ``bucket``
+    (segundos; automático se omitido), ``agg`` (mean/last) e ``max_gap``
+    (lacunas de até N intervalos são preenchidas com o último valor).
+    """
+    from analytics import choose_bucket, compare_series
+
+    try:
+        device_ids = list(dict.fromkeys(
+            value.strip() for value in request.args.get('devices', '').split(',') if value.strip()
+        ))
+        metric = request.args.get('metric', 'temperature')
+        how = request.args.get('agg', 'mean')
+        try:
+            if not 2 <= len(device_ids) <= MAX_COMPARE_DEVICES:
+                raise ValueError(f'Informe de 2 a {MAX_COMPARE_DEVICES} dispositivos em devices')
+            if metric not in RULE_METRICS:
+                raise ValueError(f"Métrica inválida (use {', '.join(RULE_METRICS)})")
+            if how not in ('mean', 'last'):
+                raise ValueError('Agregação inválida (use mean ou last)')
+            start, end = _parse_time_range()
+            bucket = _parse_bucket()
+            max_gap = request.args.get('max_gap', 0, type=int)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        seconds = (end - start).total_seconds()
+        bucket = bucket or choose_bucket(seconds, MAX_GRID_POINTS)
+        if seconds / bucket > MAX_GRID_POINTS:
+            return jsonify({
+                'status': 'error',
+                'message': f'Intervalo muito pequeno: a grade passaria de {MAX_GRID_POINTS} pontos'
+            }), 400
+        
+        known = {device_id for (device_id,) in db.session.query(Device.device_id).filter(
+            Device.device_id.in_(device_ids))}
+        missing = [device_id for device_id in device_ids if device_id not in known]
+        if missing:
+            return jsonify({
+                'status': 'error',
+                'message': f"Dispositivo não encontrado: {', '.join(missing)}"
+            }), 404
+        
+        epoch = datetime(1970, 1, 1)
+        data = compare_series(
+            SensorData.multi_series_rows(device_ids, metric, start, end), device_ids, metric,
+            (start - epoch).total_seconds(), (end - epoch).total_seconds(), bucket, how, max_gap
+        )
+        data.update({'start': start.isoformat(), 'end': end.isoformat()})
+        return jsonify({
+            'status': 'success',
+            'data': data
+        })
+    except Exception as e:
+        logger.error(f"Erro ao comparar dispositivos: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+def _parse_histogram_edges(metric):
+    """Limites das faixas: ?edges=30,70 ou ?bins=N (&min=&max=); levanta ValueError"""
+    edges = request.args.get('edges')
+    if edges:
+        try:
+            edges = [float(value) for value in edges.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError('Parâmetro edges inválido')
+    else:
+        bins = request.args.get('bins', 10, type=int)
+        default_min, default_max = (0.0, 100.0) if metric == 'humidity' else (-10.0, 50.0)
+        low = request.args.get('min', default_min, type=float)
+        high = request.args.get('max', default_max, type=float)
+        if bins < 1 or low >= high:
+            raise ValueError('Parâmetros bins/min/max inválidos')
+        edges = [low + (high - low) * i / bins for i in range(bins + 1)]
+    if not edges or len(edges) > MAX_HISTOGRAM_BINS + 1:
+        raise ValueError(f'Informe de 1 a {MAX_HISTOGRAM_BINS + 1} limites')
+    if any(a >= b for a, b in zip(edges, edges[1:])):
+        raise ValueError('Os limites devem ser crescentes')
+    return edges
+
+@app.route('/api/sensor-data/histogram')
+def get_histogram():
+    """Histograma de temperatura ou umidade por dispositivo e período
+
+    Só as contagens por faixa saem do banco (GROUP BY sobre um CASE), então
+    a resposta tem o mesmo tamanho para qualquer volume de leituras.
+    """
+    try:
+        metric = request.args.get('metric', 'humidity')
+        device_id = request.args.get('device_id')
+        try:
+            if metric not in RULE_METRICS:
+                raise ValueError(f"Métrica inválida (use {', '.join(RULE_METRICS)})")
+            start, end = _parse_time_range()
+            edges = _parse_histogram_edges(metric)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        counts = SensorData.histogram(metric, edges, start, end, device_id)
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'metric': metric,
+                'device_id': device_id,
+                'edges': edges,
+                'counts': counts,
+                'total': sum(counts)
+            }
+        })
+    except Exception as e:
+        logger.error(f"Erro ao calcular histograma: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+def _expected_readings(start, end, cadence):
+    return max(int((end - start).total_seconds() // cadence), 0)
+
+def _completeness(received, expected):
+    return round(min(received / expected, 1.0) * 100, 1) if expected else None
+
+def _period_starts(start, end, period):
+    """Início de cada hora/dia que cruza [start, end)"""
+    step = timedelta(hours=1) if period == 'hour' else timedelta(days=1)
+    current = start.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        current = current.replace(hour=0)
+    while current < end:
+        yield current
+        current += step
+
+@app.route('/api/reports/completeness')
+def completeness_report():
+    """Leituras esperadas x recebidas e lacunas por dispositivo
+
+    Contagens e lacunas (LAG por dispositivo) são calculadas no banco: as
+    contagens das horas consolidadas vêm dos rollups, e as lacunas só leem
+    as leituras brutas das horas com um intervalo interno acima do limite
+    (mais o início parcial e as horas abertas). Sem ``device_id`` retorna o
+    resumo de todos os dispositivos, do menos para o mais completo; com
+    ``device_id`` inclui o detalhamento por hora ou dia (``period``).
+    """
+    try:
+        device_id = request.args.get('device_id')
+        period = request.args.get('period', 'day')
+        cadence = request.args.get('cadence', app.config['EXPECTED_CADENCE'], type=int)
+        min_gap = request.args.get('min_gap', app.config['GAP_THRESHOLD'], type=int)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        try:
+            if period not in ('hour', 'day'):
+                raise ValueError('Período inválido (use hour ou day)')
+            if cadence <= 0 or min_gap <= 0:
+                raise ValueError('Parâmetros cadence/min_gap inválidos')
+            start, end = _parse_time_range()
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        now = datetime.utcnow()
+        end = min(end, now)
+        query = Device.query
+        if device_id:
+            query = query.filter_by(device_id=device_id)
+        devices = query.all()
+        if device_id and not devices:
+            return jsonify({'status': 'error', 'message': 'Dispositivo não encontrado'}), 404
+        
+        received = SensorData.counts_by_device(start, end, device_id)
+        longest_gaps, gap_stats = SensorData.gaps(start, end, min_gap, device_id, limit)
+        gaps = [{
+            'device_id': gap_device,
+            'start': gap_start.isoformat(),
+            'end': gap_end.isoformat(),
+            'seconds': round(seconds)
+        } for gap_device, gap_start, gap_end, seconds in longest_gaps]
+        
+        def device_start(device, first):
+            # Não cobrar leituras de antes do dispositivo existir (dados
+            # importados podem ser anteriores ao cadastro)
+            begin = min(filter(None, (device.created_at, first)), default=start)
+            return max(start, begin)
+        
+        summary = []
+        for device in devices:
+            count, first, last = received.get(device.device_id, (0, None, None))
+            begin = device_start(device, first)
+            expected = _expected_readings(begin, end, cadence)
+            gap_count, longest = gap_stats.get(device.device_id, (0, None))
+            # Lacuna em aberto: dispositivo silencioso até agora
+            silent = None
+            last_seen = max(filter(None, (device.last_seen, last, begin)))
+            if (end - last_seen).total_seconds() > min_gap:
+                silent = round((end - last_seen).total_seconds())
+            summary.append({
+                'device_id': device.device_id,
+                'expected': expected,
+                'received': count,
+                'completeness': _completeness(count, expected),
+                'gaps': gap_count,
+                'longest_gap': round(longest) if longest else None,
+                'silent_for': silent
+            })
+        summary.sort(key=lambda item: (item['completeness'] is None, item['completeness'] or 0))
+        
+        data = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'cadence': cadence,
+            'min_gap': min_gap,
+            'devices': summary,
+            'gaps': gaps
+        }
+        
+        if device_id:
+            counts = {bucket: count for _, bucket, count in
+                      SensorData.counts_by_period(period, start, end, device_id)}
+            begin = device_start(devices[0], received.get(device_id, (0, None, None))[1])
+            step = timedelta(hours=1) if period == 'hour' else timedelta(days=1)
+            periods = []
+            for period_start in _period_starts(start, end, period):
+                expected = _expected_readings(max(period_start, begin),
+                                              min(period_start + step, end), cadence)
+                count = counts.get(period_start.strftime('%Y-%m-%dT%H:00:00'), 0)
+                periods.append({
+                    'start': period_start.isoformat(),
+                    'expected': expected,
+                    'received': count,
+                    'completeness': _completeness(count, expected)
+                })
+            data['period'] = period
+            data['periods'] = periods
+        
+        return jsonify({
+            'status': 'success',
+            'data': data
+        })
+    except Exception as e:
+        logger.error(f"Erro ao gerar relatório de completude: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+def _apply_alert_rule(rule, data):
+    """Valida e aplica os campos de uma regra de alerta; retorna mensagem de erro ou None"""
+    for field in ('name', 'metric', 'kind', 'is_active'):
+        if field in data:
+            setattr(rule, field, data[field])
+    if 'device_id' in data:
+        # Vazio = regra vale para todos os dispositivos
+        rule.device_id = data['device_id'] or None
+    try:
+        for field in ('min_value', 'max_value', 'max_rate', 'z_limit', 'hysteresis'):
+            if field in data:
+                setattr(rule, field, None if data[field] is None else float(data[field]))
+        if 'window' in data:
+            rule.window = None if data['window'] is None else int(data['window'])
+    except (TypeError, ValueError):
+        return 'Parâmetros numéricos inválidos'
+    
+    if not rule.name:
+        return 'Nome da regra é obrigatório'
+    if rule.metric not in RULE_METRICS:
+        return f"Métrica inválida (use {', '.join(RULE_METRICS)})"
+    if rule.kind not in RULE_KINDS:
+        return f"Tipo inválido (use {', '.join(RULE_KINDS)})"
+    if rule.kind == 'threshold' and rule.min_value is None and rule.max_value is None:
+        return 'Regra threshold exige min_value e/ou max_value'
+    if rule.kind == 'rate' and not rule.max_rate:
+        return 'Regra rate exige max_rate'
+    if rule.kind == 'zscore' and not rule.z_limit:
+        return 'Regra zscore exige z_limit'
+    if rule.window is not None and not 2 <= rule.window <= 10000:
+        return 'Janela deve ter entre 2 e 10000 leituras'
+    if rule.device_id and not Device.query.filter_by(device_id=rule.device_id).first():
+        return 'Dispositivo não encontrado'
+    return None
+
+@app.route('/api/alerts/rules', methods=['GET'])
+def get_alert_rules():
+    """Retorna as regras de alerta"""
+    try:
+        rules = AlertRule.query.order_by(AlertRule.id).all()
+        return jsonify({
+            'status': 'success',
+            'data': [rule.to_dict() for rule in rules]
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar regras de alerta: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/alerts/rules', methods=['POST'])
+@login_required
+def create_alert_rule():
+    """Cria uma regra de alerta"""
+    try:
+        rule = AlertRule(hysteresis=0.0, is_active=True)
+        error = _apply_alert_rule(rule, request.get_json() or {})
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
+        
+        db.session.add(rule)
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Regra criada com sucesso',
+            'data': rule.to_dict()
+        }), 201
+    except Exception as e:
+        logger.error(f"Erro ao criar regra de alerta: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/alerts/rules/<int:rule_id>', methods=['PUT'])
+@login_required
+def update_alert_rule(rule_id):
+    """Atualiza uma regra de alerta"""
+    try:
+        rule = db.session.get(AlertRule, rule_id)
+        if not rule:
+            return jsonify({'status': 'error', 'message': 'Regra não encontrada'}), 404
+        
+        error = _apply_alert_rule(rule, request.get_json() or {})
+        if error:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': error}), 400
+        
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Regra atualizada com sucesso',
+            'data': rule.to_dict()
+        })
+    except Exception as e:
+        logger.error(f"Erro ao atualizar regra de alerta: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/alerts/rules/<int:rule_id>', methods=['DELETE'])
+@login_required
+def delete_alert_rule(rule_id):
+    """Remove uma regra de alerta e seu histórico de eventos"""
+    try:
+        rule = db.session.get(AlertRule, rule_id)
+        if not rule:
+            return jsonify({'status': 'error', 'message': 'Regra não encontrada'}), 404
+        
+        AlertEvent.query.filter_by(rule_id=rule_id).delete()
+        db.session.delete(rule)
+        db.session.commit()
+        
+        return jsonify({
+            'status': 'success',
+            'message': 'Regra removida com sucesso'
+        })
+    except Exception as e:
+        logger.error(f"Erro ao remover regra de alerta: {str(e)}")
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/alerts')
+def get_alert_events():
+    """Retorna o histórico de mudanças de estado dos alertas"""
+    try:
+        limit = request.args.get('limit', 100, type=int)
+        device_id = request.args.get('device_id')
+        
+        query = AlertEvent.query
+        if device_id:
+            query = query.filter_by(device_id=device_id)
+        
+        events = query.order_by(AlertEvent.timestamp.desc()).limit(limit).all()
+        
+        return jsonify({
+            'status': 'success',
+            'data': [event.to_dict() for event in events],
+            'count': len(events)
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar alertas: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
+@app.route('/api/alerts/active')
+def get_active_alerts():
+    """Retorna os alertas atualmente disparados"""
+    try:
+        active = [event for event in AlertEvent.latest_states() if event.state == 'triggered']
+        return jsonify({
+            'status': 'success',
+            'data': [event.to_dict() for event in active],
+            'count': len(active)
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar alertas ativos: {str(e)}")
+        return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
+
 @app.route('/api/health')
 def health_check():
     """Endpoint de health check"""
     try:
         # Verificar conexão com banco
-        db.session.execute('SELECT 1')
+        db.session.execute(db.text('SELECT 1'))
         
         return jsonify({
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
-            'database': 'connected'
+            'database': 'connected',
+            'storage': STORAGE_LAYOUT,
+            'ingest': ingest_guard.snapshot(),
+            'fragments': fragment_cache.snapshot(),
+            'result_cache': result_cache.snapshot(),
+            'journal': ingest_journal.snapshot(),
+            'scheduler': scheduler.snapshot()
         })
     except Exception as e:
         return jsonify({
@@ -344,9 +1474,194 @@ def health_check():
             'error': str(e)
         }), 500
 
+# Tarefas periódicas (executadas apenas no worker líder do agendador)
+
+def _rollup_job():
+    """Consolida as leituras por hora, recalculando as últimas ROLLUP_LOOKBACK"""
+    watermark = SensorRollup.watermark()
+    if watermark is None:
+        # Primeira execução: desde a leitura mais antiga, uma hora por commit
+        watermark = SensorData.first_timestamp()
+        if watermark is None:
+            return
+    else:
+        watermark -= timedelta(seconds=app.config['ROLLUP_LOOKBACK'])
+    SensorRollup.refresh_range(watermark, datetime.utcnow())
+
+def _retention_job():
+    """Apaga leituras brutas mais velhas que RETENTION_DAYS, já consolidadas nos rollups"""
+    days = app.config['RETENTION_DAYS']
+    watermark = SensorRollup.watermark()
+    if not days or watermark is None:
+        return
+    cutoff = min(datetime.utcnow() - timedelta(days=days), floor_hour(watermark))
+    deleted = SensorData.delete_chunked(SensorData.timestamp < cutoff,
+                                        chunk_size=app.config['DELETE_CHUNK_SIZE'])
+    if deleted:
+        logger.info(f"Retenção: {deleted} leituras anteriores a {cutoff.isoformat()} apagadas")
+
+def _cache_warmup_job():
+    """Recalcula os agregados de 24h antes de vencerem, fora das requisições"""
+    shared_cache.stats(_summary_24h, max_age=app.config['SHARED_STATS_TTL'] / 2)
+
+def _liveness_job():
+    """Marca dispositivos stale/offline (verificação única entre os workers)"""
+    device_liveness.run_checks(Device)
+
+def _device_deletion_job():
+    """Executa as remoções/desativações de dispositivos pedidas, uma por vez e em lotes"""
+    for deletion in DeviceDeletion.open_requests():
+        try:
+            deletion.run(chunk_size=app.config['DELETE_CHUNK_SIZE'])
+        except Exception as e:
+            db.session.rollback()
+            deletion.fail(e)
+            logger.error(f"Erro ao remover o dispositivo {deletion.device_id}: {str(e)}")
+            continue
+        # Os outros workers descartam a janela recente na próxima sincronização
+        recent_window.forget(deletion.device_id)
+        shared_cache.remove(deletion.device_id)
+        logger.info(f"Dispositivo {deletion.device_id}: {deletion.mode} concluído, "
+                    f"{deletion.deleted_readings} leituras apagadas")
+
+scheduler.add_job('rollups', _rollup_job, app.config['ROLLUP_INTERVAL'])
+scheduler.add_job('retention', _retention_job, app.config['RETENTION_INTERVAL'] if app.config['RETENTION_DAYS'] else 0)
+if shared_cache.enabled:
+    scheduler.add_job('cache-warmup', _cache_warmup_job, app.config['SHARED_STATS_TTL'] / 2)
+scheduler.add_job('device-liveness', _liveness_job, app.config['LIVENESS_TICK_INTERVAL'], jitter=0)
+scheduler.add_job('device-deletion', _device_deletion_job, app.config['DEVICE_DELETION_INTERVAL'])
+
+def start_background_threads():
+    """Threads deste worker: flush do last_seen e agendador (custo: comparações de pid)"""
+    device_liveness.start(Device, app)
+    scheduler.start(app)
+
+@app.before_request
+def ensure_background_threads():
+    """Garante as threads de fundo neste processo"""
+    start_background_threads()
+
+def warm_caches():
+    """Aquece os caches em memória do worker em segundo plano
+
+    Chamado pelo hook post_worker_init do gunicorn, depois do fork; até
+    terminar, as consultas seguem indo ao banco normalmente. Também inicia
+    as threads de fundo, para que o agendador tenha um líder mesmo com
+    todos os workers ociosos.
+    """
+    start_background_threads()
+    def run():
+        with app.app_context():
+            try:
+                recent_window.warm(SensorData.recent_rows, SensorData.max_id)
+            except Exception as e:
+                logger.error(f"Erro ao aquecer a janela recente: {str(e)}")
+            finally:
+                db.session.remove()
+    
+    threading.Thread(target=run, name='cache-warmup', daemon=True).start()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria as tabelas e os usuários padrão"""
+    init_database()
+    click.echo('Banco de dados inicializado.')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Gera os arquivos estáticos com hash e as versões .gz"""
+    manifest = assets.build_assets(app.static_folder)
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f'{name} -> {hashed}')
+
+@app.cli.command('device-key')
+@click.argument('device_id')
+@click.option('--revoke', is_flag=True, help='Remove a API key em vez de gerar uma nova')
+def device_key_command(device_id, revoke):
+    """Gera ou remove a API key de um dispositivo"""
+    device = Device.get_or_create(device_id)
+    if revoke:
+        device.revoke_api_key()
+        db.session.commit()
+        click.echo(f'API key de {device_id} removida.')
+        return
+    
+    api_key = device.generate_api_key()
+    db.session.commit()
+    click.echo(f'API key de {device_id}: {api_key}')
+    click.echo('Configure esse valor no firmware (apiKey); ele não será exibido novamente.')
+
+@app.cli.command('migrate-storage')
+@click.option('--chunk-size', default=50000, show_default=True, help='Linhas copiadas por lote')
+@click.option('--vacuum/--no-vacuum', default=True, show_default=True,
+              help='Compacta o arquivo SQLite depois da conversão')
+def migrate_storage_command(chunk_size, vacuum):
+    """Converte sensor_data para o layout de SENSOR_STORAGE (pare os workers antes)"""
+    size_before = os.path.getsize(database_path) if os.path.exists(database_path) else None
+    started = time.perf_counter()
+    previous, copied = migrate_storage(chunk_size, progress=lambda total: click.echo(f'  {total} leituras copiadas'))
+    if previous in (None, STORAGE_LAYOUT):
+        click.echo(f'sensor_data já está no layout {STORAGE_LAYOUT}.')
+        return
+    click.echo(f'{copied} leituras convertidas de {previous} para {STORAGE_LAYOUT} '
+               f'em {time.perf_counter() - started:.1f}s')
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+        if size_before:
+            size_after = os.path.getsize(database_path)
+            click.echo(f'Arquivo: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB')
+
+@app.cli.command('journal-replay')
+@click.option('--path', default=None, help='Diretório dos segmentos (padrão: JOURNAL_DIR)')
+@click.option('--batch-size', default=100000, show_default=True, help='Linhas por executemany')
+def journal_replay_command(path, batch_size):
+    """Carrega as leituras do journal em sensor_data (pare os workers antes)
+
+    Em um banco novo (flask init-db) reconstrói todo o histórico; em um banco
+    existente só grava as leituras que faltam (ex.: perdidas em um crash).
+    """
+    reader = JournalReader(path or app.config['JOURNAL_DIR'])
+    if not reader.paths:
+        click.echo('Nenhum segmento de journal encontrado.')
+        return
+    click.echo(f'Lendo {len(reader.paths)} segmentos...')
+    started = time.perf_counter()
+    read, inserted = load_readings(
+        reader, batch_size,
+        progress=lambda read, inserted: click.echo(f'  {read} lidas, {inserted} gravadas')
+    )
+    elapsed = time.perf_counter() - started
+    rate = read / elapsed if elapsed else read
+    click.echo(f'{read} leituras lidas e {inserted} gravadas em {elapsed:.1f}s ({rate:,.0f} leituras/s)')
+    for segment, offset in reader.damaged:
+        click.echo(f'Aviso: {os.path.basename(segment)} truncado no byte {offset}')
+    click.echo('Rollups: a tarefa rollups do agendador recalcula as horas recentes '
+               '(em um banco novo, todo o histórico).')
+
+@app.cli.command('seed')
+@click.option('--devices', default=3, show_default=True, help='Número de dispositivos sintéticos')
+@click.option('--days', default=7, show_default=True, type=float, help='Dias de histórico por dispositivo')
+@click.option('--interval', default=60, show_default=True, help='Intervalo entre leituras (segundos)')
+@click.option('--prefix', default='SEED', show_default=True, help='Prefixo dos IDs de dispositivo')
+@click.option('--chunk-size', default=100000, show_default=True, help='Linhas por executemany')
+@click.option('--random-seed', default=None, type=int, help='Semente do gerador para dados reproduzíveis')
+def seed_command(devices, days, interval, prefix, chunk_size, random_seed):
+    """Gera leituras realistas em massa para testes de desempenho"""
+    # Importação tardia: NumPy só é necessário para este comando
+    from seed import seed_database
+
+    click.echo(f'Gerando {devices} dispositivos x {days} dias (1 leitura a cada {interval}s)...')
+    total, elapsed = seed_database(db, Device, devices=devices, days=days, interval=interval,
+                                   prefix=prefix, chunk_size=chunk_size,
+                                   random_seed=random_seed, echo=click.echo,
+                                   compact=COMPACT_STORAGE)
+    rate = total / elapsed if elapsed else total
+    click.echo(f'{total} leituras inseridas em {elapsed:.1f}s ({rate:,.0f} linhas/s)')
+
 if __name__ == '__main__':
-    # Criar diretório do banco se não existir
-    os.makedirs(os.path.join(basedir, 'database'), exist_ok=True)
+    # Criar diretório, tabelas e usuários padrão
+    init_database()
     
     # Executar aplicação
     app.run(host='0.0.0.0', port=5006, debug=True)
@@ -0,0 +1,132 @@
+"""
+Arquivos estáticos com hash de conteúdo no nome e versões pré-comprimidas.
+
+``flask build-assets`` copia cada ``.js``/``.css`` de ``static/`` para
+``static/dist/`` com o hash do conteúdo no nome (``js/app.3f2a1b9c0d4e.js``),
+grava ao lado a versão ``.gz`` e escreve ``dist/manifest.json``
+com o mapeamento nome original -> nome com hash.
+
+Como o nome muda sempre que o conteúdo muda, esses arquivos podem ser
+servidos com ``Cache-Control: immutable`` de um ano: o navegador não volta a
+pedi-los nem para revalidar. O nginx entrega o ``.gz`` pronto
+(``gzip_static``) em vez de comprimir a cada requisição.
+
+Nos templates, ``asset_url('js/app.js')`` resolve o nome pelo manifesto; sem
+manifesto (desenvolvimento, antes do build) cai no ``url_for('static')``
+comum. Não há versões ``.br``: a imagem padrão do nginx não tem o módulo
+``ngx_brotli`` para servi-las.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from flask import request, url_for
+
+ASSET_EXTENSIONS = ('.js', '.css')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HASH_LENGTH = 12
+
+# Um ano: arquivos com hash nunca mudam de conteúdo
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _hashed_name(path, digest):
+    root, extension = os.path.splitext(path)
+    return f'{root}.{digest[:HASH_LENGTH]}{extension}'
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as output:
+        output.write(data)
+
+
+def build_assets(static_dir):
+    """Gera ``dist/`` (arquivos com hash e .gz) e o manifesto
+
+    Retorna o manifesto. Arquivos de builds anteriores que não estão no
+    novo manifesto são removidos.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+    written = set()
+
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        if os.path.abspath(directory) == os.path.abspath(static_dir):
+            subdirectories[:] = [name for name in subdirectories if name != DIST_DIR]
+        for filename in sorted(filenames):
+            if not filename.endswith(ASSET_EXTENSIONS):
+                continue
+            source = os.path.join(directory, filename)
+            name = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as asset:
+                data = asset.read()
+
+            hashed = _hashed_name(name, hashlib.sha256(data).hexdigest())
+            target = os.path.join(dist_dir, hashed)
+            _write(target, data)
+            # mtime=0: o .gz fica idêntico entre builds do mesmo conteúdo
+            _write(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            written.update((target, target + '.gz'))
+            manifest[name] = f'{DIST_DIR}/{hashed}'
+
+    for directory, _, filenames in os.walk(dist_dir):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename != MANIFEST_NAME and path not in written:
+                os.remove(path)
+
+    _write(os.path.join(dist_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    """Resolve nomes de arquivos estáticos para os nomes com hash do build"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._manifest = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    try:
+                        with open(self.path) as manifest:
+                            self._manifest = json.load(manifest)
+                    except (OSError, TypeError, ValueError):
+                        # Sem build: usa os arquivos originais
+                        self._manifest = {}
+        return self._manifest
+
+    def reload(self):
+        with self._lock:
+            self._manifest = None
+
+    def resolve(self, filename):
+        return self._load().get(filename, filename)
+
+    def url(self, filename):
+        return url_for('static', filename=self.resolve(filename))
+
+
+asset_manifest = AssetManifest()
+
+
+def init_app(app):
+    """Registra ``asset_url`` nos templates e o cache longo dos arquivos com hash"""
+    asset_manifest.path = os.path.join(app.static_folder, DIST_DIR, MANIFEST_NAME)
+    app.jinja_env.globals['asset_url'] = asset_manifest.url
+    dist_prefix = f'{app.static_url_path}/{DIST_DIR}/'
+
+    @app.after_request
+    def cache_hashed_assets(response):
+        # Sem nginx na frente (ou no fallback dele) o Flask entrega o mesmo cabeçalho
+        if request.path.startswith(dist_prefix) and response.status_code == 200:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -0,0 +1,202 @@
+"""
+Autenticação: cache de usuários, verificação de senha com concorrência
+limitada e API keys por dispositivo.
+
+O ``load_user`` do Flask-Login roda em toda requisição autenticada (cada
+fetch dos cards e cada polling de 30s), então o usuário fica em um cache com
+TTL curto. Quando um usuário muda, o commit incrementa o ``users_version`` do
+cache compartilhado e todos os workers descartam o cache na próxima
+requisição. Já o PBKDF2 de ``check_password_hash`` é caro: as verificações
+rodam em um executor com número fixo de threads e fila limitada, para que
+uma rajada de logins não ocupe todas as threads que atendem o dashboard.
+
+As API keys dos dispositivos são verificadas contra uma tabela em memória de
+digests HMAC, carregada uma vez por worker e atualizada quando dispositivos
+mudam, sem consulta extra ao banco por leitura recebida. Mudanças feitas por
+outro worker chegam pelo contador ``keys_version`` do cache compartilhado:
+quando ele muda, a tabela é recarregada na próxima verificação.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash
+
+
+class AuthBusyError(Exception):
+    """Há verificações de senha demais em andamento"""
+
+
+class UserCache:
+    """Cache LRU de usuários com TTL limitado e invalidação explícita"""
+
+    def __init__(self, ttl=60, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, user_id, loader, version=None):
+        """Retorna o usuário do cache ou carrega com ``loader(user_id)``
+
+        ``version`` é o ``users_version`` atual do cache compartilhado:
+        quando muda, as entradas de todos os usuários são descartadas.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        user = loader(user_id)
+        if user is None or self.ttl <= 0:
+            return user
+
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        """Remove um usuário do cache (ou todos, se ``user_id`` for None)"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+class PasswordVerifier:
+    """Executa check_password_hash em um pool de threads limitado"""
+
+    def __init__(self, workers=2, max_pending=8, timeout=10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self):
+        # Criado sob demanda e recriado após fork: o gunicorn importa o app no
+        # master (preload_app) e threads não sobrevivem ao fork dos workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='password-hash')
+                    self._slots = threading.BoundedSemaphore(self.max_pending)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def verify(self, password_hash, password):
+        """Verifica a senha; levanta AuthBusyError se a fila estiver cheia"""
+        executor = self._ensure_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise AuthBusyError('Fila de verificação de senha cheia')
+
+        try:
+            future = executor.submit(check_password_hash, password_hash, password)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise AuthBusyError('Tempo esgotado aguardando verificação de senha')
+
+
+class DeviceKeyRegistry:
+    """Tabela em memória device_id -> digest HMAC-SHA256 da API key"""
+
+    def __init__(self, secret='', refresh_interval=300):
+        self.secret = secret
+        self.refresh_interval = refresh_interval
+        self._digests = {}
+        self._loaded_at = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def digest(self, api_key):
+        """Calcula o digest com chave (nunca guardamos a API key em claro)"""
+        return hmac.new(self.secret.encode(), api_key.encode(), hashlib.sha256).hexdigest()
+
+    def _stale(self, now, version):
+        return (self._loaded_at is None or now - self._loaded_at >= self.refresh_interval
+                or version != self._version)
+
+    def _ensure_loaded(self, loader, version=None):
+        # Recarga quando outro worker muda uma chave (``version``) e, sem
+        # cache compartilhado, periodicamente
+        now = time.monotonic()
+        if not self._stale(now, version):
+            return
+        with self._lock:
+            if self._stale(now, version):
+                self._digests = dict(loader())
+                self._loaded_at = now
+                self._version = version
+
+    def set(self, device_id, digest):
+        """Atualiza a entrada de um dispositivo (None remove a chave)
+
+        Chamado só depois do commit que gravou a mudança.
+        """
+        with self._lock:
+            if digest:
+                self._digests[device_id] = digest
+            else:
+                self._digests.pop(device_id, None)
+
+    def invalidate(self):
+        """Força recarga completa na próxima verificação"""
+        self._loaded_at = None
+
+    def verify(self, device_id, api_key, loader, fallback_key=None, version=None):
+        """Verifica a API key enviada por um dispositivo
+
+        Dispositivos com chave própria precisam apresentá-la. Os demais são
+        comparados com a chave global (``fallback_key``), se configurada.
+        ``version`` é o ``keys_version`` atual do cache compartilhado.
+        """
+        self._ensure_loaded(loader, version)
+        expected = self._digests.get(device_id)
+        if expected is None:
+            if not fallback_key:
+                return True
+            return hmac.compare_digest((api_key or '').encode(), fallback_key.encode())
+        if not api_key:
+            return False
+        return hmac.compare_digest(self.digest(api_key), expected)
+
+
+user_cache = UserCache()
+password_verifier = PasswordVerifier()
+device_keys = DeviceKeyRegistry()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao cache e ao executor de senhas"""
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', 60)
+    user_cache.max_size = app.config.get('USER_CACHE_SIZE', 1024)
+    password_verifier.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+    password_verifier.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 8)
+    password_verifier.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+    device_keys.secret = app.config.get('API_KEY_SECRET') or app.config['SECRET_KEY']
+    device_keys.refresh_interval = app.config.get('API_KEY_REFRESH_INTERVAL', 300)
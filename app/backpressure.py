@@ -0,0 +1,160 @@
+"""
+Controle de carga do ingest: token bucket por dispositivo e descarte global
+quando o banco fica lento.
+
+O ``limit_req`` do nginx agrupa por IP, e todos os dispositivos saem pelo
+mesmo NAT; aqui o limite é por ``device_id``, então um dispositivo em loop
+esgota só o próprio balde. Os baldes ficam no slot do dispositivo no cache
+compartilhado, então a taxa configurada vale para o dispositivo, qualquer
+que seja o worker que atende cada requisição. Sem cache compartilhado (ou
+com ele cheio) o balde fica em memória no worker, e com N workers o limite
+efetivo fica entre 1× e N× a taxa.
+
+O custo de uma requisição é o número de leituras. Um lote maior que a
+rajada só entra com o balde cheio e deixa o saldo negativo: a taxa média
+continua limitada, e um dispositivo que descarrega o buffer depois de ficar
+offline não fica bloqueado para sempre.
+
+O modo de descarte acompanha a latência dos commits do ingest por média
+móvel exponencial: acima de ``enter_latency`` as taxas de todos os baldes
+são divididas por ``factor``; o modo só termina quando a média cai abaixo de
+``exit_latency`` (histerese, para não oscilar a cada commit).
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from shared_cache import shared_cache
+
+
+class TokenBucketLimiter:
+    """Baldes de tokens por chave, com número máximo de chaves (LRU)"""
+
+    def __init__(self, rate=0.5, burst=20, max_keys=10000, shared=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.shared = shared
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens, updated_at, now, cost, rate):
+        """(saldo, reposição, espera) depois de tentar consumir ``cost`` tokens"""
+        if not updated_at:
+            tokens = float(self.burst)
+        else:
+            tokens = min(self.burst, tokens + max(now - updated_at, 0.0) * rate)
+        # Lotes maiores que a rajada exigem o balde cheio e deixam saldo negativo
+        needed = min(cost, self.burst)
+        if tokens >= needed:
+            return tokens - cost, now, 0.0
+        return tokens, now, (needed - tokens) / rate
+
+    def _update(self, key, update):
+        """Aplica ``update(saldo, reposição)`` ao balde compartilhado ou ao local"""
+        if self.shared is not None:
+            result = self.shared.update_bucket(key, update)
+            if result is not None:
+                return result
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [0.0, 0.0]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            bucket[0], bucket[1], result = update(bucket[0], bucket[1])
+            return result
+
+    def acquire(self, key, cost=1.0, slowdown=1.0):
+        """Consome ``cost`` tokens; retorna 0 se permitido ou os segundos até haver tokens
+
+        ``slowdown`` divide a taxa de reposição (modo de descarte).
+        """
+        if self.rate <= 0:
+            return 0.0
+        rate = self.rate / slowdown
+        now = time.time()
+        return self._update(key, lambda tokens, updated_at: self._take(tokens, updated_at, now, cost, rate))
+
+    def refund(self, key, cost):
+        """Devolve tokens de uma requisição que acabou não sendo aceita"""
+        if self.rate <= 0:
+            return
+        def give_back(tokens, updated_at):
+            if not updated_at:
+                return tokens, updated_at, 0.0
+            return min(self.burst, tokens + cost), updated_at, 0.0
+        self._update(key, give_back)
+
+
+class LoadShedder:
+    """Liga o modo de descarte pela latência média dos commits"""
+
+    def __init__(self, enter_latency=0.2, exit_latency=0.1, factor=4.0, alpha=0.2):
+        self.enter_latency = enter_latency
+        self.exit_latency = exit_latency
+        self.factor = factor
+        self.alpha = alpha
+        self.latency = 0.0
+        self.active = False
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Registra a duração de um commit"""
+        if self.enter_latency <= 0:
+            return
+        with self._lock:
+            self.latency += self.alpha * (seconds - self.latency)
+            if not self.active and self.latency > self.enter_latency:
+                self.active = True
+            elif self.active and self.latency < self.exit_latency:
+                self.active = False
+
+    @property
+    def slowdown(self):
+        return self.factor if self.active else 1.0
+
+
+class IngestGuard:
+    """Decide se uma leitura entra: balde do dispositivo e modo de descarte"""
+
+    def __init__(self):
+        self.limiter = TokenBucketLimiter()
+        self.shedder = LoadShedder()
+
+    def admit(self, device_id, cost=1.0):
+        """Retorna (None, None) se permitido ou (status HTTP, Retry-After em segundos)"""
+        shedding = self.shedder.active
+        wait = self.limiter.acquire(device_id, cost, self.shedder.slowdown)
+        if not wait:
+            return None, None
+        return (503 if shedding else 429), max(1, math.ceil(wait))
+
+    def refund(self, device_id, cost=1.0):
+        self.limiter.refund(device_id, cost)
+
+    def observe_commit(self, seconds):
+        self.shedder.observe(seconds)
+
+    def snapshot(self):
+        return {
+            'shedding': self.shedder.active,
+            'commit_latency_ms': round(self.shedder.latency * 1000, 2)
+        }
+
+
+ingest_guard = IngestGuard()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao controle de carga do ingest"""
+    ingest_guard.limiter.rate = app.config.get('INGEST_RATE_PER_DEVICE', 0.5)
+    ingest_guard.limiter.burst = app.config.get('INGEST_BURST', 20)
+    ingest_guard.limiter.shared = shared_cache if shared_cache.enabled else None
+    ingest_guard.shedder.enter_latency = app.config.get('INGEST_SHED_LATENCY_MS', 200) / 1000.0
+    ingest_guard.shedder.exit_latency = ingest_guard.shedder.enter_latency / 2
+    ingest_guard.shedder.factor = app.config.get('INGEST_SHED_FACTOR', 4.0)
@@ -0,0 +1,52 @@
+"""
+Cache de fragmentos HTML renderizados no servidor (cards de dispositivos).
+
+Cada fragmento guarda a última versão renderizada junto com a versão dos
+dados (``shared_cache.data_version()``) usada para gerá-lo. A versão é
+compartilhada entre os workers e muda a cada leitura nova, edição de
+dispositivo ou mudança de status, então um fragmento nunca é servido depois
+que os dados mudaram; enquanto nada muda, as páginas reaproveitam o HTML
+sem consultar o banco nem renderizar os cards de novo.
+
+Sem cache compartilhado (versão ``None``) o fragmento é sempre renderizado.
+"""
+
+import threading
+
+
+class FragmentCache:
+    """Último HTML de cada fragmento, válido enquanto a versão dos dados não muda"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name, version, render):
+        """HTML de ``name`` para ``version``; chama ``render()`` se estiver desatualizado"""
+        if version is None:
+            return render()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        html = render()
+        with self._lock:
+            current = self._entries.get(name)
+            # Não sobrescrever um fragmento de versão mais nova renderizado em paralelo
+            if current is None or current[0] < version:
+                self._entries[name] = (version, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        return {'fragments': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,49 @@
+# Configuração do Gunicorn para ESP8266 DHT22 Monitor
+#
+# A criação do schema e dos usuários padrão roda uma única vez no processo
+# master (hook on_starting), antes de qualquer worker ser criado. Assim os
+# workers sobem sem tocar no SQLite, inclusive nas reciclagens de
+# --max-requests, e não disputam o lock do banco entre si.
+#
+# Com preload_app o app é importado uma vez no master e os workers são
+# criados por fork, sem repetir as importações a cada reciclagem. Por isso
+# nada no import do app pode abrir conexões, threads ou arquivos.
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# Threads por worker (gthread): o hashing de senhas roda em um executor
+# limitado e não bloqueia as threads que atendem o dashboard
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+keepalive = 2
+max_requests = 1000
+max_requests_jitter = 100
+preload_app = True
+
+
+def on_starting(server):
+    """Inicializa o banco antes de criar os workers"""
+    from app import init_database
+
+    init_database()
+    server.log.info('Banco de dados inicializado no processo master')
+
+    # No docker-compose, static/dist é um volume compartilhado com o nginx:
+    # o build da imagem só preenche o volume quando ele é criado, então o
+    # master refaz o build a cada início para o nginx ver os arquivos atuais
+    if os.environ.get('BUILD_ASSETS_ON_START', 'false').lower() == 'true':
+        import assets
+        from app import app
+
+        manifest = assets.build_assets(app.static_folder)
+        assets.asset_manifest.reload()
+        server.log.info('%d arquivos estáticos gerados em static/dist', len(manifest))
+
+
+def post_worker_init(worker):
+    """Aquece os caches em memória do worker recém-criado"""
+    from app import warm_caches
+
+    warm_caches()
@@ -0,0 +1,182 @@
+"""
+Journal binário append-only das leituras aceitas pelo ingest (opcional).
+
+Cada worker grava os próprios segmentos em ``JOURNAL_DIR``
+(``ingest-<data>-<pid>-<n>.jnl``), sem lock entre processos. As leituras de
+uma requisição viram um único ``os.write`` feito depois do commit no banco
+e antes da resposta, então o journal só tem lotes confirmados; com
+``JOURNAL_FSYNC`` o arquivo é sincronizado a cada escrita, e uma leitura
+confirmada ao dispositivo sobrevive mesmo a uma queda de energia que leve
+as últimas transações do SQLite (WAL com synchronous=NORMAL). Uma queda
+entre o commit e a escrita deixa a leitura sem confirmação: o dispositivo
+reenvia e o reenvio é idempotente. O segmento é
+trocado ao passar de ``segment_bytes``.
+
+Formato (little-endian):
+
+* cabeçalho do segmento: ``MAGIC`` (8 bytes);
+* registro: comprimento do corpo (uint16) e CRC32 do corpo (uint32),
+  seguidos do corpo: timestamp em microssegundos desde a epoch (int64),
+  temperatura e umidade (float64), seq (int64, -1 = sem seq) e o
+  device_id em UTF-8 (resto do corpo).
+
+``JournalReader`` lê os segmentos com mmap e para no primeiro registro
+inválido de cada um (cauda incompleta deixada por um crash durante a escrita).
+"""
+
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+from recent import to_micros
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'IJNL\x00\x01\x00\x00'
+SEGMENT_PATTERN = 'ingest-*.jnl'
+RECORD_HEADER = struct.Struct('<HI')
+READING = struct.Struct('<qddq')
+NO_SEQ = -1
+MAX_DEVICE_ID_BYTES = 255
+
+
+def encode_reading(device_id, timestamp, temperature, humidity, seq=None):
+    """Registro de uma leitura (cabeçalho + corpo)
+
+    Levanta ValueError se o device_id passar de ``MAX_DEVICE_ID_BYTES`` em
+    UTF-8: cortá-lo poderia partir um caractere ou gravar o id de outro
+    dispositivo.
+    """
+    device = device_id.encode('utf-8')
+    if len(device) > MAX_DEVICE_ID_BYTES:
+        raise ValueError(f'device_id com mais de {MAX_DEVICE_ID_BYTES} bytes: {device_id[:20]}...')
+    body = READING.pack(to_micros(timestamp), temperature, humidity,
+                        NO_SEQ if seq is None else seq) + device
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+class IngestJournal:
+    """Segmentos de journal deste worker"""
+
+    def __init__(self, directory=None, segment_bytes=64 * 1024 * 1024, fsync=False, enabled=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.enabled = enabled
+        self.records = 0
+        self.segments = 0
+        self._fd = None
+        self._path = None
+        self._size = 0
+        self._pid = None
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _open_segment(self):
+        """Abre um segmento novo (chamado com o lock)"""
+        if self._fd is not None:
+            os.close(self._fd)
+        os.makedirs(self.directory, exist_ok=True)
+        self._counter += 1
+        name = f"ingest-{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}-{self._counter:04d}.jnl"
+        self._path = os.path.join(self.directory, name)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, MAGIC)
+        self._size = len(MAGIC)
+        self.segments += 1
+
+    def append(self, readings):
+        """Grava leituras (device_id, timestamp, temperatura, umidade, seq) em uma escrita"""
+        if not self.enabled or not readings:
+            return
+        data = b''.join(encode_reading(*reading) for reading in readings)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Após o fork o descritor pertence ao processo pai
+                self._pid = os.getpid()
+                self._fd = None
+                self._counter = 0
+            if self._fd is None or self._size >= self.segment_bytes:
+                self._open_segment()
+            os.write(self._fd, data)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._size += len(data)
+            self.records += len(readings)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = None
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'fsync': self.fsync,
+            'segment': os.path.basename(self._path) if self._path and self._pid == os.getpid() else None,
+            'segment_bytes': self._size if self._pid == os.getpid() else 0,
+            'records': self.records,
+            'segments': self.segments
+        }
+
+
+class JournalReader:
+    """Leituras de todos os segmentos de um diretório, em ordem de nome"""
+
+    def __init__(self, directory):
+        self.paths = sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+        self.records = 0
+        self.damaged = []
+
+    def __iter__(self):
+        for path in self.paths:
+            yield from self._read(path)
+
+    def _read(self, path):
+        """(device_id, timestamp µs, temperatura, umidade, seq) de um segmento"""
+        size = os.path.getsize(path)
+        if size <= len(MAGIC):
+            return
+        with open(path, 'rb') as segment, \
+                mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:len(MAGIC)] != MAGIC:
+                self.damaged.append((path, 0))
+                logger.warning(f"Segmento ignorado (cabeçalho inválido): {path}")
+                return
+            offset = len(MAGIC)
+            header_size, reading_size = RECORD_HEADER.size, READING.size
+            unpack_header, unpack_reading = RECORD_HEADER.unpack_from, READING.unpack_from
+            while offset < size:
+                if offset + header_size > size:
+                    break
+                length, checksum = unpack_header(buffer, offset)
+                start = offset + header_size
+                end = start + length
+                if length < reading_size or end > size or zlib.crc32(buffer[start:end]) != checksum:
+                    break
+                timestamp, temperature, humidity, seq = unpack_reading(buffer, start)
+                device_id = buffer[start + reading_size:end].decode('utf-8')
+                yield device_id, timestamp, temperature, humidity, None if seq == NO_SEQ else seq
+                self.records += 1
+                offset = end
+            if offset < size:
+                self.damaged.append((path, offset))
+                logger.warning(f"Segmento {path}: registros a partir do byte {offset} descartados "
+                               f"(escrita incompleta ou corrompida)")
+
+
+ingest_journal = IngestJournal()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao journal"""
+    ingest_journal.enabled = app.config.get('JOURNAL_ENABLED', False)
+    ingest_journal.directory = app.config.get('JOURNAL_DIR')
+    ingest_journal.segment_bytes = app.config.get('JOURNAL_SEGMENT_BYTES', 64 * 1024 * 1024)
+    ingest_journal.fsync = app.config.get('JOURNAL_FSYNC', False)
@@ -0,0 +1,246 @@
+"""
+Rastreamento de atividade dos dispositivos (online / stale / offline).
+
+O ingest só marca o dispositivo em memória (``touch``). Uma thread por
+worker grava os ``last_seen`` acumulados em um único UPDATE em lote a cada
+``flush_interval`` (em vez de um UPDATE por leitura).
+
+A verificação de prazos roda só no worker líder, como tarefa do agendador
+(``run_checks``): uma roda de temporização (timer wheel) guarda o prazo de
+cada dispositivo e, quando o prazo vence, o status muda com um UPDATE
+condicional, que só tem efeito se o ``last_seen`` no banco continuar antigo
+(outro worker pode ter recebido uma leitura mais nova). A roda é alimentada
+a partir da tabela ``devices``, nunca de ``sensor_data``: a cada ciclo com
+os dispositivos vistos dentro de ``stale_after`` (gravados por qualquer
+worker) e, periodicamente, com uma recarga completa.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEVICE_STATUSES = ('online', 'stale', 'offline')
+EPOCH = datetime(1970, 1, 1)
+
+
+class TimerWheel:
+    """Roda de temporização com slots de ``resolution`` segundos
+
+    Agendar e cancelar são O(1); cada tick visita só o slot atual. Prazos
+    além de uma volta completa permanecem no slot até a volta certa.
+    """
+
+    def __init__(self, slots=64, resolution=5.0):
+        self.slots = slots
+        self.resolution = resolution
+        self._buckets = [dict() for _ in range(slots)]
+        self._slot_of = {}
+        self._current = None
+
+    def _slot(self, deadline):
+        return int(deadline // self.resolution) % self.slots
+
+    def schedule(self, key, deadline, payload=None):
+        """Agenda (ou reagenda) ``key`` para vencer em ``deadline`` (epoch)"""
+        self.cancel(key)
+        slot = self._slot(deadline)
+        self._buckets[slot][key] = (deadline, payload)
+        self._slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self._buckets[slot].pop(key, None)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def advance(self, now):
+        """Retorna [(key, payload)] vencidos até ``now``"""
+        target = int(now // self.resolution)
+        if self._current is None:
+            self._current = target - self.slots
+        # Não precisa visitar mais de uma volta completa
+        start = max(self._current + 1, target - self.slots + 1)
+        expired = []
+        for tick in range(start, target + 1):
+            bucket = self._buckets[tick % self.slots]
+            for key, (deadline, payload) in list(bucket.items()):
+                if deadline <= now:
+                    del bucket[key]
+                    self._slot_of.pop(key, None)
+                    expired.append((key, payload))
+        self._current = target
+        return expired
+
+
+class LivenessMonitor:
+    """Coalesce os last_seen do ingest e marca dispositivos stale/offline"""
+
+    def __init__(self, stale_after=180, offline_after=900, flush_interval=10,
+                 tick_interval=5, reload_interval=300):
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.flush_interval = flush_interval
+        self.tick_interval = tick_interval
+        self.reload_interval = reload_interval
+        self._pending = {}
+        self._wheel = TimerWheel(resolution=tick_interval)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._reloaded_at = None
+
+    def touch(self, device_id, seen_at=None):
+        """Registra atividade do dispositivo (apenas em memória)"""
+        seen_at = seen_at or datetime.utcnow()
+        with self._lock:
+            previous = self._pending.get(device_id)
+            if previous is None or seen_at > previous:
+                self._pending[device_id] = seen_at
+
+    def status_for(self, last_seen, now=None):
+        """Status esperado para um last_seen"""
+        if last_seen is None:
+            return 'offline'
+        age = ((now or datetime.utcnow()) - last_seen).total_seconds()
+        if age < self.stale_after:
+            return 'online'
+        if age < self.offline_after:
+            return 'stale'
+        return 'offline'
+
+    def _schedule(self, device_id, last_seen, status):
+        epoch = (last_seen - EPOCH).total_seconds()
+        if status == 'online':
+            self._wheel.schedule(device_id, epoch + self.stale_after, 'stale')
+        elif status == 'stale':
+            self._wheel.schedule(device_id, epoch + self.offline_after, 'offline')
+        else:
+            self._wheel.cancel(device_id)
+
+    def flush(self, store):
+        """Grava os last_seen acumulados em um único UPDATE em lote"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            store.flush_last_seen(pending)
+        except Exception:
+            # Devolver para a próxima tentativa sem perder leituras mais novas
+            with self._lock:
+                for device_id, seen_at in pending.items():
+                    current = self._pending.get(device_id)
+                    if current is None or seen_at > current:
+                        self._pending[device_id] = seen_at
+            raise
+        return len(pending)
+
+    def _window(self, status, now):
+        """Intervalo [seen_after, seen_before) de last_seen para cada status"""
+        stale_cutoff = now - timedelta(seconds=self.stale_after)
+        offline_cutoff = now - timedelta(seconds=self.offline_after)
+        if status == 'online':
+            return stale_cutoff, None
+        if status == 'stale':
+            return offline_cutoff, stale_cutoff
+        return None, offline_cutoff
+
+    def _mark(self, store, device_ids, status, now):
+        seen_after, seen_before = self._window(status, now)
+        return store.mark_status(device_ids, status, seen_after, seen_before)
+
+    def reload(self, store):
+        """Reconstrói a roda a partir da tabela devices"""
+        now = datetime.utcnow()
+        self._wheel = TimerWheel(resolution=self.tick_interval)
+        corrections = {}
+        for device_id, last_seen, status in store.load_liveness():
+            expected = self.status_for(last_seen, now)
+            if expected != status:
+                corrections.setdefault(expected, []).append(device_id)
+            if last_seen is not None:
+                self._schedule(device_id, last_seen, expected)
+        for status, device_ids in corrections.items():
+            self._mark(store, device_ids, status, now)
+        self._reloaded_at = time.monotonic()
+
+    def sync(self, store, now=None):
+        """Agenda os dispositivos vistos recentemente (last_seen gravado por qualquer worker)"""
+        now = now or datetime.utcnow()
+        seen_after = now - timedelta(seconds=self.stale_after)
+        for device_id, last_seen, status in store.load_liveness(seen_after=seen_after):
+            self._schedule(device_id, last_seen, 'online')
+
+    def check(self, store, now=None):
+        """Avança a roda e aplica as transições vencidas"""
+        now = now or datetime.utcnow()
+        expired = self._wheel.advance((now - EPOCH).total_seconds())
+        transitions = {}
+        for device_id, status in expired:
+            transitions.setdefault(status, []).append(device_id)
+            if status == 'stale':
+                # Próximo prazo: offline, contado a partir do mesmo last_seen
+                last_seen = now - timedelta(seconds=self.stale_after)
+                self._schedule(device_id, last_seen, 'stale')
+        for status, device_ids in transitions.items():
+            changed = self._mark(store, device_ids, status, now)
+            if changed:
+                logger.info(f"{changed} dispositivo(s) agora {status}")
+        return transitions
+
+    def run_checks(self, store):
+        """Recarga periódica ou sincronização incremental, seguida da verificação
+
+        Tarefa do agendador: roda só no worker líder.
+        """
+        monotonic = time.monotonic()
+        if self._reloaded_at is None or monotonic - self._reloaded_at >= self.reload_interval:
+            self.reload(store)
+        else:
+            self.sync(store)
+        return self.check(store)
+
+    def _loop(self, store, app):
+        while True:
+            time.sleep(self.flush_interval)
+            with app.app_context():
+                try:
+                    self.flush(store)
+                except Exception as e:
+                    logger.error(f"Erro no monitor de atividade: {str(e)}")
+
+    def start(self, store, app):
+        """Inicia a thread de flush do worker atual (uma vez por processo)
+
+        ``store`` fornece flush_last_seen, load_liveness e mark_status (o
+        modelo Device). A sessão é descartada no teardown do app context.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Após fork, as leituras pendentes pertencem ao processo pai
+            self._pending = {}
+            self._thread = threading.Thread(target=self._loop, args=(store, app),
+                                            name='liveness', daemon=True)
+            self._thread.start()
+
+
+device_liveness = LivenessMonitor()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao monitor de atividade"""
+    device_liveness.stale_after = app.config.get('DEVICE_STALE_AFTER', 180)
+    device_liveness.offline_after = app.config.get('DEVICE_OFFLINE_AFTER', 900)
+    device_liveness.flush_interval = app.config.get('LAST_SEEN_FLUSH_INTERVAL', 10)
+    device_liveness.tick_interval = app.config.get('LIVENESS_TICK_INTERVAL', 5)
+    device_liveness._wheel = TimerWheel(resolution=device_liveness.tick_interval)
@@ -1,9 +1,69 @@
+from flask import has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy.session import Session
+from collections import Counter
+from datetime import datetime, timedelta
+import logging
+import os
+import secrets
+import time
+from werkzeug.security import generate_password_hash
 from flask_login import UserMixin
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import operators
+from auth import device_keys, password_verifier, user_cache
+from alerts import AlertState, alert_engine
+from shared_cache import shared_cache
+from recent import from_micros, to_micros
+from trends import trend_settings
 
-db = SQLAlchemy()
+# Bind do engine somente leitura (SQLALCHEMY_BINDS['replica'])
+READ_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD')
+
+# Layout físico de sensor_data: 'standard' ou 'compact'. Lido na importação
+# porque define os tipos das colunas; mudar exige ``flask migrate-storage``.
+STORAGE_LAYOUTS = ('standard', 'compact')
+STORAGE_LAYOUT = os.environ.get('SENSOR_STORAGE', 'standard').lower()
+if STORAGE_LAYOUT not in STORAGE_LAYOUTS:
+    raise ValueError(f"SENSOR_STORAGE inválido: {STORAGE_LAYOUT} (use {', '.join(STORAGE_LAYOUTS)})")
+COMPACT_STORAGE = STORAGE_LAYOUT == 'compact'
+
+
+class RoutingSession(Session):
+    """Sessão que envia os SELECTs das requisições GET/HEAD ao engine de leitura
+
+    Todo o resto (escritas, flush, requisições POST/PUT/DELETE, threads de
+    fundo e comandos CLI) usa o engine principal. Depois de um flush a sessão
+    fica no principal até o commit, para enxergar as próprias escritas.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and not self.info.get('wrote')
+                and getattr(clause, 'is_select', False)
+                and has_request_context() and request.method in READ_METHODS):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_session_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _clear_session_wrote(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+logger = logging.getLogger(__name__)
 
 class User(UserMixin, db.Model):
     """Modelo para usuários do sistema"""
@@ -27,8 +87,12 @@ class User(UserMixin, db.Model):
         self.password_hash = generate_password_hash(password)
     
     def check_password(self, password):
-        """Verifica se a senha está correta"""
-        return check_password_hash(self.password_hash, password)
+        """Verifica se a senha está correta
+
+        O hash roda no executor limitado de auth.py; levanta AuthBusyError
+        quando há verificações demais em andamento.
+        """
+        return password_verifier.verify(self.password_hash, password)
     
     def to_dict(self):
         """Converte o objeto para dicionário"""
@@ -72,6 +136,35 @@ class User(UserMixin, db.Model):
         db.session.commit()
         print("Usuários padrão criados com sucesso!")
 
+# Campos que mudam quem pode entrar e com que permissões (last_login não)
+USER_CACHE_FIELDS = ('username', 'password_hash', 'email', 'is_active', 'is_admin')
+
+def _pending_user_changes(target):
+    session = object_session(target)
+    return session.info.setdefault('users_changed', set()) if session is not None else None
+
+@event.listens_for(User, 'after_update')
+def _invalidate_cached_user(mapper, connection, target):
+    """Registra o usuário alterado ou desativado; o cache só muda após o commit"""
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in USER_CACHE_FIELDS):
+        pending = _pending_user_changes(target)
+        if pending is not None:
+            pending.add(target.id)
+
+@event.listens_for(User, 'after_delete')
+def _remove_cached_user(mapper, connection, target):
+    pending = _pending_user_changes(target)
+    if pending is not None:
+        pending.add(target.id)
+
+class DeviceRetiredError(Exception):
+    """Leitura de um dispositivo com remoção ou desativação pedida"""
+
+    def __init__(self, device_id):
+        super().__init__(f'Dispositivo {device_id} foi retirado')
+        self.device_id = device_id
+
 class Device(db.Model):
     """Modelo para dispositivos/sensores"""
     
@@ -85,13 +178,23 @@ class Device(db.Model):
     is_active = db.Column(db.Boolean, default=True, comment='Dispositivo ativo')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='Data de criação')
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment='Última atualização')
-    
-    # Relacionamento com dados do sensor
-    sensor_data = db.relationship('SensorData', backref='device', lazy=True, cascade='all, delete-orphan')
+    api_key_hash = db.Column(db.String(64), comment='Digest HMAC-SHA256 da API key do dispositivo')
+    last_seen = db.Column(db.DateTime, index=True, comment='Última leitura recebida (horário do servidor)')
+    status = db.Column(db.String(10), default='offline', index=True, comment='online, stale ou offline')
+    retired_at = db.Column(db.DateTime, comment='Retirado (remoção ou desativação pedida); ingest recusado')
     
     def __repr__(self):
         return f'<Device {self.device_id}: {self.name}>'
     
+    @property
+    def sensor_data(self):
+        """Consulta das leituras do dispositivo
+
+        Sem relationship do ORM: no layout compacto sensor_data referencia
+        devices.id, e uma consulta explícita funciona igual nos dois layouts.
+        """
+        return SensorData.query.filter(SensorData.device_id == self.device_id)
+    
     def to_dict(self):
         """Converte o objeto para dicionário"""
         return {
@@ -102,23 +205,111 @@ class Device(db.Model):
             'description': self.description,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': self.updated_at.isoformat(),
+            'has_api_key': bool(self.api_key_hash),
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'status': self.status or 'offline',
+            'retired_at': self.retired_at.isoformat() if self.retired_at else None
         }
     
+    def set_api_key(self, api_key):
+        """Define a API key do dispositivo (apenas o digest é armazenado)"""
+        self.api_key_hash = device_keys.digest(api_key) if api_key else None
+    
+    def generate_api_key(self):
+        """Gera uma nova API key e retorna o valor em claro (exibido uma única vez)"""
+        api_key = secrets.token_urlsafe(32)
+        self.set_api_key(api_key)
+        return api_key
+    
+    def revoke_api_key(self):
+        """Remove a API key própria do dispositivo"""
+        self.api_key_hash = None
+    
+    @classmethod
+    def api_key_digests(cls):
+        """Retorna {device_id: digest} dos dispositivos com API key própria"""
+        rows = db.session.query(cls.device_id, cls.api_key_hash).filter(
+            cls.api_key_hash.isnot(None)
+        ).all()
+        return {device_id: digest for device_id, digest in rows}
+    
     @classmethod
-    def get_or_create(cls, device_id, name=None):
-        """Busca ou cria um dispositivo"""
+    def get_or_create(cls, device_id, name=None, commit=True):
+        """Busca ou cria um dispositivo
+
+        Com ``commit=False`` o dispositivo novo só é enviado ao banco (flush)
+        e fica na transação do chamador, que decide o commit ou o rollback.
+        """
         device = cls.query.filter_by(device_id=device_id).first()
         if not device:
             device = cls(
                 device_id=device_id,
                 name=name or f"Dispositivo {device_id}",
-                location="Não especificado"
+                location="Não especificado",
+                last_seen=datetime.utcnow(),
+                status='online'
             )
             db.session.add(device)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
         return device
     
+    @classmethod
+    def flush_last_seen(cls, pending):
+        """Grava {device_id: last_seen} acumulados em um único executemany
+
+        Só avança o last_seen (outro worker pode ter gravado um mais novo).
+        """
+        db.session.execute(text(
+            "UPDATE devices SET last_seen = :seen, status = 'online' "
+            "WHERE device_id = :device_id AND (last_seen IS NULL OR last_seen < :seen)"
+        ), [{'device_id': device_id, 'seen': seen} for device_id, seen in pending.items()])
+        db.session.commit()
+        # Dispositivos stale/offline podem ter voltado a online
+        shared_cache.touch()
+    
+    @classmethod
+    def load_liveness(cls, seen_after=None):
+        """Retorna (device_id, last_seen, status) dos dispositivos (vistos desde ``seen_after``)"""
+        query = db.session.query(cls.device_id, cls.last_seen, cls.status)
+        if seen_after is not None:
+            query = query.filter(cls.last_seen >= seen_after)
+        return query.all()
+    
+    @classmethod
+    def mark_status(cls, device_ids, status, seen_after=None, seen_before=None):
+        """Muda o status só se o last_seen no banco estiver em [seen_after, seen_before)
+
+        A condição torna a transição segura entre workers: um dispositivo
+        que voltou a enviar dados não é marcado como stale/offline.
+        """
+        query = cls.query.filter(
+            cls.device_id.in_(device_ids),
+            db.or_(cls.status.is_(None), cls.status != status)
+        )
+        if seen_after is not None:
+            query = query.filter(cls.last_seen >= seen_after)
+        if seen_before is not None:
+            query = query.filter(db.or_(cls.last_seen.is_(None), cls.last_seen < seen_before))
+        changed = query.update({cls.status: status}, synchronize_session=False)
+        db.session.commit()
+        if changed:
+            shared_cache.touch()
+        return changed
+    
+    @classmethod
+    def backfill_last_seen(cls):
+        """Preenche last_seen de dispositivos antigos (uma busca por índice cada)"""
+        for device in cls.query.filter(cls.last_seen.is_(None)).all():
+            device.last_seen = db.session.query(db.func.max(SensorData.timestamp)).filter(
+                SensorData.device_id == device.device_id
+            ).scalar()
+        db.session.execute(text("UPDATE devices SET status = 'offline' WHERE status IS NULL"))
+        db.session.commit()
+    
     def get_latest_data(self):
         """Retorna o último dado do sensor"""
         return self.sensor_data.order_by(SensorData.timestamp.desc()).first()
@@ -156,20 +347,244 @@ class Device(db.Model):
             'last_update': records[0].timestamp.isoformat() if records else None
         }
 
+def _pending_device_keys(target):
+    session = object_session(target)
+    return session.info.setdefault('device_keys', {}) if session is not None else None
+
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_update')
+def _refresh_device_key(mapper, connection, target):
+    """Registra a mudança de API key; a tabela em memória só muda após o commit"""
+    if inspect(target).attrs.api_key_hash.history.has_changes():
+        pending = _pending_device_keys(target)
+        if pending is not None:
+            pending[target.device_id] = target.api_key_hash
+
+@event.listens_for(Device, 'after_delete')
+def _remove_device_key(mapper, connection, target):
+    pending = _pending_device_keys(target)
+    if pending is not None:
+        pending[target.device_id] = None
+
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_update')
+@event.listens_for(Device, 'after_delete')
+def _device_changed(mapper, connection, target):
+    """Marca a sessão para invalidar os cards renderizados após o commit"""
+    session = object_session(target)
+    if session is not None:
+        session.info['devices_changed'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _touch_shared_cache(session):
+    if session.info.pop('devices_changed', None):
+        shared_cache.touch()
+    keys = session.info.pop('device_keys', None)
+    if keys:
+        for device_id, digest in keys.items():
+            device_keys.set(device_id, digest)
+        # Os outros workers recarregam a tabela na próxima verificação
+        shared_cache.bump_keys_version()
+    users = session.info.pop('users_changed', None)
+    if users:
+        for user_id in users:
+            user_cache.invalidate(user_id)
+        # Os outros workers descartam o cache de usuários na próxima requisição
+        shared_cache.bump_users_version()
+    if session.info.pop('rules_changed', None):
+        alert_engine.invalidate()
+        # Os outros workers recarregam as regras na próxima leitura
+        shared_cache.bump_rules_version()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_device_changes(session):
+    session.info.pop('devices_changed', None)
+    session.info.pop('device_keys', None)
+    session.info.pop('users_changed', None)
+    session.info.pop('rules_changed', None)
+
+# ----------------------------------------------------------------------
+# Layout compacto de sensor_data
+#
+# Os tipos abaixo convertem na fronteira com o banco, então o resto do app
+# continua vendo floats, datetimes e o device_id em texto:
+#   temperatura/umidade: centésimos em SmallInteger (2 bytes em vez de 8)
+#   timestamp: microssegundos desde a epoch (inteiro em vez de texto ISO)
+#   dispositivo: devices.id (inteiro) em vez da string repetida em cada
+#   linha e em cada índice
+# ----------------------------------------------------------------------
+
+class CentiValue(db.TypeDecorator):
+    """Float com duas casas armazenado em centésimos"""
+    
+    impl = db.SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(round(value * 100))
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else value / 100
+
+
+class EpochMicros(db.TypeDecorator):
+    """datetime UTC (naive) armazenado em microssegundos desde a epoch"""
+    
+    impl = db.BigInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_micros(value)
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else from_micros(value)
+
+
+class DeviceRef(db.TypeDecorator):
+    """device_id em texto na aplicação, devices.id no banco
+
+    A conversão é feita no próprio SQL (subconsulta pela chave única de
+    devices), sem cache em Python que precise acompanhar inserções e
+    remoções de dispositivos. Só se aplica a parâmetros (comparações de
+    igualdade e IN) e às colunas do SELECT externo: junções entre tabelas e
+    INSERT ... SELECT devem usar ``SensorData.device_key()``.
+    """
+    
+    impl = db.Integer
+    cache_ok = True
+    
+    class comparator_factory(db.TypeDecorator.Comparator):
+        def operate(self, op, *other, **kwargs):
+            # IN com lista: uma única subconsulta para todos os valores
+            if op in (operators.in_op, operators.not_in_op) and isinstance(other[0], (list, tuple, set)):
+                devices = Device.__table__
+                ids = db.select(devices.c.id).where(devices.c.device_id.in_(other[0]))
+                return op(db.type_coerce(self.expr, db.Integer), ids, **kwargs)
+            return super().operate(op, *other, **kwargs)
+    
+    def bind_expression(self, bindvalue):
+        devices = Device.__table__
+        return db.select(devices.c.id).where(
+            devices.c.device_id == db.type_coerce(bindvalue, db.String)
+        ).scalar_subquery()
+    
+    def column_expression(self, column):
+        devices = Device.__table__
+        return db.select(devices.c.device_id).where(
+            devices.c.id == db.type_coerce(column, db.Integer)
+        ).scalar_subquery()
+
+
+if COMPACT_STORAGE:
+    _device_column = db.Column('device_ref', DeviceRef, db.ForeignKey('devices.id'), key='device_id',
+                               nullable=False, comment='devices.id do dispositivo')
+    _measure_type = CentiValue
+    _timestamp_type = EpochMicros
+else:
+    _device_column = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False,
+                               comment='ID do dispositivo')
+    _measure_type = db.Float
+    _timestamp_type = db.DateTime
+
+
+def storage_layout():
+    """Layout da tabela sensor_data no banco (None se ela ainda não existe)"""
+    inspector = inspect(db.engine)
+    if not inspector.has_table('sensor_data'):
+        return None
+    columns = {column['name'] for column in inspector.get_columns('sensor_data')}
+    return 'compact' if 'device_ref' in columns else 'standard'
+
+
 class SensorData(db.Model):
     """Modelo para dados do sensor DHT22"""
     
     __tablename__ = 'sensor_data'
+    # Reenvios do dispositivo (mesmo seq ou mesmo timestamp) não geram nova linha
+    __table_args__ = (
+        db.Index('ux_sensor_data_device_seq', 'device_id', 'seq', unique=True),
+        db.Index('ux_sensor_data_device_timestamp', 'device_id', 'timestamp', unique=True),
+        # Faixas de tempo de todos os dispositivos (rollups, retenção, relatórios)
+        db.Index('ix_sensor_data_timestamp', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    temperature = db.Column(db.Float, nullable=False, comment='Temperatura em Celsius')
-    humidity = db.Column(db.Float, nullable=False, comment='Umidade em porcentagem')
-    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False, comment='ID do dispositivo')
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, comment='Timestamp do registro')
+    temperature = db.Column(_measure_type, nullable=False, comment='Temperatura em Celsius')
+    humidity = db.Column(_measure_type, nullable=False, comment='Umidade em porcentagem')
+    device_id = _device_column
+    timestamp = db.Column(_timestamp_type, nullable=False, default=datetime.utcnow, comment='Timestamp do registro')
+    seq = db.Column(db.Integer, comment='Número de sequência enviado pelo dispositivo')
     
     def __repr__(self):
         return f'<SensorData {self.device_id}: {self.temperature}°C, {self.humidity}%>'
     
+    @property
+    def device(self):
+        return Device.query.filter_by(device_id=self.device_id).first()
+    
+    # Expressões SQL independentes do layout, para SQL que não passa pela
+    # conversão dos tipos (INSERT ... SELECT, funções de data, junções)
+    
+    @classmethod
+    def device_key(cls, column=None):
+        """device_id (ou ``column``, no formato gravado) em texto como expressão SQL"""
+        column = cls.device_id if column is None else column
+        if COMPACT_STORAGE:
+            return DeviceRef().column_expression(column)
+        return column
+    
+    @classmethod
+    def measure(cls, name):
+        """Temperatura/umidade em unidades reais como expressão SQL"""
+        column = getattr(cls, name)
+        if COMPACT_STORAGE:
+            return db.type_coerce(column, db.Integer) / 100.0
+        return column
+    
+    @classmethod
+    def timestamp_sql(cls):
+        """Timestamp como data/hora nativa do banco (para strftime, date_trunc...)"""
+        if not COMPACT_STORAGE:
+            return cls.timestamp
+        seconds = db.type_coerce(cls.timestamp, db.BigInteger) / 1000000
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return db.func.datetime(seconds, 'unixepoch')
+        return db.func.timezone('UTC', db.func.to_timestamp(seconds))
+    
+    @classmethod
+    def insert_ignore(cls, temperature, humidity, device_id, timestamp, seq=None):
+        """Insere uma leitura ignorando duplicatas, sem consulta prévia
+
+        Usa INSERT ... ON CONFLICT DO NOTHING sobre os índices únicos
+        (device_id, seq) e (device_id, timestamp). Retorna o id da nova linha
+        ou None quando a leitura já existia.
+        """
+        values = {
+            'temperature': temperature,
+            'humidity': humidity,
+            'device_id': device_id,
+            'timestamp': timestamp,
+            'seq': seq
+        }
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            result = db.session.execute(
+                insert(cls.__table__).values(**values).on_conflict_do_nothing()
+            )
+            return result.inserted_primary_key[0] if result.rowcount else None
+        
+        # Outros bancos: savepoint e captura da violação de unicidade
+        try:
+            with db.session.begin_nested():
+                result = db.session.execute(cls.__table__.insert().values(**values))
+            return result.inserted_primary_key[0]
+        except IntegrityError:
+            return None
+    
     def to_dict(self):
         """Converte o objeto para dicionário"""
         return {
@@ -181,6 +596,340 @@ class SensorData(db.Model):
             'timestamp': self.timestamp.isoformat()
         }
     
+    @classmethod
+    def max_id(cls):
+        """Maior id gravado (marca d'água da janela recente)"""
+        return db.session.query(db.func.max(cls.id)).scalar()
+    
+    @classmethod
+    def recent_rows(cls, since, max_id):
+        """Leituras desde ``since`` até o id ``max_id``, como tuplas compactas"""
+        return db.session.query(
+            cls.id, cls.device_id, cls.timestamp, cls.temperature, cls.humidity
+        ).filter(cls.timestamp >= since, cls.id <= max_id).order_by(cls.id).all()
+    
+    @classmethod
+    def rows_after(cls, last_id):
+        """Leituras com id maior que ``last_id`` (busca incremental pela chave primária)"""
+        return db.session.query(
+            cls.id, cls.device_id, cls.timestamp, cls.temperature, cls.humidity
+        ).filter(cls.id > last_id).order_by(cls.id).all()
+    
+    @classmethod
+    def epoch_seconds(cls):
+        """Expressão SQL do timestamp em segundos desde a epoch (float)"""
+        if COMPACT_STORAGE:
+            return db.type_coerce(cls.timestamp, db.BigInteger) / 1000000.0
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return (db.func.julianday(cls.timestamp) - 2440587.5) * 86400.0
+        return db.func.extract('epoch', cls.timestamp)
+    
+    @classmethod
+    def series_rows(cls, device_id, start, end):
+        """Colunas (epoch, temperatura, umidade) de um dispositivo, em ordem de tempo
+
+        Consulta Core, sem objetos do ORM: as tuplas vão direto para arrays NumPy.
+        """
+        return db.session.execute(
+            db.select(cls.epoch_seconds(), cls.temperature, cls.humidity).where(
+                cls.device_id == device_id,
+                cls.timestamp >= start,
+                cls.timestamp < end
+            ).order_by(cls.timestamp)
+        ).all()
+    
+    @classmethod
+    def multi_series_rows(cls, device_ids, metric, start, end):
+        """(índice do dispositivo, epoch, valor) de vários dispositivos em uma consulta
+
+        O índice (posição em ``device_ids``) é calculado no SQL, para que
+        todas as colunas sejam numéricas; ordenado por dispositivo e tempo.
+        """
+        index = db.case(*[(cls.device_id == device_id, i) for i, device_id in enumerate(device_ids)])
+        return db.session.execute(
+            db.select(index, cls.epoch_seconds(), getattr(cls, metric)).where(
+                cls.device_id.in_(device_ids),
+                cls.timestamp >= start,
+                cls.timestamp < end
+            ).order_by(index, cls.timestamp)
+        ).all()
+    
+    @classmethod
+    def histogram(cls, metric, edges, start, end, device_id=None):
+        """Contagem de leituras por faixa, calculada no banco
+
+        A faixa 0 é ``valor < edges[0]``, a faixa i é
+        ``edges[i-1] <= valor < edges[i]`` e a última é ``valor > edges[-1]``:
+        como no ``numpy.histogram``, a última faixa interna inclui o limite
+        superior (com ``edges=30,70``, 70% fica em ``30–70``). Retorna uma
+        lista com len(edges) + 1 contagens.
+        """
+        column = getattr(cls, metric)
+        bin_index = db.case(
+            *[(column < edge, index) for index, edge in enumerate(edges[:-1])],
+            (column <= edges[-1], len(edges) - 1),
+            else_=len(edges)
+        )
+        query = db.select(bin_index, db.func.count()).where(
+            cls.timestamp >= start,
+            cls.timestamp < end
+        ).group_by(bin_index)
+        if device_id:
+            query = query.where(cls.device_id == device_id)
+        counts = [0] * (len(edges) + 1)
+        for index, count in db.session.execute(query):
+            counts[index] = count
+        return counts
+    
+    @classmethod
+    def period_start(cls, period, column=None):
+        """Expressão SQL com o início da hora/dia da leitura (ou de ``column``) em 'YYYY-MM-DDTHH:00:00'"""
+        column = cls.timestamp_sql() if column is None else column
+        if db.session.get_bind().dialect.name == 'sqlite':
+            fmt = '%Y-%m-%dT%H:00:00' if period == 'hour' else '%Y-%m-%dT00:00:00'
+            return db.func.strftime(fmt, column)
+        return db.func.to_char(db.func.date_trunc(period, column), 'YYYY-MM-DD"T"HH24:00:00')
+    
+    @classmethod
+    def stored_timestamp(cls):
+        """timestamp como gravado (texto/data ou µs), para comparar com ``hour_start``"""
+        if COMPACT_STORAGE:
+            return db.type_coerce(cls.timestamp, db.BigInteger)
+        return cls.timestamp
+    
+    @classmethod
+    def micros(cls):
+        """timestamp em µs desde a epoch como expressão SQL (inteiro, sem perda)"""
+        if COMPACT_STORAGE:
+            return db.type_coerce(cls.timestamp, db.BigInteger)
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # Texto 'YYYY-MM-DD HH:MM:SS.ffffff': segundos pelo strftime, µs pelo sufixo
+            return (db.cast(db.func.strftime('%s', cls.timestamp), db.BigInteger) * 1000000
+                    + db.cast(db.func.substr(cls.timestamp, 21, 6), db.BigInteger))
+        return db.cast(db.func.extract('epoch', cls.timestamp) * 1000000, db.BigInteger)
+    
+    @classmethod
+    def hour_start(cls, hours):
+        """Início da hora ``hours`` (horas desde a epoch, expressão SQL) no formato de timestamp"""
+        if COMPACT_STORAGE:
+            return hours * 3600000000
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return db.func.strftime('%Y-%m-%d %H:00:00.000000', hours * 3600, 'unixepoch')
+        return db.func.timezone('UTC', db.func.to_timestamp(hours * 3600))
+    
+    @classmethod
+    def belongs_to(cls, devices):
+        """Condição de junção de sensor_data com a tabela devices"""
+        if COMPACT_STORAGE:
+            return db.type_coerce(cls.device_id, db.Integer) == devices.c.id
+        return cls.device_id == devices.c.device_id
+    
+    @classmethod
+    def raw_ranges(cls, start, end):
+        """Trechos de [start, end) lidos de sensor_data e as horas lidas dos rollups
+
+        Retorna ([(início, fim), ...], (início, fim) consolidado ou None): só
+        o início parcial e as horas ainda abertas varrem as leituras brutas.
+        """
+        covered = SensorRollup.consolidated_range(start, end)
+        if covered is None:
+            return [(start, end)], None
+        ranges = [(low, high) for low, high in ((start, covered[0]), (covered[1], end)) if low < high]
+        return ranges, covered
+    
+    @classmethod
+    def counts_by_period(cls, period, start, end, device_id=None):
+        """(device_id, início do período, leituras) agrupados no banco
+
+        Horas consolidadas vêm de sensor_rollups; o resto, de sensor_data.
+        """
+        ranges, covered = cls.raw_ranges(start, end)
+        counts = Counter()
+        bucket = cls.period_start(period)
+        for low, high in ranges:
+            query = db.select(cls.device_id, bucket, db.func.count()).where(
+                cls.timestamp >= low,
+                cls.timestamp < high
+            ).group_by(cls.device_id, bucket)
+            if device_id:
+                query = query.where(cls.device_id == device_id)
+            counts.update({(device, period_start): count
+                           for device, period_start, count in db.session.execute(query)})
+        if covered:
+            counts.update(SensorRollup.counts_by_period(period, *covered, device_id))
+        return [(device, period_start, count) for (device, period_start), count in counts.items()]
+    
+    @classmethod
+    def counts_by_device(cls, start, end, device_id=None):
+        """{device_id: (leituras, primeira, última)} no intervalo, agrupado no banco
+
+        As contagens das horas consolidadas vêm de sensor_rollups. Primeira e
+        última leitura são buscadas pelo índice (device_id, timestamp), uma
+        busca por dispositivo em vez de uma varredura do intervalo.
+        """
+        ranges, covered = cls.raw_ranges(start, end)
+        counts = Counter()
+        for low, high in ranges:
+            query = db.select(cls.device_id, db.func.count()).where(
+                cls.timestamp >= low,
+                cls.timestamp < high
+            ).group_by(cls.device_id)
+            if device_id:
+                query = query.where(cls.device_id == device_id)
+            counts.update(dict(db.session.execute(query).all()))
+        if covered:
+            counts.update(SensorRollup.counts_by_device(*covered, device_id))
+        
+        devices = Device.__table__
+        readings = db.select(cls.timestamp).where(
+            cls.belongs_to(devices),
+            cls.timestamp >= start,
+            cls.timestamp < end
+        )
+        query = db.select(
+            devices.c.device_id,
+            readings.order_by(cls.timestamp).limit(1).scalar_subquery(),
+            readings.order_by(cls.timestamp.desc()).limit(1).scalar_subquery()
+        )
+        if device_id:
+            query = query.where(devices.c.device_id == device_id)
+        return {device: (counts.get(device, 0), first, last)
+                for device, first, last in db.session.execute(query)
+                if first is not None or counts.get(device)}
+    
+    @classmethod
+    def _gap_intervals(cls, start, end, min_gap, device_id=None):
+        """Subconsulta (device_id, previous, timestamp, seconds) com LAG por dispositivo, em µs
+
+        Cada hora consolidada sem intervalo interno maior que ``min_gap``
+        entra como uma única linha (primeira e última leitura, dos rollups);
+        só as demais horas, o início parcial e as horas abertas são lidos de
+        sensor_data. O intervalo é medido da última leitura da linha anterior
+        até a primeira da atual.
+        """
+        ranges, covered = cls.raw_ranges(start, end)
+        micros = cls.micros()
+        parts = []
+        for low, high in ranges:
+            query = db.select(cls.device_id, micros.label('first_micros'), micros.label('last_micros')).where(
+                cls.timestamp >= low, cls.timestamp < high)
+            if device_id:
+                query = query.where(cls.device_id == device_id)
+            parts.append(query)
+        if covered:
+            devices = Device.__table__
+            may_have_gap = SensorRollup.may_have_gap(min_gap)
+            hours = db.select(SensorRollup.device_id, SensorRollup.hour_number().label('hour')).where(
+                SensorRollup.bucket_start >= covered[0],
+                SensorRollup.bucket_start < covered[1],
+                may_have_gap
+            )
+            if device_id:
+                hours = hours.where(SensorRollup.device_id == device_id)
+            hours = hours.subquery()
+            timestamp = cls.stored_timestamp()
+            parts.append(
+                db.select(cls.device_id, micros.label('first_micros'), micros.label('last_micros'))
+                .select_from(hours)
+                .join(devices, devices.c.device_id == hours.c.device_id)
+                .join(cls, db.and_(
+                    cls.belongs_to(devices),
+                    timestamp >= cls.hour_start(hours.c.hour),
+                    timestamp < cls.hour_start(hours.c.hour + 1)
+                ))
+            )
+            bounds = (SensorRollup.first_micros, SensorRollup.last_micros)
+            if COMPACT_STORAGE:
+                # Mesma chave das leituras brutas (devices.id)
+                complete = db.select(db.type_coerce(devices.c.id, cls.device_id.type), *bounds).join(
+                    devices, devices.c.device_id == SensorRollup.device_id)
+            else:
+                complete = db.select(SensorRollup.device_id, *bounds)
+            complete = complete.where(
+                SensorRollup.bucket_start >= covered[0],
+                SensorRollup.bucket_start < covered[1],
+                db.not_(may_have_gap)
+            )
+            if device_id:
+                complete = complete.where(SensorRollup.device_id == device_id)
+            parts.append(complete)
+        rows = (parts[0] if len(parts) == 1 else db.union_all(*parts)).subquery()
+        
+        previous = db.func.lag(rows.c.last_micros).over(
+            partition_by=rows.c.device_id, order_by=rows.c.first_micros)
+        intervals = db.select(
+            rows.c.device_id, previous.label('previous'), rows.c.first_micros.label('timestamp')
+        ).subquery()
+        return db.select(
+            intervals.c.device_id, intervals.c.previous, intervals.c.timestamp,
+            ((intervals.c.timestamp - intervals.c.previous) / 1000000.0).label('seconds')
+        ).where(intervals.c.previous.isnot(None)).subquery()
+    
+    @classmethod
+    def gaps(cls, start, end, min_gap, device_id=None, limit=100):
+        """Maiores intervalos sem leituras acima de ``min_gap`` segundos
+
+        Retorna (lista de (device_id, início, fim, segundos) dos ``limit``
+        maiores, {device_id: (quantidade, maior)}), tudo calculado no banco
+        em uma consulta: as lacunas são calculadas uma vez e numeradas no
+        geral e por dispositivo, e só voltam as ``limit`` maiores mais a
+        maior de cada dispositivo (com a contagem dele).
+        """
+        intervals = cls._gap_intervals(start, end, min_gap, device_id)
+        found = db.select(intervals).where(intervals.c.seconds > min_gap).subquery()
+        ranked = db.select(
+            found,
+            db.func.count().over(partition_by=found.c.device_id).label('device_gaps'),
+            db.func.row_number().over(partition_by=found.c.device_id,
+                                      order_by=found.c.seconds.desc()).label('device_rank'),
+            db.func.row_number().over(order_by=(found.c.seconds.desc(), found.c.device_id,
+                                                found.c.timestamp)).label('rank')
+        ).subquery()
+        rows = db.session.execute(
+            db.select(ranked).where(db.or_(ranked.c.rank <= limit, ranked.c.device_rank == 1))
+            .order_by(ranked.c.rank)
+        ).all()
+        longest = [(row.device_id, from_micros(row.previous), from_micros(row.timestamp), row.seconds)
+                   for row in rows if row.rank <= limit]
+        per_device = {row.device_id: (row.device_gaps, row.seconds) for row in rows if row.device_rank == 1}
+        return longest, per_device
+    
+    @classmethod
+    def latest_rows(cls):
+        """Leitura mais recente (por timestamp) de cada dispositivo, como tuplas compactas"""
+        newest = db.session.query(
+            cls.device_id, db.func.max(cls.timestamp).label('timestamp')
+        ).group_by(cls.device_id).subquery()
+        return db.session.query(
+            cls.id, cls.device_id, cls.timestamp, cls.temperature, cls.humidity
+        ).join(newest, db.and_(cls.device_id == newest.c.device_id,
+                               cls.timestamp == newest.c.timestamp)).all()
+    
+    @classmethod
+    def first_timestamp(cls):
+        """Timestamp da leitura mais antiga (None se não houver leituras)"""
+        return db.session.query(db.func.min(cls.timestamp)).scalar()
+    
+    @classmethod
+    def delete_chunked(cls, *criteria, chunk_size=5000, pause=0.05, progress=None):
+        """Apaga as leituras que atendem ``criteria`` em lotes, um commit por lote
+
+        Cada lote é um único DELETE pela chave primária (sem carregar objetos
+        do ORM), então o lock de escrita fica com o ingest entre os lotes.
+        ``progress(apagadas)`` é chamado após cada commit. Retorna o total.
+        """
+        total = 0
+        while True:
+            batch = db.select(cls.id).where(*criteria).limit(chunk_size).scalar_subquery()
+            deleted = db.session.execute(db.delete(cls).where(cls.id.in_(batch))).rowcount
+            db.session.commit()
+            total += deleted
+            if progress is not None:
+                progress(total)
+            if deleted < chunk_size:
+                return total
+            time.sleep(pause)
+    
     @classmethod
     def get_latest_by_device(cls, device_id):
         """Retorna o último registro de um dispositivo específico"""
@@ -219,3 +968,921 @@ class SensorData(db.Model):
             },
             'last_update': records[0].timestamp.isoformat()
         }
+
+def floor_hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def ceil_hour(timestamp):
+    hour = floor_hour(timestamp)
+    return hour if hour == timestamp else hour + timedelta(hours=1)
+
+class SensorRollup(db.Model):
+    """Agregados por dispositivo e hora, mantidos pela tarefa de rollup do agendador
+
+    Guardam soma, mínimo e máximo (não a média), para que horas possam ser
+    combinadas em períodos maiores. Continuam existindo depois que a
+    retenção apaga as leituras brutas. A primeira e a última leitura e o
+    maior intervalo entre leituras da hora (em µs) permitem achar lacunas
+    sem reler sensor_data.
+    """
+    
+    __tablename__ = 'sensor_rollups'
+    __table_args__ = (
+        db.Index('ux_sensor_rollups_device_bucket', 'device_id', 'bucket_start', unique=True),
+        db.Index('ix_sensor_rollups_bucket_start', 'bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), nullable=False, comment='ID do dispositivo')
+    bucket_start = db.Column(db.DateTime, nullable=False, comment='Início da hora (UTC)')
+    readings = db.Column(db.Integer, nullable=False, comment='Leituras na hora')
+    temperature_sum = db.Column(db.Float, nullable=False)
+    temperature_min = db.Column(db.Float, nullable=False)
+    temperature_max = db.Column(db.Float, nullable=False)
+    humidity_sum = db.Column(db.Float, nullable=False)
+    humidity_min = db.Column(db.Float, nullable=False)
+    humidity_max = db.Column(db.Float, nullable=False)
+    first_micros = db.Column(db.BigInteger, comment='Primeira leitura da hora (µs desde a epoch)')
+    last_micros = db.Column(db.BigInteger, comment='Última leitura da hora (µs desde a epoch)')
+    max_interval_micros = db.Column(db.BigInteger, comment='Maior intervalo entre leituras da hora (µs)')
+    updated_at = db.Column(db.DateTime, comment='Último recálculo')
+    
+    AGGREGATES = ('readings', 'temperature_sum', 'temperature_min', 'temperature_max',
+                  'humidity_sum', 'humidity_min', 'humidity_max',
+                  'first_micros', 'last_micros', 'max_interval_micros', 'updated_at')
+    
+    def __repr__(self):
+        return f'<SensorRollup {self.device_id} {self.bucket_start}>'
+    
+    @classmethod
+    def bucket_expression(cls):
+        """Início da hora de SensorData.timestamp, no mesmo formato gravado pelo DateTime"""
+        if db.session.get_bind().dialect.name == 'sqlite':
+            return db.func.strftime('%Y-%m-%d %H:00:00.000000', SensorData.timestamp_sql())
+        return db.func.date_trunc('hour', SensorData.timestamp_sql())
+    
+    @classmethod
+    def refresh(cls, start, end, device_ids=None):
+        """Recalcula as horas em [start, end) a partir de sensor_data (upsert em uma instrução)
+
+        ``start`` é arredondado para o início da hora. Horas sem leituras
+        brutas não são apagadas: podem ter sido purgadas pela retenção.
+        """
+        start = floor_hour(start)
+        bucket = cls.bucket_expression()
+        micros = SensorData.micros()
+        readings = db.select(
+            SensorData.device_id, bucket.label('bucket_start'),
+            SensorData.measure('temperature').label('temperature'),
+            SensorData.measure('humidity').label('humidity'),
+            micros.label('micros'),
+            (micros - db.func.lag(micros).over(partition_by=(SensorData.device_id, bucket),
+                                               order_by=SensorData.timestamp)).label('interval')
+        ).where(
+            SensorData.timestamp >= start,
+            SensorData.timestamp < end
+        )
+        if device_ids is not None:
+            readings = readings.where(SensorData.device_id.in_(device_ids))
+        readings = readings.subquery()
+        temperature, humidity = readings.c.temperature, readings.c.humidity
+        query = db.select(
+            SensorData.device_key(readings.c.device_id), readings.c.bucket_start,
+            db.func.count(), db.func.sum(temperature),
+            db.func.min(temperature), db.func.max(temperature),
+            db.func.sum(humidity), db.func.min(humidity), db.func.max(humidity),
+            db.func.min(readings.c.micros), db.func.max(readings.c.micros),
+            db.func.max(readings.c.interval), db.literal(datetime.utcnow(), db.DateTime)
+        ).group_by(readings.c.device_id, readings.c.bucket_start)
+        columns = ('device_id', 'bucket_start') + cls.AGGREGATES
+        
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(cls.__table__).from_select(columns, query)
+            statement = statement.on_conflict_do_update(
+                index_elements=['device_id', 'bucket_start'],
+                set_={name: statement.excluded[name] for name in cls.AGGREGATES}
+            )
+            db.session.execute(statement)
+        else:
+            # Outros bancos: substitui as horas do intervalo
+            existing = db.delete(cls).where(cls.bucket_start >= start, cls.bucket_start < end)
+            if device_ids is not None:
+                existing = existing.where(cls.device_id.in_(device_ids))
+            db.session.execute(existing)
+            db.session.execute(cls.__table__.insert().from_select(columns, query))
+        db.session.commit()
+    
+    @classmethod
+    def refresh_range(cls, start, end, chunk=timedelta(hours=1), device_ids=None):
+        """``refresh`` em fatias de ``chunk`` (um commit curto por fatia)"""
+        current = floor_hour(start)
+        while current < end:
+            cls.refresh(current, min(current + chunk, end), device_ids)
+            current += chunk
+    
+    @classmethod
+    def watermark(cls):
+        """Hora mais recente já consolidada (None antes do primeiro rollup)"""
+        return db.session.query(db.func.max(cls.bucket_start)).scalar()
+
+    @classmethod
+    def consolidated_range(cls, start, end):
+        """Horas inteiras de [start, end) já fechadas nos rollups: (início, fim) ou None
+
+        A hora da marca d'água ainda recebe leituras e fica de fora.
+        """
+        watermark = cls.watermark()
+        if watermark is None:
+            return None
+        first, last = ceil_hour(start), min(floor_hour(end), watermark)
+        return (first, last) if first < last else None
+    
+    @classmethod
+    def hour_number(cls):
+        """bucket_start em horas inteiras desde a epoch"""
+        if db.session.get_bind().dialect.name == 'sqlite':
+            seconds = db.cast(db.func.strftime('%s', cls.bucket_start), db.BigInteger)
+        else:
+            seconds = db.cast(db.func.extract('epoch', cls.bucket_start), db.BigInteger)
+        return seconds // 3600
+    
+    @classmethod
+    def counts_by_device(cls, start, end, device_id=None):
+        """{device_id: leituras} das horas em [start, end)"""
+        query = db.select(cls.device_id, db.func.sum(cls.readings)).where(
+            cls.bucket_start >= start,
+            cls.bucket_start < end
+        ).group_by(cls.device_id)
+        if device_id:
+            query = query.where(cls.device_id == device_id)
+        return dict(db.session.execute(query).all())
+    
+    @classmethod
+    def counts_by_period(cls, period, start, end, device_id=None):
+        """{(device_id, início do período): leituras} das horas em [start, end)"""
+        bucket = SensorData.period_start(period, cls.bucket_start)
+        query = db.select(cls.device_id, bucket, db.func.sum(cls.readings)).where(
+            cls.bucket_start >= start,
+            cls.bucket_start < end
+        ).group_by(cls.device_id, bucket)
+        if device_id:
+            query = query.where(cls.device_id == device_id)
+        return {(device, period_start): count for device, period_start, count in db.session.execute(query)}
+    
+    @classmethod
+    def may_have_gap(cls, min_gap):
+        """Condição SQL: a hora pode ter um intervalo maior que ``min_gap`` segundos entre as próprias leituras
+
+        Inclui as horas sem o maior intervalo calculado (consolidadas antes
+        da coluna existir ou com leituras atrasadas desde o último recálculo).
+        """
+        return db.or_(cls.max_interval_micros.is_(None), cls.max_interval_micros > min_gap * 1000000)
+    
+    @classmethod
+    def merge_late(cls, readings):
+        """Soma leituras atrasadas (device_id, timestamp, temperatura, umidade) às horas já consolidadas
+
+        Sem recalcular a partir de sensor_data: soma, contagem, mínimo e
+        máximo de cada hora afetada são combinados com os já gravados, o que
+        vale também para horas cujas leituras brutas a retenção já apagou.
+        Só entram horas até a marca d'água; as seguintes são cobertas pela
+        próxima rodada da tarefa de rollup, e uma hora somada aqui que a
+        tarefa ainda recalcule é sobrescrita com o mesmo resultado. O maior
+        intervalo da hora fica desconhecido (NULL) até o próximo recálculo.
+        Roda na transação do chamador (sem commit). Retorna as horas
+        atualizadas.
+        """
+        current_hour = floor_hour(datetime.utcnow())
+        readings = [reading for reading in readings if reading[1] < current_hour]
+        if not readings:
+            return 0
+        watermark = cls.watermark()
+        if watermark is None:
+            # Antes do primeiro rollup a tarefa consolida tudo desde a leitura mais antiga
+            return 0
+        if COMPACT_STORAGE:
+            # Os mesmos valores que ficaram gravados (centésimos)
+            readings = [(device_id, timestamp, round(temperature * 100) / 100, round(humidity * 100) / 100)
+                        for device_id, timestamp, temperature, humidity in readings]
+
+        now = datetime.utcnow()
+        buckets = {}
+        for device_id, timestamp, temperature, humidity in readings:
+            key = (device_id, floor_hour(timestamp))
+            if key[1] > watermark:
+                continue
+            micros = to_micros(timestamp)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [1, temperature, temperature, temperature, humidity, humidity, humidity,
+                                micros, micros, None]
+                continue
+            bucket[0] += 1
+            bucket[1] += temperature
+            bucket[2] = min(bucket[2], temperature)
+            bucket[3] = max(bucket[3], temperature)
+            bucket[4] += humidity
+            bucket[5] = min(bucket[5], humidity)
+            bucket[6] = max(bucket[6], humidity)
+            bucket[7] = min(bucket[7], micros)
+            bucket[8] = max(bucket[8], micros)
+        if not buckets:
+            return 0
+        rows = [dict(zip(('device_id', 'bucket_start') + cls.AGGREGATES, key + tuple(values) + (now,)))
+                for key, values in buckets.items()]
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+                lowest, highest = db.func.min, db.func.max
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+                lowest, highest = db.func.least, db.func.greatest
+            table = cls.__table__
+            statement = insert(table)
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(
+                index_elements=['device_id', 'bucket_start'],
+                set_={
+                    'readings': table.c.readings + excluded.readings,
+                    'temperature_sum': table.c.temperature_sum + excluded.temperature_sum,
+                    'temperature_min': lowest(table.c.temperature_min, excluded.temperature_min),
+                    'temperature_max': highest(table.c.temperature_max, excluded.temperature_max),
+                    'humidity_sum': table.c.humidity_sum + excluded.humidity_sum,
+                    'humidity_min': lowest(table.c.humidity_min, excluded.humidity_min),
+                    'humidity_max': highest(table.c.humidity_max, excluded.humidity_max),
+                    'first_micros': lowest(table.c.first_micros, excluded.first_micros),
+                    'last_micros': highest(table.c.last_micros, excluded.last_micros),
+                    'max_interval_micros': None,
+                    'updated_at': excluded.updated_at
+                }
+            )
+            db.session.execute(statement, rows)
+            return len(rows)
+
+        # Outros bancos: combina pelo ORM, hora a hora
+        for row in rows:
+            rollup = cls.query.filter_by(device_id=row['device_id'], bucket_start=row['bucket_start']).first()
+            if rollup is None:
+                db.session.add(cls(**row))
+                continue
+            rollup.readings += row['readings']
+            rollup.temperature_sum += row['temperature_sum']
+            rollup.temperature_min = min(rollup.temperature_min, row['temperature_min'])
+            rollup.temperature_max = max(rollup.temperature_max, row['temperature_max'])
+            rollup.humidity_sum += row['humidity_sum']
+            rollup.humidity_min = min(rollup.humidity_min, row['humidity_min'])
+            rollup.humidity_max = max(rollup.humidity_max, row['humidity_max'])
+            if rollup.first_micros is not None:
+                rollup.first_micros = min(rollup.first_micros, row['first_micros'])
+                rollup.last_micros = max(rollup.last_micros, row['last_micros'])
+            rollup.max_interval_micros = None
+            rollup.updated_at = now
+        return len(rows)
+
+class DeviceTrend(db.Model):
+    """Estado da suavização (EWMA e janela móvel) de um dispositivo
+
+    Atualizado pelo ingest na mesma transação das leituras, então não se
+    perde em reinícios e é o mesmo para todos os workers. O estado completo
+    fica serializado em ``state`` (ver ``trends.DeviceTrendState``).
+    """
+
+    __tablename__ = 'device_trends'
+
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), primary_key=True)
+    last_timestamp = db.Column(db.DateTime, comment='Última leitura aplicada')
+    state = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<DeviceTrend {self.device_id}>'
+
+    def to_dict(self):
+        data = trend_settings.new_state(self.state).snapshot()
+        data.update({
+            'device_id': self.device_id,
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        })
+        data.update(trend_settings.describe())
+        return data
+
+    @classmethod
+    def apply(cls, readings):
+        """Aplica leituras (device_id, timestamp, temperatura, umidade) aos estados
+
+        Uma consulta e uma escrita por dispositivo, O(1) por leitura. Roda
+        na transação do chamador (sem commit), depois dos INSERTs: no SQLite
+        o lock de escrita já está com esta transação, e no PostgreSQL as
+        linhas são travadas, então ingests simultâneos do mesmo dispositivo
+        não perdem atualizações. Retorna o número de dispositivos atualizados.
+        """
+        if not trend_settings.enabled or not readings:
+            return 0
+        readings = sorted(readings, key=lambda reading: (reading[0], reading[1]))
+        device_ids = {reading[0] for reading in readings}
+        query = cls.query.filter(cls.device_id.in_(device_ids))
+        if db.session.get_bind().dialect.name != 'sqlite':
+            query = query.with_for_update()
+        trends = {trend.device_id: trend for trend in query}
+
+        states = {}
+        changed = {}
+        for device_id, timestamp, temperature, humidity in readings:
+            state = states.get(device_id)
+            if state is None:
+                trend = trends.get(device_id)
+                state = states[device_id] = trend_settings.new_state(trend.state if trend else None)
+            # Leituras mais antigas que a última aplicada ficam de fora
+            if state.update(to_micros(timestamp) / 1e6, temperature, humidity):
+                changed[device_id] = timestamp
+
+        now = datetime.utcnow()
+        for device_id, timestamp in changed.items():
+            trend = trends.get(device_id)
+            if trend is None:
+                trend = cls(device_id=device_id)
+                db.session.add(trend)
+            trend.state = states[device_id].pack()
+            trend.last_timestamp = timestamp
+            trend.updated_at = now
+        return len(changed)
+
+class AlertRule(db.Model):
+    """Regra de alerta avaliada a cada leitura recebida"""
+    
+    __tablename__ = 'alert_rules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, comment='Nome da regra')
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), comment='Dispositivo (vazio = todos)')
+    metric = db.Column(db.String(20), nullable=False, comment='temperature ou humidity')
+    kind = db.Column(db.String(20), nullable=False, comment='threshold, rate ou zscore')
+    min_value = db.Column(db.Float, comment='Limite inferior (threshold)')
+    max_value = db.Column(db.Float, comment='Limite superior (threshold)')
+    max_rate = db.Column(db.Float, comment='Variação máxima por minuto (rate)')
+    z_limit = db.Column(db.Float, comment='Z-score máximo (zscore)')
+    window = db.Column(db.Integer, comment='Tamanho da janela móvel em leituras (zscore)')
+    hysteresis = db.Column(db.Float, default=0.0, comment='Margem para normalizar o alerta')
+    is_active = db.Column(db.Boolean, default=True, comment='Regra ativa')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='Data de criação')
+    
+    def __repr__(self):
+        return f'<AlertRule {self.name}: {self.kind} {self.metric}>'
+    
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'device_id': self.device_id,
+            'metric': self.metric,
+            'kind': self.kind,
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'max_rate': self.max_rate,
+            'z_limit': self.z_limit,
+            'window': self.window,
+            'hysteresis': self.hysteresis,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    @classmethod
+    def active_rules(cls):
+        """Regras ativas como dicionários, para o motor de alertas"""
+        return [rule.to_dict() for rule in cls.query.filter_by(is_active=True).all()]
+
+@event.listens_for(AlertRule, 'after_insert')
+@event.listens_for(AlertRule, 'after_update')
+@event.listens_for(AlertRule, 'after_delete')
+def _reload_alert_rules(mapper, connection, target):
+    """Marca a sessão para recarregar as regras do motor de alertas após o commit"""
+    session = object_session(target)
+    if session is not None:
+        session.info['rules_changed'] = True
+
+class AlertEvent(db.Model):
+    """Mudança de estado de um alerta (disparo ou normalização)"""
+    
+    __tablename__ = 'alert_events'
+    __table_args__ = (
+        db.Index('ix_alert_events_device_timestamp', 'device_id', 'timestamp'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rules.id'), nullable=False, comment='Regra de origem')
+    device_id = db.Column(db.String(50), nullable=False, comment='ID do dispositivo')
+    state = db.Column(db.String(20), nullable=False, comment='triggered ou cleared')
+    value = db.Column(db.Float, comment='Valor observado (leitura, taxa ou z-score)')
+    message = db.Column(db.String(255), comment='Descrição do evento')
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, comment='Timestamp da leitura')
+    
+    def __repr__(self):
+        return f'<AlertEvent {self.rule_id}/{self.device_id}: {self.state}>'
+    
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'rule_id': self.rule_id,
+            'device_id': self.device_id,
+            'state': self.state,
+            'value': self.value,
+            'message': self.message,
+            'timestamp': self.timestamp.isoformat()
+        }
+    
+    @classmethod
+    def latest_states(cls):
+        """Último evento de cada par (regra, dispositivo)"""
+        latest_ids = db.session.query(db.func.max(cls.id)).group_by(cls.rule_id, cls.device_id)
+        return cls.query.filter(cls.id.in_(latest_ids)).all()
+    
+    @classmethod
+    def active_rule_ids(cls, device_id):
+        """Regras com alerta disparado para o dispositivo (estado inicial do motor de alertas)"""
+        latest_ids = db.session.query(db.func.max(cls.id)).filter(
+            cls.device_id == device_id
+        ).group_by(cls.rule_id)
+        return [event.rule_id for event in cls.query.filter(cls.id.in_(latest_ids)).all()
+                if event.state == 'triggered']
+
+class DeviceAlertState(db.Model):
+    """Estado do motor de alertas de um dispositivo (ver ``alerts.AlertState``)
+
+    Gravado pelo ingest na mesma transação das leituras e dos eventos de
+    alerta, então os workers compartilham o mesmo estado e um rollback não
+    deixa estado e ``alert_events`` divergentes.
+    """
+
+    __tablename__ = 'device_alert_states'
+
+    device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'), primary_key=True)
+    last_timestamp = db.Column(db.DateTime, comment='Última leitura avaliada')
+    state = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<DeviceAlertState {self.device_id}>'
+
+    @classmethod
+    def evaluate(cls, readings):
+        """Avalia leituras (device_id, timestamp, temperatura, umidade) e retorna as mudanças
+
+        Dispositivos sem regras não consultam nem gravam estado. Como em
+        ``DeviceTrend.apply``, roda na transação do chamador depois dos
+        INSERTs, com as linhas de estado travadas fora do SQLite. As
+        mudanças retornadas (dicts de ``AlertEvent``) devem ser gravadas na
+        mesma transação.
+        """
+        rules = {}
+        version = shared_cache.rules_version()
+        for device_id, *_ in readings:
+            if device_id not in rules:
+                rules[device_id] = alert_engine.rules_for(device_id, AlertRule.active_rules, version)
+        device_ids = [device_id for device_id, device_rules in rules.items() if device_rules]
+        if not device_ids:
+            return []
+
+        query = cls.query.filter(cls.device_id.in_(device_ids))
+        if db.session.get_bind().dialect.name != 'sqlite':
+            query = query.with_for_update()
+        rows = {row.device_id: row for row in query}
+
+        states = {}
+        changes = []
+        last = {}
+        for device_id, timestamp, temperature, humidity in sorted(
+                (reading for reading in readings if rules[reading[0]]),
+                key=lambda reading: (reading[0], reading[1])):
+            state = states.get(device_id)
+            if state is None:
+                row = rows.get(device_id)
+                state = states[device_id] = (AlertState.unpack(row.state) if row is not None
+                                             else AlertState(AlertEvent.active_rule_ids(device_id)))
+            changes.extend(alert_engine.evaluate(
+                state, rules[device_id], device_id, timestamp, to_micros(timestamp),
+                {'temperature': temperature, 'humidity': humidity}
+            ))
+            if state.last is not None:
+                last[device_id] = from_micros(state.last[0])
+
+        now = datetime.utcnow()
+        for device_id, state in states.items():
+            row = rows.get(device_id)
+            if row is None:
+                row = cls(device_id=device_id)
+                db.session.add(row)
+            row.state = state.pack()
+            row.last_timestamp = last.get(device_id)
+            row.updated_at = now
+        return changes
+
+class DeviceDeletion(db.Model):
+    """Remoção ou desativação de um dispositivo, executada em lotes pelo agendador
+
+    ``delete`` apaga leituras, rollups, regras e eventos de alerta do
+    dispositivo e por fim o próprio registro; ``decommission`` apaga só as
+    leituras brutas e mantém o dispositivo (retirado) e os rollups como
+    histórico. Sem FK para devices: o pedido sobrevive ao dispositivo e
+    continua informando o progresso.
+    """
+
+    __tablename__ = 'device_deletions'
+    __table_args__ = (
+        db.Index('ix_device_deletions_device_id', 'device_id'),
+    )
+
+    MODES = ('delete', 'decommission')
+    OPEN_STATUSES = ('pending', 'running')
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False, comment='ID do dispositivo')
+    mode = db.Column(db.String(20), nullable=False, comment='delete ou decommission')
+    status = db.Column(db.String(10), nullable=False, default='pending', comment='pending, running, done ou failed')
+    total_readings = db.Column(db.Integer, comment='Leituras do dispositivo ao iniciar')
+    deleted_readings = db.Column(db.Integer, default=0, comment='Leituras já apagadas')
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow, comment='Data do pedido')
+    started_at = db.Column(db.DateTime, comment='Início da execução')
+    finished_at = db.Column(db.DateTime, comment='Fim da execução')
+    error = db.Column(db.String(255), comment='Erro da última execução')
+
+    def __repr__(self):
+        return f'<DeviceDeletion {self.device_id}: {self.mode} {self.status}>'
+
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        if self.status == 'done':
+            progress = 1.0
+        elif self.total_readings:
+            progress = round(min((self.deleted_readings or 0) / self.total_readings, 1.0), 3)
+        else:
+            progress = 0.0
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'mode': self.mode,
+            'status': self.status,
+            'total_readings': self.total_readings,
+            'deleted_readings': self.deleted_readings or 0,
+            'progress': progress,
+            'requested_at': self.requested_at.isoformat() if self.requested_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'error': self.error
+        }
+
+    @classmethod
+    def request(cls, device, mode):
+        """Retira o dispositivo (o ingest passa a recusá-lo) e agenda a remoção
+
+        Retorna (pedido, criado). Um pedido ainda aberto para o dispositivo é
+        reaproveitado; pedir ``delete`` sobre uma desativação aberta a amplia.
+        """
+        deletion = cls.query.filter(
+            cls.device_id == device.device_id,
+            cls.status.in_(cls.OPEN_STATUSES)
+        ).first()
+        created = deletion is None
+        if created:
+            deletion = cls(device_id=device.device_id, mode=mode, status='pending', deleted_readings=0)
+            db.session.add(deletion)
+        elif mode == 'delete':
+            deletion.mode = 'delete'
+        device.retired_at = device.retired_at or datetime.utcnow()
+        device.is_active = False
+        db.session.commit()
+        return deletion, created
+
+    @classmethod
+    def open_requests(cls):
+        """Pedidos pendentes ou interrompidos (troca de líder), na ordem de chegada"""
+        return cls.query.filter(cls.status.in_(cls.OPEN_STATUSES)).order_by(cls.id).all()
+
+    @classmethod
+    def latest_for(cls, device_id):
+        return cls.query.filter_by(device_id=device_id).order_by(cls.id.desc()).first()
+
+    @classmethod
+    def finished_after(cls, since):
+        """(device_id, finished_at) das remoções concluídas depois de ``since``"""
+        return db.session.query(cls.device_id, cls.finished_at).filter(
+            cls.status == 'done',
+            cls.finished_at > since
+        ).order_by(cls.finished_at).all()
+
+    def run(self, chunk_size=5000, pause=0.05):
+        """Executa (ou retoma) o pedido; cada lote de leituras é um commit curto
+
+        Nada é carregado no ORM: as leituras saem por DELETEs em lotes pela
+        chave primária e o progresso é gravado após cada lote.
+        """
+        if self.started_at is None:
+            self.started_at = datetime.utcnow()
+            self.total_readings = db.session.query(db.func.count(SensorData.id)).filter(
+                SensorData.device_id == self.device_id
+            ).scalar()
+        self.status = 'running'
+        self.error = None
+        db.session.commit()
+
+        # Retomada: o que foi apagado antes da interrupção continua contando
+        already_deleted = self.deleted_readings or 0
+        def progress(deleted):
+            self.deleted_readings = already_deleted + deleted
+            db.session.commit()
+
+        SensorData.delete_chunked(SensorData.device_id == self.device_id,
+                                  chunk_size=chunk_size, pause=pause, progress=progress)
+
+        # O estado da suavização descreve leituras que não existem mais
+        DeviceTrend.query.filter_by(device_id=self.device_id).delete(synchronize_session=False)
+        DeviceAlertState.query.filter_by(device_id=self.device_id).delete(synchronize_session=False)
+        if self.mode == 'delete':
+            SensorRollup.query.filter_by(device_id=self.device_id).delete(synchronize_session=False)
+            AlertEvent.query.filter_by(device_id=self.device_id).delete(synchronize_session=False)
+            rules = AlertRule.query.filter_by(device_id=self.device_id).delete(synchronize_session=False)
+            device = Device.query.filter_by(device_id=self.device_id).first()
+            if device is not None:
+                db.session.delete(device)
+            if rules:
+                # DELETE em lote não dispara os eventos do ORM
+                db.session.info['rules_changed'] = True
+
+        self.status = 'done'
+        self.finished_at = datetime.utcnow()
+        db.session.commit()
+
+    def fail(self, error):
+        """Marca o pedido como falho; um novo pedido retoma de onde parou"""
+        self.status = 'failed'
+        self.error = str(error)[:255]
+        self.finished_at = datetime.utcnow()
+        db.session.commit()
+
+def configure_engines():
+    """Ajustes de conexão dos engines SQLite (chamar dentro do app context)
+
+    O principal usa WAL, em que leitores não bloqueiam o escritor nem são
+    bloqueados por ele, com synchronous=NORMAL (seguro em WAL). O de leitura
+    recebe query_only, mesmo quando aponta para um arquivo aberto sem mode=ro.
+    """
+    def primary_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def read_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', primary_pragmas)
+    replica = db.engines.get(READ_BIND)
+    if replica is not None and replica.dialect.name == 'sqlite':
+        event.listen(replica, 'connect', read_pragmas)
+
+
+def enable_wal():
+    """Coloca o SQLite principal em modo WAL (persistente no arquivo)"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.connect() as connection:
+        mode = connection.exec_driver_sql('PRAGMA journal_mode=WAL').scalar()
+    if mode != 'wal':
+        logger.warning(f"SQLite não entrou em modo WAL (journal_mode={mode})")
+
+
+def upgrade_schema():
+    """Adiciona colunas e índices novos dos modelos em tabelas já existentes
+
+    O db.create_all() só cria tabelas que não existem; bancos criados por
+    versões anteriores recebem aqui as colunas que faltam (sempre anuláveis)
+    e os índices novos.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                ))
+                logger.info(f"Coluna adicionada: {table.name}.{column.name}")
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except IntegrityError:
+                # Índice único sobre dados legados com duplicatas
+                logger.warning(f"Índice {index.name} não criado: há linhas duplicadas em {table.name}")
+
+
+# Tabela temporária da conversão de layout
+MIGRATION_TABLE = 'sensor_data_migrating'
+
+
+def _storage_decoder(layout, connection):
+    """Converte linhas lidas cruas (reflexão) do layout ``layout`` para valores da aplicação"""
+    if layout == 'standard':
+        return lambda row: {
+            'id': row['id'], 'temperature': row['temperature'], 'humidity': row['humidity'],
+            'device_id': row['device_id'], 'timestamp': row['timestamp'], 'seq': row['seq']
+        }
+    devices = dict(connection.execute(db.select(Device.id, Device.device_id)).all())
+    return lambda row: {
+        'id': row['id'], 'temperature': row['temperature'] / 100, 'humidity': row['humidity'] / 100,
+        'device_id': devices[row['device_ref']], 'timestamp': from_micros(row['timestamp']),
+        'seq': row['seq']
+    }
+
+
+def migrate_storage(chunk_size=50000, progress=None):
+    """Converte sensor_data do layout atual para o configurado em SENSOR_STORAGE
+
+    Copia as leituras (mesmos ids) em lotes pela chave primária para uma
+    tabela nova sem índices, um commit por lote; no fim troca as tabelas e
+    cria os índices uma única vez sobre os dados já carregados. Deve rodar
+    com os workers parados. ``progress(copiadas)`` é chamado após cada lote.
+    Retorna (layout anterior, linhas copiadas).
+    """
+    current = storage_layout()
+    if current in (None, STORAGE_LAYOUT):
+        return current, 0
+    
+    metadata = db.MetaData()
+    source = db.Table('sensor_data', metadata, autoload_with=db.engine)
+    # devices na mesma MetaData, para a FK da tabela nova ser resolvida
+    Device.__table__.to_metadata(metadata)
+    target = SensorData.__table__.to_metadata(metadata, name=MIGRATION_TABLE)
+    
+    if current == 'standard':
+        # O layout compacto exige o dispositivo cadastrado (devices.id)
+        orphans = db.session.execute(
+            db.select(source.c.device_id).distinct().where(
+                source.c.device_id.not_in(db.select(Device.device_id)))
+        ).scalars().all()
+        for device_id in orphans:
+            Device.get_or_create(device_id)
+    
+    copied = 0
+    with db.engine.connect() as connection:
+        connection.execute(text(f'DROP TABLE IF EXISTS {MIGRATION_TABLE}'))
+        connection.execute(CreateTable(target))
+        connection.commit()
+        decode = _storage_decoder(current, connection)
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                db.select(source).where(source.c.id > last_id).order_by(source.c.id).limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+            connection.execute(target.insert(), [decode(row) for row in rows])
+            connection.commit()
+            last_id = rows[-1]['id']
+            copied += len(rows)
+            if progress is not None:
+                progress(copied)
+    
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP TABLE sensor_data'))
+        connection.execute(text(f'ALTER TABLE {MIGRATION_TABLE} RENAME TO sensor_data'))
+        for index in SensorData.__table__.indexes:
+            index.create(connection)
+        if connection.dialect.name == 'postgresql':
+            # A sequência do id é a da tabela nova: continuar após os ids copiados
+            connection.execute(text(
+                "SELECT setval(pg_get_serial_sequence('sensor_data', 'id'), COALESCE(MAX(id), 1)) "
+                "FROM sensor_data"
+            ))
+    return current, copied
+
+
+def _sensor_data_row(dialect, device_ref):
+    """Converte (device_id, timestamp µs, temperatura, umidade, seq) para os valores crus do layout"""
+    if COMPACT_STORAGE:
+        return lambda device_id, micros, temperature, humidity, seq: (
+            int(round(temperature * 100)), int(round(humidity * 100)), device_ref[device_id], micros, seq)
+    if dialect == 'sqlite':
+        # Mesmo texto gravado pela coluna DateTime do SQLAlchemy; o prefixo até
+        # o minuto se repete entre leituras próximas e é formatado uma vez
+        minutes = {}
+        def row(device_id, micros, temperature, humidity, seq):
+            minute, rest = divmod(micros, 60000000)
+            prefix = minutes.get(minute)
+            if prefix is None:
+                if len(minutes) >= 100000:
+                    minutes.clear()
+                prefix = minutes[minute] = from_micros(minute * 60000000).strftime('%Y-%m-%d %H:%M:')
+            return (temperature, humidity, device_id,
+                    '%s%02d.%06d' % (prefix, rest // 1000000, rest % 1000000), seq)
+        return row
+    return lambda device_id, micros, temperature, humidity, seq: (
+        temperature, humidity, device_id, from_micros(micros), seq)
+
+
+def load_readings(readings, batch_size=100000, progress=None):
+    """Carrega leituras (device_id, timestamp µs, temperatura, umidade, seq) em massa
+
+    Com sensor_data vazia, grava sem índices e cria os índices uma única vez
+    no fim; só se um índice único falhar as duplicatas são removidas (a mesma
+    leitura registrada duas vezes, por exemplo reenviada depois de um commit
+    que falhou). Com leituras
+    já gravadas (recuperação depois de um crash) usa ON CONFLICT DO NOTHING
+    sobre os índices únicos. Dispositivos que faltam são criados. Escreve
+    pelo driver (executemany), sem ORM; deve rodar com os workers parados.
+    ``progress(lidas, inseridas)`` é chamado após cada lote.
+    Retorna (lidas, inseridas).
+    """
+    dialect = db.engine.dialect
+    device_column = 'device_ref' if COMPACT_STORAGE else 'device_id'
+    fresh = db.session.execute(text('SELECT 1 FROM sensor_data LIMIT 1')).first() is None
+    db.session.commit()
+    if fresh:
+        with db.engine.begin() as connection:
+            for index in SensorData.__table__.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+    marker = '?' if dialect.paramstyle == 'qmark' else '%s'
+    sql = (f'INSERT INTO sensor_data (temperature, humidity, {device_column}, timestamp, seq) '
+           f'VALUES ({", ".join([marker] * 5)})')
+    if not fresh:
+        sql += ' ON CONFLICT DO NOTHING'
+
+    device_ref = dict(db.session.query(Device.device_id, Device.id).all())
+    to_row = _sensor_data_row(dialect.name, device_ref)
+    read = inserted = 0
+    connection = db.engine.raw_connection()
+    synchronous = None
+    try:
+        cursor = connection.cursor()
+        if dialect.name == 'sqlite':
+            synchronous = cursor.execute('PRAGMA synchronous').fetchone()[0]
+            cursor.execute('PRAGMA synchronous = OFF')
+
+        def flush(rows):
+            cursor.executemany(sql, rows)
+            connection.commit()
+            return cursor.rowcount if not fresh and cursor.rowcount >= 0 else len(rows)
+
+        rows = []
+        for reading in readings:
+            if reading[0] not in device_ref:
+                # Raro (um por dispositivo): grava o lote antes de usar a sessão do ORM
+                if rows:
+                    inserted += flush(rows)
+                    rows = []
+                device_ref[reading[0]] = Device.get_or_create(reading[0]).id
+            rows.append(to_row(*reading))
+            read += 1
+            if len(rows) >= batch_size:
+                inserted += flush(rows)
+                rows = []
+                if progress is not None:
+                    progress(read, inserted)
+        if rows:
+            inserted += flush(rows)
+            if progress is not None:
+                progress(read, inserted)
+    finally:
+        if synchronous is not None:
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+        cursor.close()
+        connection.close()
+
+    if fresh:
+        with db.engine.connect() as connection:
+            for index in SensorData.__table__.indexes:
+                try:
+                    index.create(connection)
+                    connection.commit()
+                    continue
+                except IntegrityError:
+                    connection.rollback()
+                # A mesma leitura registrada duas vezes: fica a primeira
+                columns = [column.name for column in index.columns]
+                inserted -= connection.execute(text(
+                    f'DELETE FROM sensor_data WHERE {columns[-1]} IS NOT NULL AND id NOT IN '
+                    f'(SELECT MIN(id) FROM sensor_data WHERE {columns[-1]} IS NOT NULL '
+                    f'GROUP BY {", ".join(columns)})'
+                )).rowcount
+                index.create(connection)
+                connection.commit()
+    Device.backfill_last_seen()
+    return read, inserted
@@ -0,0 +1,115 @@
+"""
+Decodificação dos corpos do ingest: JSON, MessagePack ou CBOR, opcionalmente
+comprimidos com gzip/deflate.
+
+O formato vem do ``Content-Type`` e a compressão do ``Content-Encoding``.
+Os limites são verificados antes de qualquer trabalho: o corpo recebido não
+pode passar de ``max_body`` bytes e a descompressão é feita em streaming com
+teto de ``max_decoded`` bytes, para que um payload pequeno que se expande
+para gigabytes (bomba de descompressão) seja recusado sem alocar a memória.
+
+``msgpack`` e ``cbor2`` são importados só quando um dispositivo usa o
+formato, sem custo para quem envia JSON.
+"""
+
+import json
+import zlib
+
+FORMATS = {
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+    'application/cbor': 'cbor'
+}
+
+
+class PayloadError(Exception):
+    """Corpo recusado; ``status_code`` é o código HTTP da resposta"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _inflate(data, wbits, max_decoded):
+    decompressor = zlib.decompressobj(wbits)
+    output = decompressor.decompress(data, max_decoded + 1)
+    if len(output) > max_decoded or decompressor.unconsumed_tail:
+        raise PayloadError('Payload descomprimido excede o limite', 413)
+    if not decompressor.eof:
+        raise PayloadError('Payload comprimido incompleto')
+    return output
+
+
+def decompress(data, encoding, max_decoded):
+    """Aplica o Content-Encoding com limite de tamanho descomprimido"""
+    encoding = (encoding or 'identity').strip().lower()
+    try:
+        if encoding in ('identity', ''):
+            return data
+        if encoding in ('gzip', 'x-gzip'):
+            return _inflate(data, 16 + zlib.MAX_WBITS, max_decoded)
+        if encoding == 'deflate':
+            # "deflate" no HTTP é zlib, mas há clientes que enviam deflate puro
+            try:
+                return _inflate(data, zlib.MAX_WBITS, max_decoded)
+            except zlib.error:
+                return _inflate(data, -zlib.MAX_WBITS, max_decoded)
+    except zlib.error:
+        raise PayloadError('Payload comprimido inválido')
+    raise PayloadError(f'Content-Encoding não suportado: {encoding}', 415)
+
+
+def _load_msgpack(body):
+    try:
+        import msgpack
+    except ImportError:
+        raise PayloadError('MessagePack não disponível neste servidor', 415)
+    try:
+        # timestamp=3: extensão de timestamp vira datetime
+        return msgpack.unpackb(body, raw=False, timestamp=3)
+    except (ValueError, TypeError, msgpack.UnpackException):
+        raise PayloadError('MessagePack inválido')
+
+
+def _load_cbor(body):
+    try:
+        import cbor2
+    except ImportError:
+        raise PayloadError('CBOR não disponível neste servidor', 415)
+    try:
+        return cbor2.loads(body)
+    except (ValueError, cbor2.CBORDecodeError):
+        raise PayloadError('CBOR inválido')
+
+
+def decode_payload(data, mimetype, encoding, max_decoded):
+    """Descomprime e decodifica um corpo já lido"""
+    kind = FORMATS.get(mimetype or 'application/json')
+    if kind is None:
+        raise PayloadError(f'Content-Type não suportado: {mimetype}', 415)
+
+    body = decompress(data, encoding, max_decoded)
+    if len(body) > max_decoded:
+        raise PayloadError('Payload excede o limite', 413)
+
+    if kind == 'msgpack':
+        return _load_msgpack(body)
+    if kind == 'cbor':
+        return _load_cbor(body)
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise PayloadError('JSON inválido')
+
+
+def decode_request(request, max_body, max_decoded):
+    """Lê e decodifica o corpo de uma requisição de ingest"""
+    length = request.content_length
+    if length is None:
+        raise PayloadError('Content-Length obrigatório', 411)
+    if length > max_body:
+        raise PayloadError('Payload excede o limite', 413)
+    data = request.get_data(cache=False)
+    return decode_payload(data, request.mimetype, request.headers.get('Content-Encoding'), max_decoded)
@@ -0,0 +1,298 @@
+"""
+Janela recente em memória por dispositivo (últimas 24–48h).
+
+As leituras ficam em arrays compactos (``array('q')``/``array('d')``, 32
+bytes por leitura) ordenados por timestamp. Consultas de curto prazo dos
+gráficos e das estatísticas são respondidas daqui, sem
+``ORDER BY timestamp DESC LIMIT`` no banco.
+
+Cada worker mantém sua cópia: ela é aquecida com uma consulta na subida e
+alimentada pelo ingest do próprio worker. Para enxergar o que os outros
+workers gravaram, a janela guarda a marca d'água do maior ``id`` aplicado e,
+no máximo uma vez por ``sync_interval``, busca só as linhas com ``id``
+maior (consulta pela chave primária, que devolve poucas linhas). Na mesma
+sincronização, descarta os dispositivos cuja remoção terminou desde a
+anterior (a remoção roda no worker líder).
+
+No SQLite os escritores são serializados e os ids ficam visíveis em ordem.
+Com escritores concorrentes (PostgreSQL), uma transação pode confirmar um
+id menor depois de outra já ter confirmado um maior; por isso cada
+sincronização relê a partir da marca d'água de ``sync_overlap`` segundos
+atrás, ignorando os ids já aplicados. Só uma transação de ingest mais longa
+que ``sync_overlap`` ainda pode ficar de fora da janela.
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(timestamp):
+    """datetime UTC (naive) -> microssegundos desde a epoch, sem perda"""
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(micros):
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class DeviceWindow:
+    """Leituras recentes de um dispositivo, ordenadas por timestamp"""
+
+    __slots__ = ('ids', 'timestamps', 'temperatures', 'humidities')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.timestamps = array('q')
+        self.temperatures = array('d')
+        self.humidities = array('d')
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def insert(self, record_id, micros, temperature, humidity):
+        if not self.timestamps or micros >= self.timestamps[-1]:
+            self.ids.append(record_id)
+            self.timestamps.append(micros)
+            self.temperatures.append(temperature)
+            self.humidities.append(humidity)
+            return
+        # Leitura atrasada: inserir na posição certa (raro)
+        position = bisect_right(self.timestamps, micros)
+        self.ids.insert(position, record_id)
+        self.timestamps.insert(position, micros)
+        self.temperatures.insert(position, temperature)
+        self.humidities.insert(position, humidity)
+
+    def trim(self, cutoff):
+        """Descarta leituras anteriores a ``cutoff`` (em lote, amortizado)"""
+        position = bisect_left(self.timestamps, cutoff)
+        if position and position * 8 >= len(self.timestamps):
+            del self.ids[:position]
+            del self.timestamps[:position]
+            del self.temperatures[:position]
+            del self.humidities[:position]
+
+    def since(self, cutoff):
+        return bisect_left(self.timestamps, cutoff)
+
+    def newest_first(self, device_id):
+        """Itera (timestamp, índice, device_id, janela) do mais recente ao mais antigo"""
+        for index in range(len(self.timestamps) - 1, -1, -1):
+            yield self.timestamps[index], index, device_id, self
+
+    def row(self, index, device_id):
+        return {
+            'id': self.ids[index],
+            'temperature': self.temperatures[index],
+            'humidity': self.humidities[index],
+            'device_id': device_id,
+            'timestamp': from_micros(self.timestamps[index]).isoformat()
+        }
+
+
+class RecentWindow:
+    """Janelas recentes de todos os dispositivos de um worker"""
+
+    def __init__(self, hours=48, sync_interval=1.0, sync_overlap=5.0):
+        self.hours = hours
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self._devices = {}
+        self._watermark = 0
+        # (instante, marca d'água) de cada sincronização dentro de sync_overlap
+        # e os ids aplicados acima da mais antiga delas
+        self._marks = deque()
+        self._applied = set()
+        self._removed_after = None
+        self._warm = False
+        self._synced_at = 0.0
+        self._lock = threading.RLock()
+        self._warm_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.hours > 0
+
+    def _cutoff(self):
+        return to_micros(datetime.utcnow() - timedelta(hours=self.hours))
+
+    def _apply(self, record_id, device_id, timestamp, temperature, humidity, cutoff):
+        micros = to_micros(timestamp)
+        if micros < cutoff:
+            return
+        window = self._devices.get(device_id)
+        if window is None:
+            window = self._devices[device_id] = DeviceWindow()
+        window.insert(record_id, micros, temperature, humidity)
+
+    def warm(self, window_loader, max_id_loader):
+        """Carrega a janela do banco (uma vez por worker)
+
+        Retorna False sem bloquear se outra thread já estiver aquecendo:
+        quem chamou deve responder pelo banco enquanto isso.
+        """
+        if self._warm or not self.enabled:
+            return self._warm
+        if not self._warm_lock.acquire(blocking=False):
+            return False
+        try:
+            if self._warm:
+                return True
+            since = datetime.utcnow() - timedelta(hours=self.hours)
+            # Remoções concluídas antes da carga já não têm linhas no banco
+            removed_after = datetime.utcnow()
+            # A marca d'água é lida antes: linhas gravadas durante a carga
+            # chegam depois pela sincronização incremental
+            watermark = max_id_loader() or 0
+            rows = window_loader(since, watermark)
+            with self._lock:
+                cutoff = self._cutoff()
+                self._devices = {}
+                for row in rows:
+                    self._apply(*row, cutoff)
+                self._watermark = watermark
+                self._marks = deque([(time.monotonic(), watermark)])
+                self._applied = set()
+                self._removed_after = removed_after
+                self._synced_at = time.monotonic()
+                self._warm = True
+            return True
+        finally:
+            self._warm_lock.release()
+
+    def append(self, record_id, device_id, timestamp, temperature, humidity):
+        """Aplica uma leitura gravada por este worker
+
+        Os ids menores ainda não vistos são preenchidos pela sincronização
+        incremental, que relê o intervalo e pula os ids já aplicados.
+        """
+        if not self._warm:
+            return
+        with self._lock:
+            if record_id > self._marks[0][1] and record_id not in self._applied:
+                self._apply(record_id, device_id, timestamp, temperature, humidity, self._cutoff())
+                self._applied.add(record_id)
+                self._watermark = max(self._watermark, record_id)
+
+    def sync(self, delta_loader, removed_loader=None):
+        """Busca as linhas gravadas por outros workers desde a marca d'água de ``sync_overlap`` segundos atrás"""
+        now = time.monotonic()
+        if now - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if now - self._synced_at < self.sync_interval:
+                return
+            if removed_loader is not None and self._removed_after is not None:
+                for device_id, finished_at in removed_loader(self._removed_after):
+                    self._devices.pop(device_id, None)
+                    self._removed_after = max(self._removed_after, finished_at)
+            rows = delta_loader(self._marks[0][1])
+            cutoff = self._cutoff()
+            for row in rows:
+                if row[0] in self._applied:
+                    continue
+                self._apply(*row, cutoff)
+                self._applied.add(row[0])
+                self._watermark = max(self._watermark, row[0])
+            for window in self._devices.values():
+                window.trim(cutoff)
+            self._marks.append((now, self._watermark))
+            # A releitura parte da sincronização mais recente com pelo menos
+            # sync_overlap segundos; ids abaixo dela não voltam mais
+            while len(self._marks) > 1 and now - self._marks[1][0] >= self.sync_overlap:
+                self._marks.popleft()
+            floor = self._marks[0][1]
+            self._applied = {record_id for record_id in self._applied if record_id > floor}
+            self._synced_at = now
+
+    def forget(self, device_id):
+        """Descarta a janela de um dispositivo removido"""
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def ready(self, loaders, hours=None):
+        """Garante janela aquecida e sincronizada; False se não puder responder"""
+        if not self.enabled or (hours is not None and hours > self.hours):
+            return False
+        window_loader, max_id_loader, delta_loader, removed_loader = loaders
+        if not self.warm(window_loader, max_id_loader):
+            return False
+        self.sync(delta_loader, removed_loader)
+        return True
+
+    def latest(self, device_id, limit):
+        """Últimas ``limit`` leituras (mais recentes primeiro) ou None
+
+        Retorna None quando a janela não tem leituras suficientes: as mais
+        antigas podem estar só no banco.
+        """
+        with self._lock:
+            if device_id:
+                window = self._devices.get(device_id)
+                if window is None or len(window) < limit:
+                    return None
+                return [window.row(i, device_id)
+                        for i in range(len(window) - 1, len(window) - 1 - limit, -1)]
+
+            if sum(len(w) for w in self._devices.values()) < limit:
+                return None
+            streams = [window.newest_first(device_id) for device_id, window in self._devices.items()]
+            merged = heapq.merge(*streams, key=lambda item: item[0], reverse=True)
+            return [window.row(i, device_id)
+                    for _, i, device_id, window in (next(merged) for _ in range(limit))]
+
+    def stats(self, device_id, hours):
+        """Agregados das últimas ``hours`` horas (um dispositivo ou todos)"""
+        cutoff = to_micros(datetime.utcnow() - timedelta(hours=hours))
+        count = 0
+        temp_sum = hum_sum = 0.0
+        temp_max = hum_max = float('-inf')
+        temp_min = hum_min = float('inf')
+        last_update = None
+        with self._lock:
+            if device_id:
+                windows = [self._devices[device_id]] if device_id in self._devices else []
+            else:
+                windows = list(self._devices.values())
+            for window in windows:
+                start = window.since(cutoff)
+                if start >= len(window):
+                    continue
+                temps = window.temperatures[start:]
+                hums = window.humidities[start:]
+                count += len(temps)
+                temp_sum += sum(temps)
+                hum_sum += sum(hums)
+                temp_max = max(temp_max, max(temps))
+                temp_min = min(temp_min, min(temps))
+                hum_max = max(hum_max, max(hums))
+                hum_min = min(hum_min, min(hums))
+                newest = window.timestamps[-1]
+                last_update = newest if last_update is None else max(last_update, newest)
+
+        if not count:
+            return {'total_readings': 0}
+        return {
+            'total_readings': count,
+            'temperature': {'avg': temp_sum / count, 'max': temp_max, 'min': temp_min},
+            'humidity': {'avg': hum_sum / count, 'max': hum_max, 'min': hum_min},
+            'last_update': from_micros(last_update).isoformat()
+        }
+
+
+recent_window = RecentWindow()
+
+
+def init_app(app):
+    """Aplica a configuração do app à janela recente"""
+    recent_window.hours = app.config.get('RECENT_WINDOW_HOURS', 48)
+    recent_window.sync_interval = app.config.get('RECENT_SYNC_INTERVAL', 1.0)
+    recent_window.sync_overlap = app.config.get('RECENT_SYNC_OVERLAP', 5.0)
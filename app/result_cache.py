@@ -0,0 +1,135 @@
+"""
+Cache de resultados dos endpoints de agregados (/api/sensor-data/stats,
+/api/devices/<id>/stats).
+
+Cada aba aberta do painel pede as mesmas estatísticas de 24h a cada 30s; o
+resultado só muda quando chega uma leitura nova. Cada entrada é identificada
+por endpoint + parâmetros e guarda a versão dos dados usada para calculá-la
+(``shared_cache.data_version()`` ou a versão do slot do dispositivo, que o
+ingest incrementa). Uma entrada só é servida enquanto a versão for a mesma e
+o TTL não tiver vencido; o TTL limita a idade do resultado quando não há
+versão (cache compartilhado desativado).
+
+* LRU limitado a ``max_entries`` entradas por worker;
+* single-flight: requisições simultâneas para a mesma chave esperam o
+  cálculo da primeira em vez de repeti-lo;
+* contadores de acertos, falhas, esperas e remoções para o /api/health.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """Cálculo em andamento de uma chave"""
+
+    __slots__ = ('version', 'done', 'value', 'error')
+
+    def __init__(self, version):
+        self.version = version
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """Resultados por (endpoint, parâmetros), válidos para uma versão dos dados"""
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get_or_compute(self, endpoint, params, version, compute):
+        """Resultado em cache para ``version``; chama ``compute()`` uma única vez se faltar"""
+        if not self.enabled:
+            return compute()
+        key = (endpoint, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version == version and time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if entry_version == version:
+                    self.expired += 1
+                del self._entries[key]
+
+            flight = self._inflight.get(key)
+            if flight is not None and flight.version == version:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self._inflight[key] = _Flight(version)
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # Se uma versão mais nova começou a ser calculada, ela é quem grava
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                    if flight.error is None:
+                        self._store(key, version, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def _store(self, key, version, value):
+        """Grava a entrada (chamado com o lock) e remove as menos usadas"""
+        self._entries[key] = (version, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None
+        }
+
+
+result_cache = ResultCache()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao cache de resultados"""
+    result_cache.ttl = app.config.get('RESULT_CACHE_TTL', 30)
+    result_cache.max_entries = app.config.get('RESULT_CACHE_SIZE', 1024)
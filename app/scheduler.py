@@ -0,0 +1,208 @@
+"""
+Agendador de tarefas periódicas dentro do app, com um único líder entre os
+workers do gunicorn.
+
+Todo worker inicia a thread do agendador, mas só o que consegue o
+``flock`` exclusivo (não bloqueante) no arquivo de lock executa as tarefas;
+os demais tentam de novo a cada ``tick``. Quando o líder termina (reciclagem
+por ``max_requests``, crash), o kernel libera o lock e outro worker assume
+em até um tick, sem arquivo de PID velho para limpar.
+
+Cada tarefa roda em uma thread própria dentro de um app context:
+
+* intervalo com jitter (``interval * (1 ± jitter)``), para que tarefas com o
+  mesmo intervalo não disputem o lock do SQLite sempre no mesmo instante;
+* proteção contra sobreposição: se a execução anterior ainda não terminou,
+  a rodada é pulada (e contada em ``skipped``);
+* métricas por tarefa (execuções, falhas, duração última/média/máxima),
+  gravadas pelo líder em um arquivo JSON para que qualquer worker possa
+  expô-las no /api/health.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Tarefa periódica e suas métricas"""
+
+    def __init__(self, name, func, interval, jitter=0.1):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error = None
+
+    def schedule_next(self, now, first=False):
+        if first:
+            # Primeira execução espalhada dentro da janela de jitter
+            self.next_run = now + random.uniform(0, self.interval * self.jitter)
+        else:
+            self.next_run = now + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def snapshot(self):
+        return {
+            'interval': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_started': self.last_started,
+            'last_duration_ms': round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+            'avg_duration_ms': round(self.total_duration / self.runs * 1000, 1) if self.runs else None,
+            'max_duration_ms': round(self.max_duration * 1000, 1),
+            'last_error': self.last_error
+        }
+
+
+class Scheduler:
+    """Executa as tarefas registradas apenas no worker que detém o lock"""
+
+    def __init__(self, lock_path=None, status_path=None, tick=1.0, enabled=True):
+        self.lock_path = lock_path
+        self.status_path = status_path
+        self.tick = tick
+        self.enabled = enabled
+        self.jobs = {}
+        self.is_leader = False
+        self._lock_fd = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def add_job(self, name, func, interval, jitter=0.1):
+        """Registra ``func`` para rodar a cada ``interval`` segundos (0 desativa)"""
+        if interval and interval > 0:
+            self.jobs[name] = Job(name, func, interval, jitter)
+
+    def _try_lead(self):
+        """Tenta obter o lock de líder (não bloqueante)"""
+        if self._lock_fd is None:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.ftruncate(self._lock_fd, 0)
+        os.pwrite(self._lock_fd, str(os.getpid()).encode(), 0)
+        logger.info(f"Agendador: worker {os.getpid()} é o líder")
+        return True
+
+    def _run_job(self, job, app):
+        started = time.monotonic()
+        job.last_started = datetime.utcnow().isoformat()
+        try:
+            with app.app_context():
+                job.func()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"Erro na tarefa {job.name}: {str(e)}")
+        finally:
+            duration = time.monotonic() - started
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+            job.running = False
+            self._write_status()
+
+    def run_pending(self, app, now=None):
+        """Dispara as tarefas vencidas (chamado pelo líder a cada tick)"""
+        now = now if now is not None else time.monotonic()
+        for job in self.jobs.values():
+            if job.next_run is None:
+                job.schedule_next(now, first=True)
+            if now < job.next_run:
+                continue
+            job.schedule_next(now)
+            if job.running:
+                job.skipped += 1
+                logger.warning(f"Tarefa {job.name} ainda em execução; rodada pulada")
+                continue
+            job.running = True
+            threading.Thread(target=self._run_job, args=(job, app),
+                             name=f'job-{job.name}', daemon=True).start()
+
+    def _loop(self, app):
+        while True:
+            try:
+                if not self.is_leader:
+                    self.is_leader = self._try_lead()
+                if self.is_leader:
+                    self.run_pending(app)
+            except Exception as e:
+                logger.error(f"Erro no agendador: {str(e)}")
+            time.sleep(self.tick)
+
+    def start(self, app):
+        """Inicia a thread do agendador no processo atual (uma vez por processo)"""
+        if not self.enabled or not self.jobs or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Após fork: o lock e as métricas pertencem ao processo pai
+            self.is_leader = False
+            self._lock_fd = None
+            for job in self.jobs.values():
+                job.next_run = None
+                job.running = False
+            threading.Thread(target=self._loop, args=(app,), name='scheduler', daemon=True).start()
+
+    def _write_status(self):
+        if not self.status_path:
+            return
+        status = {
+            'leader_pid': os.getpid(),
+            'updated_at': datetime.utcnow().isoformat(),
+            'jobs': {name: job.snapshot() for name, job in self.jobs.items()}
+        }
+        temporary = f'{self.status_path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'w') as output:
+                json.dump(status, output)
+            os.replace(temporary, self.status_path)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar o status do agendador: {str(e)}")
+
+    def snapshot(self):
+        """Métricas gravadas pelo líder (visíveis de qualquer worker)"""
+        try:
+            with open(self.status_path) as status:
+                data = json.load(status)
+        except (OSError, TypeError, ValueError):
+            data = {'leader_pid': None, 'jobs': {}}
+        data['enabled'] = self.enabled
+        data['is_leader'] = self.is_leader
+        return data
+
+
+scheduler = Scheduler()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao agendador"""
+    scheduler.enabled = app.config.get('SCHEDULER_ENABLED', True)
+    scheduler.lock_path = app.config.get('SCHEDULER_LOCK_PATH')
+    scheduler.status_path = os.path.splitext(scheduler.lock_path)[0] + '_status.json'
+    scheduler.tick = app.config.get('SCHEDULER_TICK', 1.0)
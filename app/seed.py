@@ -0,0 +1,172 @@
+"""
+Geração de dados sintéticos em massa para investigações de desempenho.
+
+As leituras são geradas de forma vetorizada com NumPy e inseridas com
+``executemany`` direto no driver do banco, sem passar pelo ORM.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Perfis por ambiente (mesmas bases de simulate_continuous.generate_realistic_data)
+LOCATION_PROFILES = [
+    {'location': 'Sala de Estar', 'name': 'Sensor Sala', 'temperature': 24.0, 'humidity': 55.0},
+    {'location': 'Cozinha', 'name': 'Sensor Cozinha', 'temperature': 26.0, 'humidity': 65.0},
+    {'location': 'Quarto', 'name': 'Sensor Quarto', 'temperature': 22.0, 'humidity': 50.0},
+]
+
+# Formato usado pelo SQLAlchemy para colunas DateTime no SQLite
+SQLITE_DATETIME_UNIT = 'us'
+
+
+def device_profiles(count, prefix='SEED'):
+    """Retorna a lista de dispositivos sintéticos com seus perfis de ambiente"""
+    profiles = []
+    for index in range(count):
+        base = LOCATION_PROFILES[index % len(LOCATION_PROFILES)]
+        profiles.append({
+            'device_id': f'{prefix}_{index + 1:04d}',
+            'name': f"{base['name']} {index + 1}",
+            'location': base['location'],
+            'temperature': base['temperature'],
+            'humidity': base['humidity'],
+        })
+    return profiles
+
+
+def generate_readings(profile, start, days, interval, rng):
+    """Gera as leituras de um dispositivo em arrays NumPy
+
+    Combina a base do ambiente, um ciclo diário (mais quente à tarde, mais
+    úmido de madrugada) e a mesma variação uniforme do simulador.
+    """
+    count = int(days * 86400 // interval)
+    offsets = np.arange(count, dtype=np.int64) * interval
+    # Pequeno atraso de envio, como no firmware real
+    offsets += rng.integers(0, max(1, interval // 10), size=count)
+
+    start_epoch = (start - datetime(1970, 1, 1)).total_seconds()
+    hours = ((start_epoch + offsets) % 86400) / 3600.0
+    daily = np.sin((hours - 9.0) / 24.0 * 2 * np.pi)
+
+    device_offset = rng.uniform(-1, 1)
+    temperature = (profile['temperature'] + device_offset + 1.5 * daily
+                   + rng.uniform(-2, 2, size=count))
+    humidity = (profile['humidity'] - 4.0 * daily
+                + rng.uniform(-8, 8, size=count))
+
+    timestamps = (np.datetime64(start, SQLITE_DATETIME_UNIT)
+                  + offsets.astype('timedelta64[s]'))
+
+    return timestamps, np.round(temperature, 1), np.clip(np.round(humidity, 1), 0.0, 100.0)
+
+
+def format_timestamps(timestamps, dialect):
+    """Converte timestamps NumPy para o formato aceito pelo driver"""
+    if dialect == 'sqlite':
+        text = np.datetime_as_string(timestamps, unit=SQLITE_DATETIME_UNIT)
+        return np.char.replace(text, 'T', ' ').tolist()
+    return timestamps.astype('datetime64[us]').tolist()
+
+
+def _placeholders(paramstyle, count):
+    """Monta os placeholders de acordo com o paramstyle do driver"""
+    if paramstyle == 'qmark':
+        return ', '.join(['?'] * count)
+    return ', '.join(['%s'] * count)
+
+
+def compact_columns(timestamps, temperature, humidity):
+    """Colunas no layout compacto: microssegundos e centésimos inteiros"""
+    return (timestamps.astype('datetime64[us]').astype(np.int64),
+            np.round(temperature * 100).astype(np.int64),
+            np.round(humidity * 100).astype(np.int64))
+
+
+def bulk_insert_readings(connection, dialect, device_id, timestamps, temperature, humidity,
+                         chunk_size=100000, device_ref=None):
+    """Insere as leituras em blocos via executemany, sem ORM
+
+    Com ``device_ref`` (devices.id) grava no layout compacto de sensor_data.
+    """
+    device_column = 'device_ref' if device_ref is not None else 'device_id'
+    sql = (f'INSERT INTO sensor_data (temperature, humidity, {device_column}, timestamp) '
+           f'VALUES ({_placeholders(dialect.paramstyle, 4)})')
+    if device_ref is not None:
+        timestamps, temperature, humidity = compact_columns(timestamps, temperature, humidity)
+        device_id = device_ref
+
+    cursor = connection.cursor()
+    inserted = 0
+    for begin in range(0, len(timestamps), chunk_size):
+        end = begin + chunk_size
+        rows = zip(
+            temperature[begin:end].tolist(),
+            humidity[begin:end].tolist(),
+            [device_id] * (min(end, len(timestamps)) - begin),
+            (timestamps[begin:end].tolist() if device_ref is not None
+             else format_timestamps(timestamps[begin:end], dialect.name)),
+        )
+        cursor.executemany(sql, rows)
+        inserted += min(end, len(timestamps)) - begin
+    cursor.close()
+    return inserted
+
+
+def seed_database(db, Device, devices=3, days=7, interval=60, prefix='SEED',
+                  chunk_size=100000, random_seed=None, echo=print, compact=False):
+    """Popula o banco com N dispositivos e M dias de leituras
+
+    ``compact`` indica que sensor_data está no layout compacto (SENSOR_STORAGE).
+    """
+    rng = np.random.default_rng(random_seed)
+    start = datetime.utcnow() - timedelta(days=days)
+    profiles = device_profiles(devices, prefix)
+
+    # Dispositivos são poucos: o ORM é suficiente aqui
+    existing = {d.device_id for d in Device.query.filter(
+        Device.device_id.in_([p['device_id'] for p in profiles])).all()}
+    for profile in profiles:
+        if profile['device_id'] not in existing:
+            db.session.add(Device(device_id=profile['device_id'], name=profile['name'],
+                                  location=profile['location'],
+                                  description='Dispositivo gerado por flask seed',
+                                  created_at=start))
+    db.session.commit()
+    device_refs = {}
+    if compact:
+        device_refs = dict(db.session.query(Device.device_id, Device.id).filter(
+            Device.device_id.in_([p['device_id'] for p in profiles])).all())
+
+    dialect = db.engine.dialect
+    connection = db.engine.raw_connection()
+    total = 0
+    synchronous = None
+    started = time.perf_counter()
+    try:
+        if dialect.name == 'sqlite':
+            # A conexão volta para o pool: guardar o valor original para restaurar
+            cursor = connection.cursor()
+            synchronous = cursor.execute('PRAGMA synchronous').fetchone()[0]
+            cursor.execute('PRAGMA synchronous = OFF')
+            cursor.close()
+        for profile in profiles:
+            timestamps, temperature, humidity = generate_readings(profile, start, days, interval, rng)
+            total += bulk_insert_readings(connection, dialect, profile['device_id'],
+                                          timestamps, temperature, humidity, chunk_size,
+                                          device_refs.get(profile['device_id']))
+            connection.commit()
+            echo(f"  {profile['device_id']} ({profile['location']}): {len(timestamps)} leituras")
+    finally:
+        if synchronous is not None:
+            cursor = connection.cursor()
+            cursor.execute(f'PRAGMA synchronous = {int(synchronous)}')
+            cursor.close()
+        connection.close()
+
+    elapsed = time.perf_counter() - started
+    # last_seen/status dos dispositivos novos a partir das leituras geradas
+    Device.backfill_last_seen()
+    return total, elapsed
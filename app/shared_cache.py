@@ -0,0 +1,509 @@
+"""
+Cache compartilhado entre os workers do gunicorn em um arquivo mapeado em
+memória (mmap) sob ``app/database``.
+
+Guarda a última leitura de cada dispositivo e os agregados das últimas 24
+horas. Todos os workers mapeiam o mesmo arquivo (MAP_SHARED), então uma
+escrita feita por um worker é vista imediatamente pelos outros, sem cópia
+por processo nem consulta ao banco.
+
+Layout (little-endian)::
+
+    cabeçalho (256 bytes)
+        magic, versão do layout, capacidade, slots usados, overflow,
+        data_version (incrementado a cada escrita ou ``touch()``)
+        bloco de agregados: seq, computed_at, contagem, médias/máx/mín,
+        last_update
+        keys_version (incrementado quando uma API key muda)
+        users_version (incrementado quando um usuário muda)
+        rules_version (incrementado quando uma regra de alerta muda)
+    slots (128 bytes cada)
+        seq, device_id (UTF-8, até 64 bytes; ids maiores não têm slot e
+        levam ``latest_all()`` a responder pelo banco), id, timestamp (µs),
+        temperatura, umidade
+        balde de tokens do ingest: saldo, última reposição (fora do seqlock,
+        lido e escrito só com o flock)
+
+Leitura sem lock (seqlock): o escritor torna o ``seq`` do bloco ímpar,
+grava os campos e o torna par de novo; o leitor copia o bloco e só aceita a
+cópia se o ``seq`` era par e não mudou. Escritores de processos diferentes
+são serializados com ``fcntl.flock`` no próprio arquivo (seção crítica de
+alguns microssegundos). O recálculo dos agregados usa um segundo lock não
+bloqueante: apenas um worker recalcula, os demais continuam servindo o
+valor anterior.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+
+from recent import from_micros, to_micros
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HOTC'
+LAYOUT_VERSION = 4
+
+HEADER_SIZE = 256
+SLOT_SIZE = 128
+DEVICE_ID_SIZE = 64
+
+# magic, versão, capacidade, usados, overflow, data_version
+HEADER = struct.Struct('<4sIIII4xQ')
+# seq, computed_at, contagem, temp avg/max/min, umid avg/max/min, last_update
+AGGREGATES = struct.Struct('<Qdq6dq')
+AGGREGATES_OFFSET = HEADER.size
+# seq, device_id, id, timestamp, temperatura, umidade
+SLOT = struct.Struct(f'<Q{DEVICE_ID_SIZE}sqqdd')
+SEQ = struct.Struct('<Q')
+# saldo de tokens, instante da última reposição (time.time(); 0 = balde novo)
+BUCKET = struct.Struct('<dd')
+BUCKET_OFFSET = SLOT.size
+
+KEYS_VERSION_OFFSET = AGGREGATES_OFFSET + AGGREGATES.size
+USERS_VERSION_OFFSET = KEYS_VERSION_OFFSET + SEQ.size
+RULES_VERSION_OFFSET = USERS_VERSION_OFFSET + SEQ.size
+
+assert RULES_VERSION_OFFSET + SEQ.size <= HEADER_SIZE
+assert BUCKET_OFFSET + BUCKET.size <= SLOT_SIZE
+
+USED_OFFSET = 12
+OVERFLOW_OFFSET = 16
+DATA_VERSION_OFFSET = 24
+
+# Tentativas de leitura antes de desistir (escritor lento ou morto no meio)
+MAX_READ_RETRIES = 100
+
+
+class SharedCache:
+    """Última leitura por dispositivo e agregados de 24h em memória compartilhada"""
+
+    def __init__(self, path=None, capacity=4096, stats_ttl=30):
+        self.path = path
+        self.capacity = capacity
+        self.stats_ttl = stats_ttl
+        self._map = None
+        self._fd = None
+        self._refresh_fd = None
+        self._pid = None
+        self._slots = {}
+        self._lock = threading.Lock()
+        # flock não exclui threads do mesmo processo (mesmo descritor)
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    # ------------------------------------------------------------------
+    # Abertura e escrita
+    # ------------------------------------------------------------------
+
+    def _size(self):
+        return HEADER_SIZE + self.capacity * SLOT_SIZE
+
+    def _open(self):
+        """Mapeia o arquivo neste processo (recriado após fork)"""
+        if self._pid == os.getpid():
+            return self._map
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._map
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != self._size() or not self._valid_header(fd):
+                    self._format(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, self._size())
+            self._fd = fd
+            self._refresh_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            self._slots = {}
+            self._pid = os.getpid()
+            return self._map
+
+    def _valid_header(self, fd):
+        magic, version, capacity, _, _, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+        return magic == MAGIC and version == LAYOUT_VERSION and capacity == self.capacity
+
+    def _format(self, fd):
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, self._size())
+        os.pwrite(fd, HEADER.pack(MAGIC, LAYOUT_VERSION, self.capacity, 0, 0, 0), 0)
+
+    def _locked(self):
+        return _FileLock(self._fd, self._write_lock)
+
+    def _bump_version(self, buffer):
+        version = SEQ.unpack_from(buffer, DATA_VERSION_OFFSET)[0]
+        SEQ.pack_into(buffer, DATA_VERSION_OFFSET, version + 1)
+
+    @staticmethod
+    def _write_block(buffer, offset, layout, *fields):
+        """Escrita seqlock: seq ímpar, campos, seq par"""
+        seq = SEQ.unpack_from(buffer, offset)[0]
+        SEQ.pack_into(buffer, offset, seq + 1)
+        layout.pack_into(buffer, offset, seq + 1, *fields)
+        SEQ.pack_into(buffer, offset, seq + 2)
+
+    @staticmethod
+    def _read_block(buffer, offset, layout):
+        """Leitura seqlock; None se não conseguir uma cópia consistente"""
+        for _ in range(MAX_READ_RETRIES):
+            before = SEQ.unpack_from(buffer, offset)[0]
+            if not before & 1:
+                fields = layout.unpack_from(buffer, offset)
+                if SEQ.unpack_from(buffer, offset)[0] == before:
+                    return fields
+            # Escritor no meio da escrita: ceder a CPU para ele terminar
+            os.sched_yield()
+        return None
+
+    def _slot_offset(self, index):
+        return HEADER_SIZE + index * SLOT_SIZE
+
+    def _find_slot(self, buffer, device_key, claim):
+        """Índice do slot do dispositivo (chamado com o flock adquirido)"""
+        index = self._slots.get(device_key)
+        if index is not None:
+            key = buffer[self._slot_offset(index) + 8:self._slot_offset(index) + 8 + DEVICE_ID_SIZE]
+            if key == device_key:
+                return index
+        used = struct.unpack_from('<I', buffer, USED_OFFSET)[0]
+        free = None
+        for index in range(used):
+            offset = self._slot_offset(index) + 8
+            key = buffer[offset:offset + DEVICE_ID_SIZE]
+            if key == device_key:
+                self._slots[device_key] = index
+                return index
+            if free is None and not key.strip(b'\0'):
+                free = index
+        if not claim:
+            return None
+        if free is None:
+            if used >= self.capacity:
+                struct.pack_into('<I', buffer, OVERFLOW_OFFSET, 1)
+                return None
+            free = used
+            struct.pack_into('<I', buffer, USED_OFFSET, used + 1)
+        self._slots[device_key] = free
+        return free
+
+    @staticmethod
+    def _key(device_id):
+        """Chave do slot, ou None se o device_id não couber em DEVICE_ID_SIZE bytes
+
+        O id nunca é cortado: um corte poderia partir um caractere UTF-8 ou
+        juntar dois dispositivos com o mesmo prefixo no mesmo slot.
+        """
+        key = device_id.encode()
+        if len(key) > DEVICE_ID_SIZE:
+            return None
+        return key.ljust(DEVICE_ID_SIZE, b'\0')
+
+    def update_latest(self, device_id, record_id, timestamp, temperature, humidity):
+        """Registra uma leitura se for a mais recente do dispositivo (por timestamp)"""
+        if not self.enabled:
+            return
+        buffer = self._open()
+        micros = to_micros(timestamp)
+        device_key = self._key(device_id)
+        with self._locked():
+            if device_key is None:
+                # Sem slot possível: como no overflow, latest_all() passa a
+                # responder pelo banco
+                struct.pack_into('<I', buffer, OVERFLOW_OFFSET, 1)
+                self._bump_version(buffer)
+                return
+            index = self._find_slot(buffer, device_key, claim=True)
+            if index is None:
+                return
+            offset = self._slot_offset(index)
+            current = SLOT.unpack_from(buffer, offset)
+            if current[1] == device_key and current[3] > micros:
+                # Leitura atrasada: a última continua sendo a já gravada, mas o
+                # slot é regravado para que a versão do dispositivo mude
+                # (os agregados do período mudaram)
+                self._write_block(buffer, offset, SLOT, *current[1:])
+            else:
+                self._write_block(buffer, offset, SLOT, device_key, record_id, micros,
+                                  temperature, humidity)
+            self._bump_version(buffer)
+
+    def remove(self, device_id):
+        """Libera o slot de um dispositivo removido"""
+        if not self.enabled:
+            return
+        buffer = self._open()
+        device_key = self._key(device_id)
+        if device_key is None:
+            return
+        with self._locked():
+            index = self._find_slot(buffer, device_key, claim=False)
+            if index is None:
+                return
+            self._write_block(buffer, self._slot_offset(index), SLOT, b'', 0, 0, 0.0, 0.0)
+            BUCKET.pack_into(buffer, self._slot_offset(index) + BUCKET_OFFSET, 0.0, 0.0)
+            self._slots.pop(device_key, None)
+            self._bump_version(buffer)
+
+    def touch(self):
+        """Incrementa o data_version sem mudar as leituras (ex.: dispositivo editado)"""
+        if not self.enabled:
+            return
+        buffer = self._open()
+        with self._locked():
+            self._bump_version(buffer)
+
+    def update_bucket(self, device_id, update):
+        """Aplica ``update(saldo, última reposição)`` ao balde do dispositivo, com o flock
+
+        ``update`` retorna (saldo, reposição, resultado); a função devolve o
+        resultado, ou None se não houver slot livre para o dispositivo. Um
+        slot criado aqui ainda não tem leitura (id 0) e não aparece em
+        ``latest_all()``.
+        """
+        if not self.enabled:
+            return None
+        buffer = self._open()
+        device_key = self._key(device_id)
+        if device_key is None:
+            return None
+        with self._locked():
+            index = self._find_slot(buffer, device_key, claim=True)
+            if index is None:
+                return None
+            offset = self._slot_offset(index)
+            if SLOT.unpack_from(buffer, offset)[1] != device_key:
+                self._write_block(buffer, offset, SLOT, device_key, 0, 0, 0.0, 0.0)
+                BUCKET.pack_into(buffer, offset + BUCKET_OFFSET, 0.0, 0.0)
+            tokens, updated_at, result = update(*BUCKET.unpack_from(buffer, offset + BUCKET_OFFSET))
+            BUCKET.pack_into(buffer, offset + BUCKET_OFFSET, tokens, updated_at)
+            return result
+
+    def _bump_counter(self, offset):
+        if not self.enabled:
+            return
+        buffer = self._open()
+        with self._locked():
+            version = SEQ.unpack_from(buffer, offset)[0]
+            SEQ.pack_into(buffer, offset, version + 1)
+
+    def bump_keys_version(self):
+        """Avisa os outros workers que alguma API key mudou"""
+        self._bump_counter(KEYS_VERSION_OFFSET)
+
+    def bump_users_version(self):
+        """Avisa os outros workers que algum usuário mudou (cache de load_user)"""
+        self._bump_counter(USERS_VERSION_OFFSET)
+
+    def bump_rules_version(self):
+        """Avisa os outros workers que alguma regra de alerta mudou"""
+        self._bump_counter(RULES_VERSION_OFFSET)
+
+    def rebuild(self, rows):
+        """Recria o arquivo a partir de (id, device_id, timestamp, temperatura, umidade)
+
+        Chamado no init_database (processo master, antes dos workers), para
+        que o cache não sobreviva a um banco restaurado ou apagado.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        buffer = self._open()
+        with self._locked():
+            buffer[:] = bytes(len(buffer))
+            HEADER.pack_into(buffer, 0, MAGIC, LAYOUT_VERSION, self.capacity, 0, 0, 0)
+            self._slots = {}
+        for record_id, device_id, timestamp, temperature, humidity in rows:
+            self.update_latest(device_id, record_id, timestamp, temperature, humidity)
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def data_version(self):
+        """Contador de escritas: muda sempre que o conteúdo do cache muda"""
+        if not self.enabled:
+            return None
+        return SEQ.unpack_from(self._open(), DATA_VERSION_OFFSET)[0]
+
+    def _counter(self, offset):
+        if not self.enabled:
+            return None
+        return SEQ.unpack_from(self._open(), offset)[0]
+
+    def keys_version(self):
+        """Contador de mudanças de API keys (None se o cache estiver desativado)"""
+        return self._counter(KEYS_VERSION_OFFSET)
+
+    def users_version(self):
+        """Contador de mudanças de usuários (None se o cache estiver desativado)"""
+        return self._counter(USERS_VERSION_OFFSET)
+
+    def rules_version(self):
+        """Contador de mudanças de regras de alerta (None se o cache estiver desativado)"""
+        return self._counter(RULES_VERSION_OFFSET)
+
+    def device_version(self, device_id):
+        """Versão dos dados de um dispositivo (seq do slot; 0 se não tiver slot)
+
+        Muda a cada leitura registrada para o dispositivo, inclusive
+        atrasadas, sem ser afetada pelas leituras dos demais. Um device_id
+        longo demais para um slot usa o ``data_version`` global.
+        """
+        if not self.enabled:
+            return None
+        device_key = self._key(device_id)
+        if device_key is None:
+            return self.data_version()
+        buffer = self._open()
+        # Leitura seqlock, sem flock: chamada nas chaves dos caches de cada GET
+        index = self._slots.get(device_key)
+        if index is not None:
+            fields = self._read_block(buffer, self._slot_offset(index), SLOT)
+            if fields is not None and fields[1] == device_key:
+                return fields[0]
+        used = struct.unpack_from('<I', buffer, USED_OFFSET)[0]
+        for index in range(used):
+            fields = self._read_block(buffer, self._slot_offset(index), SLOT)
+            if fields is None:
+                # Escritor lento no meio do slot: esperar por ele com o flock
+                return self._locked_device_version(buffer, device_key)
+            if fields[1] == device_key:
+                self._slots[device_key] = index
+                return fields[0]
+        return 0
+
+    def _locked_device_version(self, buffer, device_key):
+        with self._locked():
+            index = self._find_slot(buffer, device_key, claim=False)
+            if index is None:
+                return 0
+            return SEQ.unpack_from(buffer, self._slot_offset(index))[0]
+
+    def latest_all(self):
+        """Última leitura de cada dispositivo, ou None se o cache não estiver completo"""
+        if not self.enabled:
+            return None
+        buffer = self._open()
+        _, _, _, used, overflow, _ = HEADER.unpack_from(buffer, 0)
+        if overflow:
+            return None
+        result = []
+        for index in range(used):
+            fields = self._read_block(buffer, self._slot_offset(index), SLOT)
+            if fields is None:
+                return None
+            _, device_key, record_id, micros, temperature, humidity = fields
+            device_id = device_key.rstrip(b'\0').decode()
+            if not device_id or not record_id:
+                # Slot livre ou só com o balde de tokens (sem leitura ainda)
+                continue
+            result.append({
+                'id': record_id,
+                'temperature': temperature,
+                'humidity': humidity,
+                'device_id': device_id,
+                'timestamp': from_micros(micros).isoformat()
+            })
+        return result
+
+    def _read_aggregates(self, buffer):
+        fields = self._read_block(buffer, AGGREGATES_OFFSET, AGGREGATES)
+        if fields is None or not fields[1]:
+            return None, None
+        (_, computed_at, count, temp_avg, temp_max, temp_min,
+         hum_avg, hum_max, hum_min, last_update) = fields
+        if not count:
+            return computed_at, {'total_readings': 0}
+        return computed_at, {
+            'total_readings': count,
+            'temperature': {'avg': temp_avg, 'max': temp_max, 'min': temp_min},
+            'humidity': {'avg': hum_avg, 'max': hum_max, 'min': hum_min},
+            'last_update': from_micros(last_update).isoformat() if last_update else None
+        }
+
+    def _write_aggregates(self, buffer, stats):
+        if stats['total_readings']:
+            temp, hum = stats['temperature'], stats['humidity']
+            last_update = stats.get('last_update')
+            fields = (stats['total_readings'], temp['avg'], temp['max'], temp['min'],
+                      hum['avg'], hum['max'], hum['min'],
+                      to_micros(datetime.fromisoformat(last_update)) if last_update else 0)
+        else:
+            fields = (0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+        with self._locked():
+            self._write_block(buffer, AGGREGATES_OFFSET, AGGREGATES, time.time(), *fields)
+
+    def stats(self, loader, max_age=None):
+        """Agregados de 24h; recalculados com ``loader()`` por um único worker
+
+        Se o valor estiver velho e outro worker já estiver recalculando,
+        devolve o valor anterior. Retorna None apenas se ainda não houver
+        nenhum valor calculado e o recálculo estiver em andamento.
+        ``max_age`` (padrão: ``stats_ttl``) permite recalcular antes do
+        vencimento, como faz a tarefa de aquecimento do agendador.
+        """
+        if not self.enabled:
+            return loader()
+        max_age = self.stats_ttl if max_age is None else max_age
+        buffer = self._open()
+        computed_at, stats = self._read_aggregates(buffer)
+        if stats is not None and time.time() - computed_at < max_age:
+            return stats
+
+        if not self._refresh_lock.acquire(blocking=False):
+            return stats
+        try:
+            fcntl.flock(self._refresh_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._refresh_lock.release()
+            return stats
+        try:
+            # Outro worker pode ter acabado de recalcular
+            computed_at, cached = self._read_aggregates(buffer)
+            if cached is not None and time.time() - computed_at < max_age:
+                return cached
+            stats = loader()
+            self._write_aggregates(buffer, stats)
+            return stats
+        finally:
+            fcntl.flock(self._refresh_fd, fcntl.LOCK_UN)
+            self._refresh_lock.release()
+
+
+class _FileLock:
+    """Lock de thread + flock exclusivo como context manager"""
+
+    __slots__ = ('fd', 'lock')
+
+    def __init__(self, fd, lock):
+        self.fd = fd
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+shared_cache = SharedCache()
+
+
+def init_app(app):
+    """Aplica a configuração do app ao cache compartilhado"""
+    shared_cache.path = app.config.get('SHARED_CACHE_PATH')
+    shared_cache.capacity = app.config.get('SHARED_CACHE_SLOTS', 4096)
+    shared_cache.stats_ttl = app.config.get('SHARED_STATS_TTL', 30)
@@ -36,10 +36,21 @@ class SensorMonitor {
     }
 
     async loadInitialData() {
+        // Valores renderizados pelo servidor só precisam do fuso do navegador
+        localizeTimestamps(document);
+
+        // Só busca o que a página exibe e ainda não veio renderizado
         try {
-            await this.updateCurrentData();
-            await this.updateStats();
-            await this.updateCharts();
+            if (document.getElementById('current-temp')) {
+                await this.updateCurrentData();
+            }
+            const avgTemp = document.getElementById('avg-temp');
+            if (avgTemp && avgTemp.textContent.startsWith('--')) {
+                await this.updateStats();
+            }
+            if (this.charts.main) {
+                await this.updateCharts();
+            }
         } catch (error) {
             console.error('Erro ao carregar dados iniciais:', error);
             this.showError('Erro ao carregar dados iniciais');
@@ -180,14 +191,35 @@ class SensorMonitor {
             
             if (data.status === 'success') {
                 this.updateMainChart(data.data);
-                this.updateHumidityChart(data.data);
                 this.updateDataTable(data.data);
             }
+
+            await this.updateHumidityChart(timeRange, deviceId);
         } catch (error) {
             console.error('Erro ao atualizar gráficos:', error);
         }
     }
 
+    async updateHumidityChart(timeRange, deviceId) {
+        if (!this.charts.humidity) return;
+
+        // Só as contagens por faixa (<30%, 30-70%, >70%) vêm do servidor
+        let url = `/api/sensor-data/histogram?metric=humidity&edges=30,70&hours=${timeRange}`;
+        if (deviceId) {
+            url += `&device_id=${deviceId}`;
+        }
+
+        try {
+            const data = await this.fetchData(url);
+            if (data.status === 'success') {
+                this.charts.humidity.data.datasets[0].data = data.data.counts;
+                this.charts.humidity.update();
+            }
+        } catch (error) {
+            console.error('Erro ao atualizar histograma de umidade:', error);
+        }
+    }
+
     updateMainChart(data) {
         if (!this.charts.main) return;
 
@@ -201,18 +233,6 @@ class SensorMonitor {
         this.charts.main.update();
     }
 
-    updateHumidityChart(data) {
-        if (!this.charts.humidity) return;
-
-        const humidities = data.map(item => item.humidity);
-        const low = humidities.filter(h => h < 30).length;
-        const normal = humidities.filter(h => h >= 30 && h <= 70).length;
-        const high = humidities.filter(h => h > 70).length;
-
-        this.charts.humidity.data.datasets[0].data = [low, normal, high];
-        this.charts.humidity.update();
-    }
-
     updateDataTable(data) {
         const tbody = document.getElementById('dataTableBody');
         if (!tbody) return;
@@ -309,6 +329,17 @@ function formatTimestamp(timestamp) {
     return new Date(timestamp).toLocaleString('pt-BR');
 }
 
+// Converte os timestamps renderizados no servidor (data-timestamp, ISO) para o horário local
+function localizeTimestamps(root) {
+    root.querySelectorAll('[data-timestamp]').forEach(element => {
+        const timestamp = new Date(element.dataset.timestamp);
+        if (isNaN(timestamp)) return;
+        element.textContent = element.dataset.format === 'time'
+            ? timestamp.toLocaleTimeString('pt-BR')
+            : timestamp.toLocaleString('pt-BR');
+    });
+}
+
 // Exportar para uso global
 window.SensorMonitor = SensorMonitor;
 
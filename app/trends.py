@@ -0,0 +1,249 @@
+"""
+Suavização e tendência incrementais por dispositivo.
+
+Para cada métrica (temperatura e umidade) o estado guarda:
+
+- média exponencial (EWMA) com inclinação, pelo método de Holt, com
+  ``alpha = 1 - exp(-dt / tau)``: leituras com intervalos irregulares pesam
+  pelo tempo decorrido, não pela contagem, e ``halflife`` é o tempo em que
+  uma leitura perde metade do peso;
+- média e inclinação (mínimos quadrados) das últimas ``window`` leituras,
+  em um buffer circular com somas acumuladas.
+
+Cada leitura custa O(1). As somas da janela são refeitas do buffer a cada
+volta completa, com o instante de referência na leitura mais antiga, para
+não acumular erro de arredondamento. Leituras mais antigas que a última
+aplicada são ignoradas (como no motor de alertas) e uma lacuna maior que
+``reset_gap`` reinicia o estado.
+
+O estado é serializado com ``pack()`` e gravado por ``DeviceTrend`` na
+mesma transação das leituras, então sobrevive a reinícios e é o mesmo em
+todos os workers.
+"""
+
+import math
+import struct
+from array import array
+
+METRICS = ('temperature', 'humidity')
+
+# versão, janela, leituras no buffer, posição, leituras aplicadas,
+# última leitura (epoch), nível e inclinação (por segundo) de cada métrica
+STATE_HEADER = struct.Struct('<BIIIqd4d')
+STATE_VERSION = 1
+
+
+class DeviceTrendState:
+    """Estado incremental de um dispositivo (EWMA/Holt e janela móvel)"""
+
+    __slots__ = ('window', 'halflife', 'reset_gap', 'last', 'readings', 'level', 'slope',
+                 'times', 'values', 'index', 'count', 'base', 'sum_t', 'sum_tt', 'sum_x', 'sum_tx')
+
+    def __init__(self, window=30, halflife=300, reset_gap=3600):
+        self.window = window
+        self.halflife = halflife
+        self.reset_gap = reset_gap
+        self.last = None
+        self.readings = 0
+        self.level = [0.0, 0.0]
+        self.slope = [0.0, 0.0]
+        self._clear_window()
+
+    def _clear_window(self):
+        self.times = array('d', bytes(8 * self.window))
+        self.values = [array('d', bytes(8 * self.window)) for _ in METRICS]
+        self.index = 0
+        self.count = 0
+        self.base = 0.0
+        self.sum_t = self.sum_tt = 0.0
+        self.sum_x = [0.0, 0.0]
+        self.sum_tx = [0.0, 0.0]
+
+    def _rebase(self):
+        """Refaz as somas a partir do buffer, relativas à leitura mais antiga"""
+        start = (self.index - self.count) % self.window
+        order = [(start + i) % self.window for i in range(self.count)]
+        self.base = self.times[order[0]] if order else 0.0
+        self.sum_t = self.sum_tt = 0.0
+        self.sum_x = [0.0, 0.0]
+        self.sum_tx = [0.0, 0.0]
+        for position in order:
+            t = self.times[position] - self.base
+            self.sum_t += t
+            self.sum_tt += t * t
+            for m in range(len(METRICS)):
+                x = self.values[m][position]
+                self.sum_x[m] += x
+                self.sum_tx[m] += t * x
+
+    def update(self, epoch, temperature, humidity):
+        """Aplica uma leitura; retorna False se ela for mais antiga que a última"""
+        current = (temperature, humidity)
+        if self.last is not None and epoch <= self.last:
+            return False
+        if self.last is None or epoch - self.last > self.reset_gap:
+            # Primeira leitura ou volta depois de muito tempo sem dados
+            self.level = list(current)
+            self.slope = [0.0, 0.0]
+            self._clear_window()
+            self.base = epoch
+        else:
+            dt = epoch - self.last
+            alpha = 1.0 - math.exp(-dt * math.log(2) / self.halflife)
+            for m, x in enumerate(current):
+                predicted = self.level[m] + self.slope[m] * dt
+                level = predicted + alpha * (x - predicted)
+                self.slope[m] += alpha * ((level - self.level[m]) / dt - self.slope[m])
+                self.level[m] = level
+
+        position = self.index
+        if self.count == self.window:
+            t = self.times[position] - self.base
+            self.sum_t -= t
+            self.sum_tt -= t * t
+            for m in range(len(METRICS)):
+                x = self.values[m][position]
+                self.sum_x[m] -= x
+                self.sum_tx[m] -= t * x
+        else:
+            self.count += 1
+        self.times[position] = epoch
+        t = epoch - self.base
+        self.sum_t += t
+        self.sum_tt += t * t
+        for m, x in enumerate(current):
+            self.values[m][position] = x
+            self.sum_x[m] += x
+            self.sum_tx[m] += t * x
+        self.index = (position + 1) % self.window
+        if self.index == 0:
+            self._rebase()
+
+        self.last = epoch
+        self.readings += 1
+        return True
+
+    def rolling(self, m):
+        """(média, inclinação por segundo) da janela para a métrica ``m``"""
+        if not self.count:
+            return None, None
+        mean = self.sum_x[m] / self.count
+        denominator = self.count * self.sum_tt - self.sum_t * self.sum_t
+        if self.count < 2 or denominator <= 0:
+            return mean, None
+        return mean, (self.count * self.sum_tx[m] - self.sum_t * self.sum_x[m]) / denominator
+
+    def snapshot(self):
+        """Valores atuais por métrica; inclinações em unidades por hora"""
+        if self.last is None:
+            return {metric: None for metric in METRICS}
+        result = {}
+        for m, metric in enumerate(METRICS):
+            mean, slope = self.rolling(m)
+            result[metric] = {
+                'ewma': round(self.level[m], 2),
+                'ewma_slope': round(self.slope[m] * 3600, 3),
+                'rolling_mean': round(mean, 2),
+                'rolling_slope': round(slope * 3600, 3) if slope is not None else None
+            }
+        return result
+
+    def pack(self):
+        header = STATE_HEADER.pack(STATE_VERSION, self.window, self.count, self.index, self.readings,
+                                   self.last if self.last is not None else math.nan,
+                                   self.level[0], self.slope[0], self.level[1], self.slope[1])
+        return header + self.times.tobytes() + b''.join(values.tobytes() for values in self.values)
+
+    def unpack(self, data):
+        """Restaura um estado gravado; ajusta a janela se ``window`` mudou"""
+        (version, window, count, index, readings, last,
+         temperature_level, temperature_slope, humidity_level, humidity_slope) = STATE_HEADER.unpack_from(data)
+        if version != STATE_VERSION:
+            return self
+        self.readings = readings
+        self.last = None if math.isnan(last) else last
+        self.level = [temperature_level, humidity_level]
+        self.slope = [temperature_slope, humidity_slope]
+
+        buffers = []
+        offset = STATE_HEADER.size
+        for _ in range(1 + len(METRICS)):
+            buffer = array('d')
+            buffer.frombytes(data[offset:offset + 8 * window])
+            buffers.append(buffer)
+            offset += 8 * window
+        start = (index - count) % window if window else 0
+        order = [(start + i) % window for i in range(count)][-self.window:]
+
+        self._clear_window()
+        for position in order:
+            self.times[self.index] = buffers[0][position]
+            for m in range(len(METRICS)):
+                self.values[m][self.index] = buffers[1 + m][position]
+            self.index = (self.index + 1) % self.window
+            self.count += 1
+        self._rebase()
+        return self
+
+
+class TrendSettings:
+    """Parâmetros da suavização, aplicados pelo ``init_app``"""
+
+    def __init__(self, enabled=True, halflife=300, window=30, reset_gap=3600):
+        self.enabled = enabled
+        self.halflife = halflife
+        self.window = window
+        self.reset_gap = reset_gap
+
+    def new_state(self, data=None):
+        state = DeviceTrendState(self.window, self.halflife, self.reset_gap)
+        return state.unpack(data) if data else state
+
+    def warmup_seconds(self):
+        """Histórico lido antes do início de um gráfico (peso restante < 2%)"""
+        return 6 * self.halflife
+
+    def describe(self):
+        return {'halflife_seconds': self.halflife, 'window': self.window}
+
+
+trend_settings = TrendSettings()
+
+OVERLAY_COLUMNS = tuple(f'{metric}_{name}' for metric in METRICS
+                        for name in ('ewma', 'ewma_slope', 'rolling_mean', 'rolling_slope'))
+
+
+def smooth_rows(rows, start_epoch, settings=trend_settings):
+    """Aplica o estado incremental às linhas (epoch, temperatura, umidade)
+
+    As linhas anteriores a ``start_epoch`` servem só de aquecimento. Retorna
+    (linhas a partir de ``start_epoch``, {coluna: array alinhado às linhas}),
+    calculadas pela mesma recorrência que o ingest usa em ``DeviceTrend``.
+    """
+    # Importação tardia: o ingest usa este módulo e não precisa de NumPy
+    import numpy as np
+
+    state = settings.new_state()
+    kept = []
+    columns = [[] for _ in OVERLAY_COLUMNS]
+    for row in rows:
+        epoch, temperature, humidity = row
+        state.update(epoch, temperature, humidity)
+        if epoch < start_epoch:
+            continue
+        kept.append(row)
+        for m in range(len(METRICS)):
+            mean, slope = state.rolling(m)
+            columns[4 * m].append(state.level[m])
+            columns[4 * m + 1].append(state.slope[m] * 3600)
+            columns[4 * m + 2].append(mean)
+            columns[4 * m + 3].append(slope * 3600 if slope is not None else math.nan)
+    return kept, {name: np.asarray(values, dtype=np.float64) for name, values in zip(OVERLAY_COLUMNS, columns)}
+
+
+def init_app(app):
+    """Aplica a configuração do app à suavização"""
+    trend_settings.enabled = app.config.get('TRENDS_ENABLED', True)
+    trend_settings.halflife = app.config.get('TRENDS_HALFLIFE', 300)
+    trend_settings.window = app.config.get('TRENDS_WINDOW', 30)
+    trend_settings.reset_gap = app.config.get('TRENDS_RESET_GAP', 3600)
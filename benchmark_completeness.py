@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Benchmark do relatório de completude (/api/reports/completeness)
+Gera DEVICES dispositivos x DAYS dias de leituras a cada INTERVAL segundos
+(com os geradores do flask seed, em um banco SQLite temporário), com quedas
+de conexão em parte dos dispositivos, e mede as consultas do relatório em
+duas situações: antes dos rollups (tudo lido de sensor_data) e depois
+deles (contagens e lacunas entre horas dos rollups; sensor_data só nas
+horas com lacunas internas). Confere que as duas dão o mesmo resultado
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Flask
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+
+from models import COMPACT_STORAGE, Device, SensorData, SensorRollup, db  # noqa: E402
+from seed import bulk_insert_readings, device_profiles, generate_readings  # noqa: E402
+
+# Configurações (escala pedida para o relatório: 1000 dispositivos x 90 dias)
+DEVICES = 1000
+DAYS = 90
+INTERVAL = 60
+# Parte dos dispositivos com quedas de 2 min a 6 h
+FLAKY_FRACTION = 0.1
+OUTAGES_PER_DEVICE = 20
+# Leituras perdidas avulsas em todos os dispositivos (lacunas abaixo do limite)
+DROP_RATE = 0.005
+MIN_GAP = 300
+LIMIT = 100
+RANDOM_SEED = 42
+
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def outage_mask(timestamps, rng, flaky):
+    """Leituras mantidas: perdas avulsas e, nos instáveis, quedas longas"""
+    keep = rng.random(len(timestamps)) >= DROP_RATE
+    if flaky:
+        first, last = timestamps[0], timestamps[-1]
+        span = (last - first).astype(np.int64)
+        starts = first + rng.integers(0, span, size=OUTAGES_PER_DEVICE).astype("timedelta64[us]")
+        lengths = rng.integers(120, 6 * 3600, size=OUTAGES_PER_DEVICE).astype("timedelta64[s]")
+        for begin, length in zip(starts, lengths):
+            keep &= (timestamps < begin) | (timestamps >= begin + length)
+    return keep
+
+
+def populate(start):
+    """Dispositivos e leituras; os índices de sensor_data são criados depois da carga"""
+    rng = np.random.default_rng(RANDOM_SEED)
+    profiles = device_profiles(DEVICES, "BENCH")
+    for profile in profiles:
+        db.session.add(Device(device_id=profile["device_id"], name=profile["name"],
+                              location=profile["location"], created_at=start))
+    db.session.commit()
+    # Layout compacto (SENSOR_STORAGE=compact): sensor_data guarda devices.id
+    device_refs = dict(db.session.query(Device.device_id, Device.id)) if COMPACT_STORAGE else {}
+
+    indexes = list(SensorData.__table__.indexes)
+    for index in indexes:
+        index.drop(db.engine)
+    connection = db.engine.raw_connection()
+    connection.execute("PRAGMA synchronous = OFF")
+    total = 0
+    try:
+        for number, profile in enumerate(profiles):
+            timestamps, temperature, humidity = generate_readings(profile, start, DAYS, INTERVAL, rng)
+            keep = outage_mask(timestamps, rng, number < DEVICES * FLAKY_FRACTION)
+            total += bulk_insert_readings(connection, db.engine.dialect, profile["device_id"],
+                                          timestamps[keep], temperature[keep], humidity[keep],
+                                          device_ref=device_refs.get(profile["device_id"]))
+            connection.commit()
+            if (number + 1) % 100 == 0:
+                print(f"  {number + 1} dispositivos, {total:,} leituras")
+    finally:
+        connection.close()
+    for index in indexes:
+        index.create(db.engine)
+    Device.backfill_last_seen()
+    return total
+
+
+def report(start, end):
+    """As consultas do relatório sem device_id; retorna (segundos por etapa, resultado)"""
+    timings = {}
+    started = time.perf_counter()
+    received = SensorData.counts_by_device(start, end)
+    timings["contagens"] = time.perf_counter() - started
+    started = time.perf_counter()
+    longest, per_device = SensorData.gaps(start, end, MIN_GAP, limit=LIMIT)
+    timings["lacunas"] = time.perf_counter() - started
+    started = time.perf_counter()
+    periods = SensorData.counts_by_period("day", start, end, "BENCH_0001")
+    timings["por dia (1 dispositivo)"] = time.perf_counter() - started
+    db.session.rollback()
+    return timings, (received, longest, per_device, sorted(periods))
+
+
+def print_timings(label, timings):
+    print(f"\n{label}")
+    for step, seconds in timings.items():
+        print(f"  {step:<24} {seconds:8.2f} s")
+    print(f"  {'total':<24} {sum(timings.values()):8.2f} s")
+
+
+def compare(raw, rollups):
+    """Diferenças entre os resultados lidos só de sensor_data e com os rollups"""
+    problems = []
+    received_raw, longest_raw, per_device_raw, periods_raw = raw
+    received, longest, per_device, periods = rollups
+    if received_raw != received:
+        problems.append("contagens por dispositivo")
+    if [(gap[0], gap[1], gap[2]) for gap in longest_raw] != [(gap[0], gap[1], gap[2]) for gap in longest]:
+        problems.append("maiores lacunas")
+    if {device: count for device, (count, _) in per_device_raw.items()} != \
+            {device: count for device, (count, _) in per_device.items()}:
+        problems.append("lacunas por dispositivo")
+    if periods_raw != periods:
+        problems.append("contagens por dia")
+    return problems
+
+
+def main():
+    print("Benchmark do relatório de completude")
+    print("=" * 55)
+    print(f"Dispositivos: {DEVICES} | Dias: {DAYS} | Intervalo: {INTERVAL}s | "
+          f"Instáveis: {FLAKY_FRACTION:.0%}")
+
+    directory = tempfile.mkdtemp(prefix="completeness-")
+    app = create_app(os.path.join(directory, "bench.db"))
+    try:
+        with app.app_context():
+            db.create_all()
+            end = datetime.utcnow().replace(microsecond=0)
+            start = end - timedelta(days=DAYS)
+
+            started = time.perf_counter()
+            total = populate(start)
+            print(f"\n{total:,} leituras geradas em {time.perf_counter() - started:.0f}s")
+
+            raw_timings, raw = report(start, end)
+            print_timings("Sem rollups (varredura de sensor_data)", raw_timings)
+
+            started = time.perf_counter()
+            SensorRollup.refresh(start, end)
+            print(f"\nRollups consolidados em {time.perf_counter() - started:.0f}s")
+
+            timings, result = report(start, end)
+            print_timings("Com rollups (sensor_data só nas horas com lacunas)", timings)
+
+            problems = compare(raw, result)
+            print("\nResultados iguais" if not problems else f"\nDIFERENÇAS: {', '.join(problems)}")
+            print(f"Lacunas acima de {MIN_GAP}s: {sum(count for count, _ in result[2].values()):,} "
+                  f"em {len(result[2])} dispositivos")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
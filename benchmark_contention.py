@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark de contenção entre ingest e consultas de histórico no SQLite
+Mede a latência do ingest (INSERT + COMMIT por leitura, como em
+/api/sensor-data) enquanto processos leitores rodam consultas pesadas de
+histórico, comparando o journal padrão (rollback) com leitores na mesma
+conexão de escrita e o modo WAL com leitores em conexões mode=ro, que é a
+configuração do app (engine de leitura para as requisições GET)
+"""
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Configurações
+DEVICES = 20
+DAYS = 7
+READERS = 2
+DURATION = 5.0
+INGEST_INTERVAL = 0.01
+BUSY_TIMEOUT = 5.0
+
+# Consultas de histórico no padrão dos relatórios (séries por hora, lacunas)
+HISTORY_QUERIES = (
+    """
+    SELECT device_id, strftime('%Y-%m-%d %H:00:00', timestamp) AS hour,
+           AVG(temperature), MAX(temperature), MIN(temperature), AVG(humidity), COUNT(*)
+    FROM sensor_data GROUP BY device_id, hour
+    """,
+    """
+    SELECT device_id, MAX(gap) FROM (
+        SELECT device_id,
+               julianday(timestamp) - julianday(LAG(timestamp) OVER (
+                   PARTITION BY device_id ORDER BY timestamp)) AS gap
+        FROM sensor_data
+    ) GROUP BY device_id
+    """,
+)
+
+INSERT_SQL = "INSERT INTO sensor_data (temperature, humidity, device_id, timestamp) VALUES (?, ?, ?, ?)"
+
+# (rótulo, journal_mode, leitores, leitores em mode=ro)
+SCENARIOS = (
+    ("rollback journal, sem leitores", "DELETE", 0, False),
+    ("rollback journal + histórico", "DELETE", READERS, False),
+    ("WAL, sem leitores", "WAL", 0, True),
+    ("WAL + histórico em mode=ro", "WAL", READERS, True),
+)
+
+def build_database(path, journal_mode):
+    """Cria um SQLite com o schema/índices de sensor_data e DAYS dias por dispositivo"""
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA journal_mode={journal_mode}")
+    connection.execute(
+        "CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, temperature REAL, humidity REAL, "
+        "device_id TEXT, timestamp TEXT)"
+    )
+    connection.execute("CREATE UNIQUE INDEX ux_device_ts ON sensor_data (device_id, timestamp)")
+    connection.execute("CREATE INDEX ix_timestamp ON sensor_data (timestamp)")
+    start = datetime.utcnow() - timedelta(days=DAYS)
+    minutes = DAYS * 24 * 60
+    for device in range(DEVICES):
+        connection.executemany(INSERT_SQL, (
+            (random.uniform(15, 30), random.uniform(30, 80), f"BENCH_{device:03d}",
+             (start + timedelta(minutes=minute)).isoformat(sep=" "))
+            for minute in range(minutes)
+        ))
+    connection.commit()
+    connection.close()
+
+def ingest(path, journal_mode, ready, results):
+    """Simula o ingest: uma leitura por commit, mede a latência de cada uma (ms)"""
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    if journal_mode == "WAL":
+        connection.execute("PRAGMA synchronous=NORMAL")
+    ready.wait()
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.execute(INSERT_SQL, (random.uniform(15, 30), random.uniform(30, 80),
+                                            f"BENCH_{random.randrange(DEVICES):03d}",
+                                            datetime.utcnow().isoformat(sep=" ")))
+            connection.commit()
+        except sqlite3.OperationalError:
+            # "database is locked" depois do busy timeout
+            connection.rollback()
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(INGEST_INTERVAL)
+    connection.close()
+    results.put(("ingest", latencies, errors))
+
+def history(path, read_only, ready, stop, results):
+    """Roda as consultas de histórico em sequência até o fim do ingest"""
+    if read_only:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT)
+    else:
+        connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    ready.wait()
+    queries = 0
+    while not stop.is_set():
+        connection.execute(HISTORY_QUERIES[queries % len(HISTORY_QUERIES)]).fetchall()
+        queries += 1
+    connection.close()
+    results.put(("history", queries, 0))
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def run(label, journal_mode, readers, read_only, directory):
+    path = os.path.join(directory, f"contention_{journal_mode.lower()}.db")
+    if not os.path.exists(path):
+        build_database(path, journal_mode)
+
+    results = multiprocessing.Queue()
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=ingest, args=(path, journal_mode, ready, results))
+    workers = [multiprocessing.Process(target=history, args=(path, read_only, ready, stop, results))
+               for _ in range(readers)]
+    for process in [writer] + workers:
+        process.start()
+    ready.set()
+
+    # Os leitores só terminam depois do stop, então o primeiro resultado é o do ingest
+    _, latencies, errors = results.get()
+    stop.set()
+    queries = sum(results.get()[1] for _ in workers)
+    for process in [writer] + workers:
+        process.join()
+
+    print(f"\n{label}")
+    print(f"  ingest: {len(latencies)} commits  "
+          f"p50={statistics.median(latencies):8.2f} ms  "
+          f"p99={percentile(latencies, 0.99):8.2f} ms  "
+          f"máx={max(latencies):8.2f} ms  erros={errors}")
+    if readers:
+        print(f"  histórico: {queries} consultas em {readers} processos")
+
+def main():
+    print("Benchmark de contenção: ingest x consultas de histórico")
+    print("=" * 55)
+    print(f"Dispositivos: {DEVICES} | Dias: {DAYS} | Leitores: {READERS} | Duração: {DURATION:.0f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for label, journal_mode, readers, read_only in SCENARIOS:
+            run(label, journal_mode, readers, read_only, directory)
+
+if __name__ == "__main__":
+    main()
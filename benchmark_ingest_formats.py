@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos formatos de ingest (app/payloads.py)
+Compara tamanho por leitura e custo de decodificação por leitura de JSON,
+MessagePack e CBOR, com e sem gzip, para uma leitura avulsa e para um lote
+como o enviado por gateways
+"""
+
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+
+import cbor2  # noqa: E402
+import msgpack  # noqa: E402
+
+from payloads import decode_payload  # noqa: E402
+
+# Configurações
+BATCH_SIZE = 500
+MAX_DECODED = 16 * 1024 * 1024
+MIN_SECONDS = 1.0
+
+ENCODERS = {
+    "application/json": lambda body: json.dumps(body, separators=(",", ":")).encode(),
+    "application/msgpack": msgpack.packb,
+    "application/cbor": cbor2.dumps,
+}
+
+def make_reading(index, start):
+    return {
+        "temperature": round(random.uniform(15, 35), 1),
+        "humidity": round(random.uniform(30, 90), 1),
+        "device_id": "ESP8266_001",
+        "timestamp": start + index * 60,
+        "seq": index,
+    }
+
+def time_decode(data, mimetype, encoding):
+    """Tempo médio de decode_payload, repetindo até MIN_SECONDS"""
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        decode_payload(data, mimetype, encoding, MAX_DECODED)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SECONDS:
+            return elapsed / runs
+
+def report(title, body, readings):
+    print(f"\n{title} ({readings} leitura(s))")
+    print(f"  {'formato':24s} {'bytes/leitura':>14s} {'µs/leitura':>12s}")
+    for mimetype, encode in ENCODERS.items():
+        raw = encode(body)
+        for encoding, data in ((None, raw), ("gzip", gzip.compress(raw))):
+            seconds = time_decode(data, mimetype, encoding)
+            label = mimetype.split("/")[1] + (" + gzip" if encoding else "")
+            print(f"  {label:24s} {len(data) / readings:14.1f} {seconds * 1e6 / readings:12.2f}")
+
+def main():
+    print("Benchmark dos formatos de ingest")
+    print("=" * 50)
+    start = int(time.time()) - BATCH_SIZE * 60
+
+    report("Leitura avulsa (POST /api/sensor-data)", make_reading(0, start), 1)
+    batch = {"device_id": "ESP8266_001",
+             "readings": [make_reading(i, start) for i in range(BATCH_SIZE)]}
+    report("Lote (POST /api/sensor-data/batch)", batch, BATCH_SIZE)
+
+if __name__ == "__main__":
+    main()
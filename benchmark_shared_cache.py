@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark do cache compartilhado entre workers (app/shared_cache.py)
+Mede a latência de leitura da última leitura por dispositivo e dos agregados
+de 24h com 4 e 16 processos leitores, enquanto um processo escritor simula o
+ingest, e compara com a consulta equivalente no SQLite
+"""
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+
+from shared_cache import SharedCache  # noqa: E402
+
+# Configurações
+DEVICES = 50
+READINGS_PER_DEVICE = 1440
+WORKER_COUNTS = (4, 16)
+DURATION = 3.0
+
+LATEST_SQL = """
+SELECT s.id, s.device_id, s.timestamp, s.temperature, s.humidity
+FROM sensor_data s
+JOIN (SELECT device_id, MAX(timestamp) AS ts FROM sensor_data GROUP BY device_id) n
+  ON s.device_id = n.device_id AND s.timestamp = n.ts
+"""
+
+STATS_SQL = """
+SELECT AVG(temperature), MAX(temperature), MIN(temperature),
+       AVG(humidity), MAX(humidity), MIN(humidity), COUNT(id), MAX(timestamp)
+FROM sensor_data WHERE timestamp >= ?
+"""
+
+def build_database(path):
+    """Cria um SQLite com o mesmo schema/índices de sensor_data"""
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, temperature REAL, humidity REAL, "
+        "device_id TEXT, timestamp TEXT, seq INTEGER)"
+    )
+    connection.execute("CREATE UNIQUE INDEX ux_ts ON sensor_data (device_id, timestamp)")
+    start = datetime.utcnow() - timedelta(minutes=READINGS_PER_DEVICE)
+    rows = []
+    for device in range(DEVICES):
+        for minute in range(READINGS_PER_DEVICE):
+            timestamp = (start + timedelta(minutes=minute)).isoformat(sep=' ')
+            rows.append((random.uniform(15, 30), random.uniform(30, 80), f"BENCH_{device:03d}", timestamp))
+    connection.executemany(
+        "INSERT INTO sensor_data (temperature, humidity, device_id, timestamp) VALUES (?, ?, ?, ?)", rows
+    )
+    connection.commit()
+    connection.close()
+
+def db_stats(connection):
+    since = (datetime.utcnow() - timedelta(days=1)).isoformat(sep=' ')
+    row = connection.execute(STATS_SQL, (since,)).fetchone()
+    return {
+        'total_readings': row[6],
+        'temperature': {'avg': row[0], 'max': row[1], 'min': row[2]},
+        'humidity': {'avg': row[3], 'max': row[4], 'min': row[5]},
+        'last_update': datetime.fromisoformat(row[7]).isoformat()
+    }
+
+def writer(cache_path, stop):
+    """Simula o ingest: atualiza a última leitura de dispositivos aleatórios"""
+    cache = SharedCache(cache_path)
+    record_id = 10 ** 6
+    while not stop.is_set():
+        record_id += 1
+        device = random.randrange(DEVICES)
+        cache.update_latest(f"BENCH_{device:03d}", record_id, datetime.utcnow(),
+                            random.uniform(15, 30), random.uniform(30, 80))
+
+def reader(mode, cache_path, db_path, results):
+    """Lê /latest e /stats repetidamente e devolve as latências (µs)"""
+    cache = SharedCache(cache_path, stats_ttl=1.0)
+    connection = sqlite3.connect(db_path)
+    loader = lambda: db_stats(connection)  # noqa: E731
+    latest, stats = [], []
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if mode == "cache":
+            data = cache.latest_all()
+        else:
+            data = connection.execute(LATEST_SQL).fetchall()
+        latest.append((time.perf_counter() - started) * 1e6)
+        assert len(data) == DEVICES
+
+        started = time.perf_counter()
+        if mode == "cache":
+            cache.stats(loader)
+        else:
+            loader()
+        stats.append((time.perf_counter() - started) * 1e6)
+    connection.close()
+    results.put((latest, stats))
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def run(mode, workers, cache_path, db_path):
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    ingest = multiprocessing.Process(target=writer, args=(cache_path, stop))
+    ingest.start()
+    readers = [multiprocessing.Process(target=reader, args=(mode, cache_path, db_path, results))
+               for _ in range(workers)]
+    for process in readers:
+        process.start()
+    latest, stats = [], []
+    for _ in readers:
+        worker_latest, worker_stats = results.get()
+        latest.extend(worker_latest)
+        stats.extend(worker_stats)
+    for process in readers:
+        process.join()
+    stop.set()
+    ingest.join()
+
+    label = "mmap compartilhado" if mode == "cache" else "SQLite"
+    print(f"\n{label} - {workers} workers ({len(latest)} leituras em {DURATION:.0f}s)")
+    for name, samples in (("/latest", latest), ("/stats", stats)):
+        print(f"  {name:8s} p50={statistics.median(samples):9.1f} µs  "
+              f"p99={percentile(samples, 0.99):9.1f} µs  "
+              f"vazão={len(samples) / DURATION:10.0f} ops/s")
+
+def main():
+    print("Benchmark do cache compartilhado entre workers")
+    print("=" * 50)
+    print(f"Dispositivos: {DEVICES} | Leituras por dispositivo: {READINGS_PER_DEVICE}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "bench.db")
+        cache_path = os.path.join(directory, "hot_cache.bin")
+        build_database(db_path)
+
+        connection = sqlite3.connect(db_path)
+        cache = SharedCache(cache_path)
+        cache.rebuild(
+            (row[0], row[1], datetime.fromisoformat(row[2]), row[3], row[4])
+            for row in connection.execute(LATEST_SQL)
+        )
+        connection.close()
+
+        for workers in WORKER_COUNTS:
+            run("cache", workers, cache_path, db_path)
+            run("db", workers, cache_path, db_path)
+
+if __name__ == "__main__":
+    main()
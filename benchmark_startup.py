@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark do tempo de inicialização de um worker
+Mede quanto tempo um processo novo leva para importar app.py, como acontece
+a cada worker do gunicorn (inclusive nas reciclagens de --max-requests)
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# Configurações
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+RUNS = 10
+TOP_IMPORTS = 10
+
+def time_import():
+    """Mede o tempo de parede de um processo que apenas importa o app"""
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import app"],
+        cwd=APP_DIR,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - started
+
+def baseline_interpreter():
+    """Tempo de um interpretador vazio, para descontar do resultado"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - started
+
+def slowest_imports():
+    """Lista os módulos mais caros usando -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=APP_DIR,
+        check=True,
+        capture_output=True,
+        text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            entries.append((int(match.group(2)), match.group(4).strip()))
+    entries.sort(reverse=True)
+    return entries[:TOP_IMPORTS]
+
+def main():
+    print("Benchmark de inicialização do worker")
+    print("=" * 50)
+
+    base = statistics.median(baseline_interpreter() for _ in range(3))
+    samples = sorted(time_import() for _ in range(RUNS))
+
+    print(f"Execuções: {RUNS}")
+    print(f"Interpretador vazio: {base * 1000:.1f} ms")
+    print(f"Importar app (mediana): {statistics.median(samples) * 1000:.1f} ms")
+    print(f"Importar app (máximo): {samples[-1] * 1000:.1f} ms")
+    print(f"Custo do app (mediana - vazio): {(statistics.median(samples) - base) * 1000:.1f} ms")
+
+    print("\nImportações mais caras (cumulativo):")
+    for micros, module in slowest_imports():
+        print(f"  {micros / 1000:8.1f} ms  {module}")
+
+if __name__ == "__main__":
+    main()
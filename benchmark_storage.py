@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark do layout de armazenamento de sensor_data (SENSOR_STORAGE)
+Compara o layout padrão (floats, device_id em texto, timestamp ISO em texto)
+com o compacto (centésimos em inteiro, devices.id, microssegundos desde a
+epoch): tamanho do arquivo, de cada tabela/índice e tempo das varreduras
+típicas dos endpoints de estatísticas e relatórios
+"""
+
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Configurações
+DEVICES = 20
+DAYS = 14
+INTERVAL = 60
+REPEAT = 5
+# IDs no formato real dos dispositivos (a string se repete em cada linha e índice)
+DEVICE_PREFIX = "ESP8266_MONITOR_"
+
+EPOCH = datetime(1970, 1, 1)
+
+# Mesmo schema e índices dos modelos em cada layout
+SCHEMAS = {
+    "standard": (
+        "CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, temperature FLOAT NOT NULL, "
+        "humidity FLOAT NOT NULL, device_id VARCHAR(50) NOT NULL, timestamp DATETIME NOT NULL, seq INTEGER)",
+        "CREATE UNIQUE INDEX ux_sensor_data_device_seq ON sensor_data (device_id, seq)",
+        "CREATE UNIQUE INDEX ux_sensor_data_device_timestamp ON sensor_data (device_id, timestamp)",
+        "CREATE INDEX ix_sensor_data_timestamp ON sensor_data (timestamp)",
+    ),
+    "compact": (
+        "CREATE TABLE sensor_data (id INTEGER PRIMARY KEY, temperature SMALLINT NOT NULL, "
+        "humidity SMALLINT NOT NULL, device_ref INTEGER NOT NULL, timestamp BIGINT NOT NULL, seq INTEGER)",
+        "CREATE UNIQUE INDEX ux_sensor_data_device_seq ON sensor_data (device_ref, seq)",
+        "CREATE UNIQUE INDEX ux_sensor_data_device_timestamp ON sensor_data (device_ref, timestamp)",
+        "CREATE INDEX ix_sensor_data_timestamp ON sensor_data (timestamp)",
+    ),
+}
+
+# (rótulo, SQL padrão, SQL compacto); parâmetros: início da janela (texto, µs)
+QUERIES = (
+    ("agregados 24h (todos)",
+     "SELECT AVG(temperature), MAX(temperature), MIN(temperature), AVG(humidity), COUNT(*) "
+     "FROM sensor_data WHERE timestamp >= :since_text",
+     "SELECT AVG(temperature) / 100.0, MAX(temperature) / 100.0, MIN(temperature) / 100.0, "
+     "AVG(humidity) / 100.0, COUNT(*) FROM sensor_data WHERE timestamp >= :since_micros"),
+    ("agregados 24h (1 dispositivo)",
+     "SELECT AVG(temperature), MAX(temperature), MIN(temperature), COUNT(*) FROM sensor_data "
+     "WHERE device_id = :device AND timestamp >= :since_text",
+     "SELECT AVG(temperature) / 100.0, MAX(temperature) / 100.0, MIN(temperature) / 100.0, COUNT(*) "
+     "FROM sensor_data WHERE device_ref = (SELECT id FROM devices WHERE device_id = :device) "
+     "AND timestamp >= :since_micros"),
+    ("contagem por dispositivo (tudo)",
+     "SELECT device_id, COUNT(*), MIN(timestamp), MAX(timestamp) FROM sensor_data GROUP BY device_id",
+     "SELECT (SELECT device_id FROM devices WHERE id = device_ref), COUNT(*), MIN(timestamp), "
+     "MAX(timestamp) FROM sensor_data GROUP BY device_ref"),
+    ("varredura completa da tabela",
+     "SELECT SUM(temperature), SUM(humidity), COUNT(DISTINCT device_id) FROM sensor_data",
+     "SELECT SUM(temperature) / 100.0, SUM(humidity) / 100.0, COUNT(DISTINCT device_ref) FROM sensor_data"),
+)
+
+
+def to_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def generate(start):
+    """Leituras (device_id, timestamp, temperatura, umidade) com 1 casa decimal, como o DHT22"""
+    readings = []
+    for device in range(DEVICES):
+        device_id = f"{DEVICE_PREFIX}{device:03d}"
+        for index in range(DAYS * 86400 // INTERVAL):
+            timestamp = start + timedelta(seconds=index * INTERVAL, microseconds=random.randrange(1000000))
+            readings.append((device_id, timestamp, round(random.uniform(15, 30), 1),
+                             round(random.uniform(30, 80), 1)))
+    return readings
+
+
+def build(path, layout, readings):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE devices (id INTEGER PRIMARY KEY, device_id VARCHAR(50) UNIQUE NOT NULL)")
+    connection.executemany("INSERT INTO devices (device_id) VALUES (?)",
+                           [(f"{DEVICE_PREFIX}{device:03d}",) for device in range(DEVICES)])
+    for statement in SCHEMAS[layout]:
+        connection.execute(statement)
+
+    if layout == "standard":
+        rows = ((temperature, humidity, device_id, timestamp.isoformat(sep=" ", timespec="microseconds"))
+                for device_id, timestamp, temperature, humidity in readings)
+        sql = "INSERT INTO sensor_data (temperature, humidity, device_id, timestamp) VALUES (?, ?, ?, ?)"
+    else:
+        devices = dict(connection.execute("SELECT device_id, id FROM devices"))
+        rows = ((int(round(temperature * 100)), int(round(humidity * 100)), devices[device_id],
+                 to_micros(timestamp))
+                for device_id, timestamp, temperature, humidity in readings)
+        sql = "INSERT INTO sensor_data (temperature, humidity, device_ref, timestamp) VALUES (?, ?, ?, ?)"
+    connection.executemany(sql, rows)
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def object_sizes(path):
+    """{tabela/índice: bytes} via dbstat (None se o SQLite não tiver a extensão)"""
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat WHERE name LIKE '%sensor_data%' GROUP BY name"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = None
+    connection.close()
+    return dict(rows) if rows is not None else None
+
+
+def time_queries(path, layout, since):
+    connection = sqlite3.connect(path)
+    params = {"since_text": since.isoformat(sep=" ", timespec="microseconds"),
+              "since_micros": to_micros(since), "device": f"{DEVICE_PREFIX}007"}
+    timings = {}
+    for label, standard_sql, compact_sql in QUERIES:
+        sql = standard_sql if layout == "standard" else compact_sql
+        samples = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            connection.execute(sql, params).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[label] = statistics.median(samples)
+    connection.close()
+    return timings
+
+
+def megabytes(size):
+    return f"{size / 1e6:8.2f} MB"
+
+
+def main():
+    print("Benchmark de armazenamento: layout padrão x compacto")
+    print("=" * 55)
+    print(f"Dispositivos: {DEVICES} | Dias: {DAYS} | Intervalo: {INTERVAL}s")
+
+    start = datetime.utcnow() - timedelta(days=DAYS)
+    readings = generate(start)
+    print(f"Leituras: {len(readings)}")
+    since = datetime.utcnow() - timedelta(hours=24)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for layout in SCHEMAS:
+            path = os.path.join(directory, f"{layout}.db")
+            build(path, layout, readings)
+            results[layout] = (os.path.getsize(path), object_sizes(path), time_queries(path, layout, since))
+
+    standard_size, standard_objects, standard_times = results["standard"]
+    compact_size, compact_objects, compact_times = results["compact"]
+
+    print(f"\n{'Tamanho':32} {'padrão':>11} {'compacto':>11} {'redução':>8}")
+    print(f"{'arquivo':32} {megabytes(standard_size)} {megabytes(compact_size)} "
+          f"{1 - compact_size / standard_size:8.0%}")
+    if standard_objects and compact_objects:
+        for name in sorted(standard_objects):
+            before, after = standard_objects[name], compact_objects.get(name, 0)
+            print(f"{name:32} {megabytes(before)} {megabytes(after)} {1 - after / before:8.0%}")
+        print(f"  {standard_objects['sensor_data'] / len(readings):.1f} -> "
+              f"{compact_objects['sensor_data'] / len(readings):.1f} bytes por linha na tabela")
+
+    print(f"\n{'Consulta (mediana de %d)' % REPEAT:32} {'padrão':>11} {'compacto':>11} {'ganho':>8}")
+    for label in standard_times:
+        before, after = standard_times[label], compact_times[label]
+        print(f"{label:32} {before:8.1f} ms {after:8.1f} ms {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Script para testar o envio de leituras atrasadas e fora de ordem
+Simula um dispositivo que volta de deep sleep/queda de rede e descarrega o
+buffer em lotes embaralhados para /api/sensor-data/batch, e confere que as
+leituras ficam em ordem, que reenvios são ignorados e que as estatísticas
+contam cada leitura uma única vez
+
+Os lotes são cobrados por leitura no limite de ingestão: rode o servidor com
+INGEST_RATE_PER_DEVICE=0 (ou um valor alto) para não receber 429.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+# Configurações
+BASE_URL = "http://localhost:5005/api"
+DEVICE_ID = "ESP8266_BACKFILL"
+HEADERS = {"X-API-Key": "esp8266-dht22-key"}
+HOURS = 6           # horas de leituras guardadas no buffer
+INTERVAL = 60       # segundos entre leituras
+BATCH_SIZE = 250
+OFFLINE_FOR = 2     # horas entre a última leitura do buffer e agora
+
+
+def post(path, payload):
+    """POST com nova tentativa quando o limite do dispositivo responde 429/503"""
+    for _ in range(10):
+        response = requests.post(f"{BASE_URL}{path}", json=payload, headers=HEADERS, timeout=30)
+        if response.status_code not in (429, 503):
+            return response
+        time.sleep(float(response.json().get("retry_after", 1)))
+    return response
+
+
+def generate_readings():
+    """Leituras de HOURS horas terminando OFFLINE_FOR horas atrás, embaralhadas"""
+    end = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(hours=OFFLINE_FOR)
+    readings = []
+    for index in range(HOURS * 3600 // INTERVAL):
+        timestamp = end - timedelta(seconds=index * INTERVAL)
+        readings.append({
+            "device_id": DEVICE_ID,
+            "temperature": round(random.uniform(18, 30), 1),
+            "humidity": round(random.uniform(40, 80), 1),
+            "timestamp": timestamp.isoformat()
+        })
+    random.shuffle(readings)
+    return readings
+
+
+def send_batches(readings):
+    """Envia os lotes; retorna (inseridas, duplicadas)"""
+    inserted = duplicates = 0
+    for start in range(0, len(readings), BATCH_SIZE):
+        response = post("/sensor-data/batch", readings[start:start + BATCH_SIZE])
+        if response.status_code != 200:
+            print(f"❌ Erro HTTP {response.status_code}: {response.text}")
+            return None
+        result = response.json()
+        inserted += result["inserted"]
+        duplicates += result["duplicates"]
+    return inserted, duplicates
+
+
+def check_backfill(readings):
+    print(f"\n📡 Enviando {len(readings)} leituras embaralhadas em lotes de {BATCH_SIZE}...")
+    result = send_batches(readings)
+    if result is None:
+        return False
+    inserted, duplicates = result
+    print(f"   Inseridas: {inserted} | Duplicadas: {duplicates}")
+    return inserted + duplicates == len(readings)
+
+
+def check_resend(readings):
+    print("\n🔁 Reenviando o mesmo buffer em outra ordem...")
+    shuffled = list(readings)
+    random.shuffle(shuffled)
+    result = send_batches(shuffled)
+    if result is None:
+        return False
+    inserted, duplicates = result
+    print(f"   Inseridas: {inserted} | Duplicadas: {duplicates}")
+    if inserted:
+        print("❌ Reenvio gravou leituras repetidas")
+        return False
+    print("✅ Reenvio ignorado")
+    return True
+
+
+def check_single_late_reading():
+    print("\n⏪ Enviando uma leitura avulsa mais antiga que a última do dispositivo...")
+    timestamp = datetime.now(timezone.utc) - timedelta(hours=OFFLINE_FOR + HOURS, seconds=30)
+    response = post("/sensor-data", {
+        "device_id": DEVICE_ID, "temperature": 21.0, "humidity": 55.0,
+        "timestamp": timestamp.isoformat()
+    })
+    if response.status_code != 200:
+        print(f"❌ Erro HTTP {response.status_code}: {response.text}")
+        return False
+    print(f"✅ {response.json().get('message')}")
+    return True
+
+
+def check_order(expected):
+    print("\n📋 Conferindo a ordem das leituras gravadas...")
+    response = requests.get(f"{BASE_URL}/sensor-data",
+                            params={"device_id": DEVICE_ID, "limit": expected}, timeout=30)
+    data = response.json().get("data", [])
+    timestamps = [row["timestamp"] for row in data]
+    if timestamps != sorted(timestamps, reverse=True):
+        print("❌ Leituras fora de ordem na resposta")
+        return False
+    if len(set(timestamps)) != len(timestamps):
+        print("❌ Timestamps repetidos na resposta")
+        return False
+    print(f"✅ {len(timestamps)} leituras em ordem decrescente, sem repetição")
+    return True
+
+
+def check_stats(expected):
+    print("\n📊 Conferindo as estatísticas do dispositivo...")
+    hours = HOURS + OFFLINE_FOR + 1
+    response = requests.get(f"{BASE_URL}/devices/{DEVICE_ID}/stats", params={"hours": hours}, timeout=30)
+    if response.status_code != 200:
+        print(f"❌ Erro HTTP {response.status_code}: {response.text}")
+        return False
+    total = response.json()["data"]["total_readings"]
+    print(f"   Leituras nas últimas {hours}h: {total} (esperado: {expected})")
+    return total == expected
+
+
+def main():
+    print("⏪ Teste de Leituras Atrasadas e Fora de Ordem")
+    print("=" * 50)
+    print(f"Dispositivo: {DEVICE_ID}")
+    print("Use um dispositivo sem outras leituras (ou apague-o antes)")
+
+    readings = generate_readings()
+    results = [
+        check_backfill(readings),
+        check_resend(readings),
+        check_single_late_reading(),
+    ]
+    expected = len(readings) + 1
+    results.append(check_order(expected))
+    results.append(check_stats(expected))
+
+    print("\n" + "=" * 50)
+    if all(results):
+        print("✅ Todos os testes passaram!")
+    else:
+        print(f"❌ {results.count(False)} teste(s) falharam")
+
+
+if __name__ == "__main__":
+    main()